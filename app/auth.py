@@ -1,12 +1,18 @@
+import hmac
+import logging
 import os
+import threading
+import time
 import unittest
 from unittest.mock import patch
 from flask_httpauth import HTTPTokenAuth
 import jwt
 
-from app.config import VERIFY_JWT_SIGNATURE
+from app.config import STATUS_TOKEN, VERIFY_JWT_SIGNATURE
 
 auth = HTTPTokenAuth(scheme="Bearer")
+# Protects the status endpoints that show internals of the workers
+status_auth = HTTPTokenAuth(scheme="Bearer")
 
 PROFILE_TYPE_PRIVATE = "private"
 PROFILE_TYPE_COMMERCIAL = "commercial"
@@ -16,6 +22,10 @@ OIDC_CLIENT_ID_DIGID = os.getenv("OIDC_CLIENT_ID_DIGID", "digid")
 OIDC_CLIENT_ID_EHERKENNING = os.getenv("OIDC_CLIENT_ID_EHERKENNING", "eherkenning")
 OIDC_CLIENT_ID_YIVI = os.getenv("OIDC_CLIENT_ID_YIVI", "yivi")
 OIDC_JWKS_URL = os.getenv("OIDC_JWKS_URL", "")
+OIDC_JWKS_REFRESH_SECONDS = int(os.getenv("OIDC_JWKS_REFRESH_SECONDS", 60 * 5))
+OIDC_JWKS_MIN_REFETCH_SECONDS = int(os.getenv("OIDC_JWKS_MIN_REFETCH_SECONDS", 10))
+# Well below the uwsgi harakiri, other requests with an unknown kid wait for the fetch
+OIDC_JWKS_TIMEOUT_SECONDS = int(os.getenv("OIDC_JWKS_TIMEOUT_SECONDS", 5))
 
 TOKEN_ID_ATTRIBUTE_EHERKENNING = "urn:etoegang:1.9:EntityConcernedID:KvKnr"
 
@@ -66,6 +76,7 @@ TokenAttributeByProfileType = {
 }
 
 login_required = auth.login_required
+status_login_required = status_auth.login_required
 
 
 class AuthError(Exception):
@@ -100,9 +111,95 @@ def get_profile_id(token_data):
     return token_data[id_attribute]
 
 
+class SigningKeyStore:
+    def __init__(
+        self,
+        jwks_url,
+        refresh_interval=OIDC_JWKS_REFRESH_SECONDS,
+        min_refetch_interval=OIDC_JWKS_MIN_REFETCH_SECONDS,
+        timeout=OIDC_JWKS_TIMEOUT_SECONDS,
+    ):
+        self.jwks_client = jwt.PyJWKClient(
+            jwks_url, cache_jwk_set=False, timeout=timeout
+        )
+        self.refresh_interval = refresh_interval
+        self.min_refetch_interval = min_refetch_interval
+
+        self.keys = {}
+        self.last_fetched = None
+        # Also set when the fetch fails, an unreachable JWKS endpoint is not asked on every request
+        self.last_attempted = None
+
+        self._lock = threading.Lock()
+        self._refresh_thread_pid = None
+
+    def refresh(self):
+        self.last_attempted = time.monotonic()
+        jwk_set = jwt.PyJWKSet.from_dict(self.jwks_client.fetch_data())
+
+        # Replace the whole dict at once so readers never see a partial key set
+        self.keys = {
+            jwk.key_id: jwk
+            for jwk in jwk_set.keys
+            if jwk.public_key_use in ["sig", None] and jwk.key_id
+        }
+        self.last_fetched = time.monotonic()
+
+    def can_refetch(self):
+        return (
+            self.last_attempted is None
+            or time.monotonic() - self.last_attempted >= self.min_refetch_interval
+        )
+
+    def refresh_periodically(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                with self._lock:
+                    self.refresh()
+            except Exception as error:
+                logging.error(f"Refreshing JWKS failed: {error}")
+
+    def start_refresh_thread(self):
+        # Threads do not survive the uwsgi fork, start one in every worker.
+        if self._refresh_thread_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._refresh_thread_pid != os.getpid():
+                self._refresh_thread_pid = os.getpid()
+                threading.Thread(target=self.refresh_periodically, daemon=True).start()
+
+    def get_signing_key(self, kid):
+        self.start_refresh_thread()
+
+        signing_key = self.keys.get(kid)
+
+        if signing_key is None:
+            with self._lock:
+                signing_key = self.keys.get(kid)
+                # Unknown kid, the keys might have been rotated. Refetch at most once per interval.
+                if signing_key is None and self.can_refetch():
+                    self.refresh()
+                    signing_key = self.keys.get(kid)
+
+        if signing_key is None:
+            raise jwt.PyJWKClientError(
+                f'Unable to find a signing key that matches: "{kid}"'
+            )
+
+        return signing_key
+
+    def get_signing_key_from_jwt(self, token):
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get("kid"))
+
+
+signing_key_store = SigningKeyStore(OIDC_JWKS_URL)
+
+
 def get_verified_token_data(token):
-    jwks_client = jwt.PyJWKClient(OIDC_JWKS_URL)
-    signing_key = jwks_client.get_signing_key_from_jwt(token)
+    signing_key = signing_key_store.get_signing_key_from_jwt(token)
 
     audience = [
         get_client_id(PROFILE_TYPE_PRIVATE),
@@ -138,6 +235,13 @@ def verify_token(token):
     return get_user_profile_from_token(token)
 
 
+@status_auth.verify_token
+def verify_status_token(token):
+    if not STATUS_TOKEN or not token:
+        return None
+    return hmac.compare_digest(token, STATUS_TOKEN)
+
+
 def get_current_user():
     return auth.current_user()
 
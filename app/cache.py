@@ -0,0 +1,475 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+def create_cache_key(operation, bsn, post_message, secret):
+    # No BSN's in memory, on disk or in Redis as plain text. Keyed, a plain hash of a BSN is reversed by trying
+    # all of them.
+    key_source = json.dumps([operation, str(bsn), post_message], sort_keys=True)
+    return hmac.new(secret, key_source.encode(), hashlib.sha256).hexdigest()
+
+
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, value_bytes, ttl):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+    def stats(self):
+        return {}
+
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_entries, max_bytes, purge_interval=1):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.purge_interval = purge_interval
+
+        # key -> (expires_at, value_bytes), ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.size = 0
+
+        self.evictions = 0
+        self.expirations = 0
+
+        self._lock = threading.Lock()
+        self._purge_thread_pid = None
+
+    def _remove(self, key):
+        _, value_bytes = self.entries.pop(key)
+        self.size -= len(value_bytes)
+
+    def get(self, key):
+        self.start_purge_thread()
+
+        with self._lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            expires_at, value_bytes = entry
+
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+
+            self.entries.move_to_end(key)
+
+        return value_bytes
+
+    def set(self, key, value_bytes, ttl):
+        self.start_purge_thread()
+
+        if len(value_bytes) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (time.monotonic() + ttl, value_bytes)
+            self.size += len(value_bytes)
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def purge_expired(self):
+        now = time.monotonic()
+
+        with self._lock:
+            expired_keys = [
+                key
+                for key, (expires_at, _) in self.entries.items()
+                if expires_at <= now
+            ]
+            for key in expired_keys:
+                self._remove(key)
+
+            self.expirations += len(expired_keys)
+
+        return len(expired_keys)
+
+    def purge_periodically(self):
+        while True:
+            time.sleep(self.purge_interval)
+            try:
+                self.purge_expired()
+            except Exception as error:
+                logging.error(f"Purging cache failed: {error}")
+
+    def start_purge_thread(self):
+        # Threads do not survive the uwsgi fork, start one in every worker.
+        if self._purge_thread_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._purge_thread_pid != os.getpid():
+                self._purge_thread_pid = os.getpid()
+                threading.Thread(target=self.purge_periodically, daemon=True).start()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteCacheBackend(CacheBackend):
+    # A single database file shared by all uwsgi workers on a node.
+
+    def __init__(self, path, max_entries, max_bytes, purge_interval=1):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.purge_interval = purge_interval
+        self.last_purged = 0
+
+        self.evictions = 0
+
+        self._local = threading.local()
+
+        with self.connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL, accessed_at REAL)"
+            )
+
+            # Files created before entries were evicted by last access
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(cache)")]
+            if "accessed_at" not in columns:
+                try:
+                    connection.execute(
+                        "ALTER TABLE cache ADD COLUMN accessed_at REAL DEFAULT 0"
+                    )
+                except sqlite3.OperationalError as error:
+                    # Added by another worker in the meantime
+                    if "duplicate column" not in str(error):
+                        raise
+
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+            )
+
+    def connection(self):
+        # Connections can not be shared between threads or forked processes
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def get(self, key):
+        now = time.time()
+
+        # Marks the entry as recently used in the same statement
+        with self.connection() as connection:
+            rows = connection.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ? AND expires_at > ? RETURNING value",
+                (now, key, now),
+            ).fetchall()
+
+        return rows[0][0] if rows else None
+
+    def set(self, key, value_bytes, ttl):
+        if len(value_bytes) > self.max_bytes:
+            return
+
+        now = time.time()
+
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value_bytes, now + ttl, now),
+            )
+
+        if time.monotonic() - self.last_purged > self.purge_interval:
+            self.purge()
+
+    def purge(self):
+        self.last_purged = time.monotonic()
+
+        with self.connection() as connection:
+            connection.execute(
+                "DELETE FROM cache WHERE expires_at <= ?", (time.time(),)
+            )
+
+            # Evict the least recently used entries, the running totals start at the most recently used entry
+            cursor = connection.execute(
+                """
+                DELETE FROM cache WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, COUNT(*) OVER recent AS entries, SUM(LENGTH(value)) OVER recent AS size
+                        FROM cache
+                        WINDOW recent AS (ORDER BY accessed_at DESC, rowid DESC ROWS UNBOUNDED PRECEDING)
+                    )
+                    WHERE entries > ? OR size > ?
+                )
+                """,
+                (self.max_entries, self.max_bytes),
+            )
+            self.evictions += cursor.rowcount
+
+    def delete(self, key):
+        with self.connection() as connection:
+            connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self.connection() as connection:
+            connection.execute("DELETE FROM cache")
+
+    def stats(self):
+        (entries, size) = (
+            self.connection()
+            .execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache")
+            .fetchone()
+        )
+        return {"entries": entries, "bytes": size, "evictions": self.evictions}
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCacheBackend(CacheBackend):
+    # Minimal client for the Redis protocol (RESP), only supports the commands the cache needs.
+
+    def __init__(self, url, key_prefix="wmoned:", timeout=1):
+        url_parsed = urlparse(url)
+
+        self.host = url_parsed.hostname or "localhost"
+        self.port = url_parsed.port or 6379
+        self.password = url_parsed.password
+        self.db = int(url_parsed.path.lstrip("/") or 0)
+        self.use_ssl = url_parsed.scheme == "rediss"
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+
+        self._socket = None
+        self._reader = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        connection = socket.create_connection((self.host, self.port), self.timeout)
+
+        if self.use_ssl:
+            connection = ssl.create_default_context().wrap_socket(
+                connection, server_hostname=self.host
+            )
+
+        self._socket = connection
+        self._reader = connection.makefile("rb")
+        self._pid = os.getpid()
+
+        if self.password:
+            self._execute("AUTH", self.password)
+        if self.db:
+            self._execute("SELECT", self.db)
+
+    def disconnect(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+
+        self._socket = None
+        self._reader = None
+
+    def encode_command(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(f"${len(arg)}\r\n".encode())
+            parts.append(arg)
+            parts.append(b"\r\n")
+
+        return b"".join(parts)
+
+    def read_reply(self):
+        line = self._reader.readline()
+
+        if not line:
+            raise ConnectionError("Connection closed by server")
+
+        reply_type, value = line[:1], line[1:-2]
+
+        if reply_type == b"+":
+            return value.decode()
+        if reply_type == b"-":
+            raise RedisError(value.decode())
+        if reply_type == b":":
+            return int(value)
+        if reply_type == b"$":
+            length = int(value)
+            if length == -1:
+                return None
+            return self._reader.read(length + 2)[:-2]
+        if reply_type == b"*":
+            length = int(value)
+            if length == -1:
+                return None
+            return [self.read_reply() for _ in range(length)]
+
+        raise RedisError(f"Unknown reply type {reply_type}")
+
+    def _execute(self, *args):
+        self._socket.sendall(self.encode_command(*args))
+        return self.read_reply()
+
+    def execute(self, *args):
+        with self._lock:
+            if self._socket is None or self._pid != os.getpid():
+                self.connect()
+
+            try:
+                return self._execute(*args)
+            except (OSError, ConnectionError):
+                # Reconnect once, the server might have closed an idle connection
+                self.disconnect()
+                self.connect()
+                return self._execute(*args)
+
+    def get(self, key):
+        return self.execute("GET", self.key_prefix + key)
+
+    def set(self, key, value_bytes, ttl):
+        self.execute("SET", self.key_prefix + key, value_bytes, "PX", int(ttl * 1000))
+
+    def delete(self, key):
+        self.execute("DEL", self.key_prefix + key)
+
+    def clear(self):
+        keys = self.execute("KEYS", self.key_prefix + "*")
+        if keys:
+            self.execute("DEL", *keys)
+
+
+def create_cache_backend(
+    backend_name, max_entries, max_bytes, sqlite_path=None, redis_url=None
+):
+    if backend_name == "sqlite":
+        return SQLiteCacheBackend(
+            sqlite_path, max_entries=max_entries, max_bytes=max_bytes
+        )
+    if backend_name == "redis":
+        return RedisCacheBackend(redis_url)
+    return MemoryCacheBackend(max_entries=max_entries, max_bytes=max_bytes)
+
+
+class Cache:
+    def __init__(self, backend, ttl, encryptor=None, max_stale=0):
+        self.backend = backend
+        self.ttl = ttl
+        # Any object with encrypt(bytes) and decrypt(bytes) methods, e.g. Fernet
+        self.encryptor = encryptor
+        # Expired entries are kept this much longer so they can be served while being refreshed
+        self.max_stale = max_stale
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def serialize(self, value):
+        value_bytes = json.dumps([time.time(), value]).encode()
+        if self.encryptor:
+            value_bytes = self.encryptor.encrypt(value_bytes)
+        return value_bytes
+
+    def deserialize(self, value_bytes):
+        if self.encryptor:
+            value_bytes = self.encryptor.decrypt(value_bytes)
+        return json.loads(value_bytes)
+
+    def get_stale(self, key):
+        # A failing cache should never fail the request, treat it as a miss.
+        try:
+            value_bytes = self.backend.get(key)
+            entry = None if value_bytes is None else self.deserialize(value_bytes)
+        except Exception as error:
+            logging.error(f"Cache get failed: {error}")
+            self.errors += 1
+            entry = None
+
+        if entry is not None:
+            stored_at, value = entry
+            age = time.time() - stored_at
+
+            if age <= self.ttl:
+                self.hits += 1
+                return value, False
+
+            if age <= self.ttl + self.max_stale:
+                self.stale_hits += 1
+                return value, True
+
+        self.misses += 1
+        return None, False
+
+    def get(self, key):
+        value, is_stale = self.get_stale(key)
+        return None if is_stale else value
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, self.serialize(value), self.ttl + self.max_stale)
+        except Exception as error:
+            logging.error(f"Cache set failed: {error}")
+            self.errors += 1
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "staleHits": self.stale_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            **self.backend.stats(),
+        }
@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import deque
+
+from app import metrics
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+STATES = [STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN]
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        window_size=20,
+        min_calls=10,
+        error_rate_threshold=0.5,
+        slow_call_seconds=5,
+        slow_call_rate_threshold=0.5,
+        open_seconds=5,
+        max_open_seconds=60,
+        half_open_probes=1,
+    ):
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = STATE_CLOSED
+        # Outcomes of the most recent calls as (is_error, is_slow)
+        self.outcomes = deque(maxlen=window_size)
+        self.opened_at = None
+        # Doubled after every failed probe, reset when the circuit closes
+        self.current_open_seconds = open_seconds
+        self.probes_in_flight = 0
+        self.probes_succeeded = 0
+        # Incremented on every transition, the outcome of a call admitted in an earlier state is ignored
+        self.generation = 0
+
+        self.transitions = {}
+        self.rejected = 0
+
+        self._lock = threading.Lock()
+
+        self.report_state()
+
+    def report_state(self):
+        for state in STATES:
+            metrics.set_gauge(
+                "wmoned_circuit_breaker_state", int(state == self.state), state=state
+            )
+
+    def _transition(self, state):
+        transition = f"{self.state}->{state}"
+        self.transitions[transition] = self.transitions.get(transition, 0) + 1
+        metrics.inc(
+            "wmoned_circuit_breaker_transitions_total",
+            from_state=self.state,
+            to_state=state,
+        )
+        self.state = state
+        self.generation += 1
+        self.report_state()
+
+        if state == STATE_OPEN:
+            self.opened_at = time.monotonic()
+        elif state == STATE_HALF_OPEN:
+            self.probes_in_flight = 0
+            self.probes_succeeded = 0
+        elif state == STATE_CLOSED:
+            self.outcomes.clear()
+            self.current_open_seconds = self.open_seconds
+
+    def before_call(self):
+        with self._lock:
+            if (
+                self.state == STATE_OPEN
+                and time.monotonic() - self.opened_at >= self.current_open_seconds
+            ):
+                self._transition(STATE_HALF_OPEN)
+
+            if self.state == STATE_OPEN or (
+                self.state == STATE_HALF_OPEN
+                and self.probes_in_flight >= self.half_open_probes
+            ):
+                self.rejected += 1
+                raise CircuitOpenError("Circuit breaker is open")
+
+            if self.state == STATE_HALF_OPEN:
+                self.probes_in_flight += 1
+
+            return self.generation
+
+    def record(self, generation, duration, is_error):
+        is_slow = duration >= self.slow_call_seconds
+
+        with self._lock:
+            if generation != self.generation:
+                return
+
+            if self.state == STATE_HALF_OPEN:
+                self.probes_in_flight -= 1
+
+                if is_error or is_slow:
+                    self.current_open_seconds = min(
+                        self.current_open_seconds * 2, self.max_open_seconds
+                    )
+                    self._transition(STATE_OPEN)
+                else:
+                    self.probes_succeeded += 1
+                    if self.probes_succeeded >= self.half_open_probes:
+                        self._transition(STATE_CLOSED)
+                return
+
+            self.outcomes.append((is_error, is_slow))
+
+            if len(self.outcomes) < self.min_calls:
+                return
+
+            error_rate = sum(outcome[0] for outcome in self.outcomes) / len(
+                self.outcomes
+            )
+            slow_call_rate = sum(outcome[1] for outcome in self.outcomes) / len(
+                self.outcomes
+            )
+
+            if (
+                error_rate >= self.error_rate_threshold
+                or slow_call_rate >= self.slow_call_rate_threshold
+            ):
+                self._transition(STATE_OPEN)
+
+    def call(self, fn, *args, is_error=None, **kwargs):
+        generation = self.before_call()
+
+        start = time.monotonic()
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record(generation, time.monotonic() - start, True)
+            raise
+
+        self.record(
+            generation, time.monotonic() - start, bool(is_error and is_error(result))
+        )
+
+        return result
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "transitions": dict(self.transitions),
+            "rejected": self.rejected,
+        }
@@ -7,6 +7,8 @@ import tempfile
 
 from flask.json.provider import DefaultJSONProvider
 
+from app.logs import setup_logging
+
 BASE_PATH = os.path.abspath(os.path.dirname(__file__))
 
 # Sentry configuration.
@@ -29,13 +31,130 @@ VERIFY_JWT_SIGNATURE = os.getenv("VERIFY_JWT_SIGNATURE", IS_AP)
 
 # ZORGNED specific config
 ZORGNED_API_REQUEST_TIMEOUT_SECONDS = 30
+ZORGNED_API_CONNECT_TIMEOUT_SECONDS = 5
+
+# Time budget of a request, stays below the uwsgi harakiri of 20 seconds so we can respond before the worker is killed.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", 18))
+REQUEST_DEADLINE_MIN_REMAINING_SECONDS = 0.1
 ZORGNED_GEMEENTE_CODE = "0363"
 ZORGNED_API_TOKEN = os.getenv("ZORGNED_API_TOKEN", os.getenv("WMO_NED_API_TOKEN"))
 ZORGNED_API_URL = os.getenv("ZORGNED_API_URL")
 ZORGNED_DOCUMENT_ATTACHMENTS_ACTIVE = False
+DOCUMENT_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Keep-alive connection pool for the ZorgNed client, one pool per uwsgi worker.
+ZORGNED_POOL_MAXSIZE = int(os.getenv("ZORGNED_POOL_MAXSIZE", 4))
+ZORGNED_POOL_IDLE_TIMEOUT_SECONDS = int(
+    os.getenv("ZORGNED_POOL_IDLE_TIMEOUT_SECONDS", 60)
+)
+
+# Circuit breaker, opens when too many of the recent ZorgNed calls fail or are slow.
+ZORGNED_CIRCUIT_WINDOW_SIZE = int(os.getenv("ZORGNED_CIRCUIT_WINDOW_SIZE", 20))
+ZORGNED_CIRCUIT_MIN_CALLS = int(os.getenv("ZORGNED_CIRCUIT_MIN_CALLS", 10))
+ZORGNED_CIRCUIT_ERROR_RATE = float(os.getenv("ZORGNED_CIRCUIT_ERROR_RATE", 0.5))
+ZORGNED_CIRCUIT_SLOW_CALL_SECONDS = float(
+    os.getenv("ZORGNED_CIRCUIT_SLOW_CALL_SECONDS", 10)
+)
+ZORGNED_CIRCUIT_SLOW_CALL_RATE = float(os.getenv("ZORGNED_CIRCUIT_SLOW_CALL_RATE", 0.5))
+ZORGNED_CIRCUIT_OPEN_SECONDS = float(os.getenv("ZORGNED_CIRCUIT_OPEN_SECONDS", 5))
+ZORGNED_CIRCUIT_MAX_OPEN_SECONDS = float(
+    os.getenv("ZORGNED_CIRCUIT_MAX_OPEN_SECONDS", 60)
+)
+ZORGNED_CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("ZORGNED_CIRCUIT_HALF_OPEN_PROBES", 1))
 
 WMONED_FERNET_ENCRYPTION_KEY = os.getenv("FERNET_ENCRYPTION_KEY")
 
+# Keys for the deterministic document ids, comma separated. The first key encrypts, all keys decrypt so keys can be rotated.
+DOCUMENT_ID_ENCRYPTION_KEYS = [
+    key
+    for key in os.getenv(
+        "DOCUMENT_ID_ENCRYPTION_KEYS", WMONED_FERNET_ENCRYPTION_KEY or ""
+    ).split(",")
+    if key
+]
+# A document url is valid for at least this long and at most twice as long.
+DOCUMENT_ID_VALIDITY_SECONDS = int(os.getenv("DOCUMENT_ID_VALIDITY_SECONDS", 60 * 60))
+
+# Cache of ZorgNed aanvragen and voorzieningen, entries are encrypted when a key is available.
+# Backends: memory (per worker), sqlite (shared by the workers on a node) or redis.
+ZORGNED_CACHE_ACTIVE = os.getenv("ZORGNED_CACHE_ACTIVE", "false").lower() == "true"
+ZORGNED_CACHE_TTL_SECONDS = int(os.getenv("ZORGNED_CACHE_TTL_SECONDS", 60))
+# Expired voorzieningen are served for at most this long while they are refreshed in the background.
+ZORGNED_CACHE_MAX_STALE_SECONDS = int(os.getenv("ZORGNED_CACHE_MAX_STALE_SECONDS", 0))
+ZORGNED_CACHE_MAX_ENTRIES = int(os.getenv("ZORGNED_CACHE_MAX_ENTRIES", 1000))
+ZORGNED_CACHE_MAX_BYTES = int(os.getenv("ZORGNED_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+ZORGNED_CACHE_ENCRYPTION_KEY = os.getenv(
+    "ZORGNED_CACHE_ENCRYPTION_KEY", WMONED_FERNET_ENCRYPTION_KEY
+)
+ZORGNED_CACHE_BACKEND = os.getenv("ZORGNED_CACHE_BACKEND", "memory")
+ZORGNED_CACHE_SQLITE_PATH = os.getenv(
+    "ZORGNED_CACHE_SQLITE_PATH",
+    os.path.join(tempfile.gettempdir(), "mijn-wmoned-cache.sqlite"),
+)
+# On-disk cache of ZorgNed documents, encrypted at rest when a key is available.
+DOCUMENT_CACHE_ACTIVE = os.getenv("DOCUMENT_CACHE_ACTIVE", "false").lower() == "true"
+DOCUMENT_CACHE_DIRECTORY = os.getenv(
+    "DOCUMENT_CACHE_DIRECTORY",
+    os.path.join(tempfile.gettempdir(), "mijn-wmoned-documents"),
+)
+DOCUMENT_CACHE_TTL_SECONDS = int(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", 60 * 60 * 24))
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+DOCUMENT_CACHE_ENCRYPTION_KEY = os.getenv(
+    "DOCUMENT_CACHE_ENCRYPTION_KEY", WMONED_FERNET_ENCRYPTION_KEY
+)
+
+ZORGNED_CACHE_REDIS_URL = os.getenv(
+    "ZORGNED_CACHE_REDIS_URL", "redis://localhost:6379/0"
+)
+
+# Every worker writes its metrics to a file in this directory, /status/metrics adds them up.
+METRICS_DIRECTORY = os.getenv(
+    "METRICS_DIRECTORY", os.path.join(tempfile.gettempdir(), "mijn-wmoned-metrics")
+)
+# How often a worker writes its metrics, after a request
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 1))
+
+# Timings of the steps of a request in a Server-Timing header and/or a log line per request
+SERVER_TIMING_ACTIVE = os.getenv("SERVER_TIMING_ACTIVE", "false").lower() == "true"
+SERVER_TIMING_LOG_ACTIVE = (
+    os.getenv("SERVER_TIMING_LOG_ACTIVE", "false").lower() == "true"
+)
+
+# Profiles single requests, only in the OT environments. A request is profiled when it has a valid signed
+# PROFILER_HEADER (see scripts/profile_header.py) or, with a sample rate, at random.
+PROFILER_ACTIVE = IS_OT and os.getenv("PROFILER_ACTIVE", "false").lower() == "true"
+PROFILER_SECRET = os.getenv("PROFILER_SECRET")
+PROFILER_HEADER = "X-Profile"
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", 0))
+PROFILER_DIRECTORY = os.getenv(
+    "PROFILER_DIRECTORY", os.path.join(tempfile.gettempdir(), "mijn-wmoned-profiles")
+)
+# Interval of the stack samples for the flamegraphs
+PROFILER_INTERVAL_SECONDS = float(os.getenv("PROFILER_INTERVAL_SECONDS", 0.001))
+# Samples the stacks of all threads of every worker in the background, see /status/profile
+SAMPLING_PROFILER_ACTIVE = (
+    os.getenv("SAMPLING_PROFILER_ACTIVE", "false").lower() == "true"
+)
+SAMPLING_PROFILER_INTERVAL_SECONDS = float(
+    os.getenv("SAMPLING_PROFILER_INTERVAL_SECONDS", 0.01)
+)
+
+# Traces the memory allocations of every worker with tracemalloc, see /status/memory. Requests that allocate more
+# than the budget on top of what was allocated when they started are logged.
+MEMORY_TRACING_ACTIVE = os.getenv("MEMORY_TRACING_ACTIVE", "false").lower() == "true"
+MEMORY_TRACING_FRAMES = int(os.getenv("MEMORY_TRACING_FRAMES", 1))
+MEMORY_BUDGET_BYTES = int(os.getenv("MEMORY_BUDGET_BYTES", 50 * 1024 * 1024))
+
+# Bearer token for the protected status endpoints, these are not available without it
+STATUS_TOKEN = os.getenv("STATUS_TOKEN")
+
+# Number of parsed date strings that are kept per worker
+DATE_CACHE_SIZE = 4096
+
+# Encoder of the JSON responses: json from the standard library or orjson (used when it is installed). orjson
+# writes non-ascii characters as UTF-8 instead of \u escapes, so the responses are not byte-identical.
+JSON_ENCODER = os.getenv("JSON_ENCODER", "json").lower()
+
 REGELING_IDENTIFICATIE = "wmo"
 BESCHIKT_PRODUCT_RESULTAAT = ["toegewezen"]
 DATE_END_NOT_OLDER_THAN = "2018-01-01"
@@ -100,16 +219,22 @@ if IS_AZ and IS_TAP and SERVER_CLIENT_CERT is not None:
     SERVER_CLIENT_CERT = cert.name
     SERVER_CLIENT_KEY = key.name
 
-# Set-up logging
+# Set-up logging, records are written by a background thread
 LOG_LEVEL = os.getenv("LOG_LEVEL", "ERROR").upper()
-logging.basicConfig(
-    format="%(asctime)s,%(msecs)d %(levelname)-8s [%(pathname)s:%(lineno)d in function %(funcName)s] %(message)s",
-    datefmt="%Y-%m-%d:%H:%M:%S",
-    level=LOG_LEVEL,
+# The same warning or error is written at most once per this many seconds, 0 writes all of them
+LOG_REPEAT_SECONDS = int(os.getenv("LOG_REPEAT_SECONDS", 60))
+setup_logging(
+    LOG_LEVEL,
+    "%(asctime)s,%(msecs)d %(levelname)-8s [%(pathname)s:%(lineno)d in function %(funcName)s] %(message)s",
+    "%Y-%m-%d:%H:%M:%S",
+    LOG_REPEAT_SECONDS,
 )
 
 
 class UpdatedJSONProvider(DefaultJSONProvider):
+    def is_indented(self):
+        return self.compact is False or (self.compact is None and self._app.debug)
+
     def default(self, obj):
         if isinstance(obj, time):
             return obj.isoformat(timespec="minutes")
@@ -0,0 +1,41 @@
+import time
+
+from flask import g, has_request_context
+
+from app.config import (
+    REQUEST_DEADLINE_MIN_REMAINING_SECONDS,
+    REQUEST_DEADLINE_SECONDS,
+    ZORGNED_API_CONNECT_TIMEOUT_SECONDS,
+    ZORGNED_API_REQUEST_TIMEOUT_SECONDS,
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def start_deadline(budget=REQUEST_DEADLINE_SECONDS):
+    g.deadline = time.monotonic() + budget
+
+
+def get_remaining_seconds():
+    # Work outside of a request, e.g. a background refresh, has no deadline
+    if not has_request_context() or "deadline" not in g:
+        return None
+
+    return g.deadline - time.monotonic()
+
+
+def get_upstream_timeout(
+    connect_timeout=ZORGNED_API_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=ZORGNED_API_REQUEST_TIMEOUT_SECONDS,
+):
+    remaining = get_remaining_seconds()
+
+    if remaining is None:
+        return (connect_timeout, read_timeout)
+
+    if remaining < REQUEST_DEADLINE_MIN_REMAINING_SECONDS:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+    return (min(connect_timeout, remaining), min(read_timeout, remaining))
@@ -0,0 +1,353 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import mmap
+import os
+import tempfile
+import time
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+ENCRYPTED_FILE_HEADER = b"WMODC1"
+NONCE_PREFIX_SIZE = 8
+TAG_SIZE = 16
+CHUNK_SIZE = 64 * 1024
+
+
+def derive_key(fernet_key, info):
+    # Derive a separate key for the document cache from the configured Fernet key
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=info,
+    ).derive(base64.urlsafe_b64decode(fernet_key))
+
+
+def create_aesgcm(fernet_key):
+    return AESGCM(derive_key(fernet_key, b"mijn-wmoned-document-cache"))
+
+
+def chunk_nonce(nonce_prefix, index):
+    return nonce_prefix + index.to_bytes(4, "big")
+
+
+def chunk_aad(index, is_last):
+    # Binds every chunk to its position so chunks can not be reordered or the file truncated
+    return index.to_bytes(4, "big") + (b"\x01" if is_last else b"\x00")
+
+
+class EncryptedFileWriter:
+    def __init__(self, file, aesgcm):
+        self.file = file
+        self.aesgcm = aesgcm
+        self.nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self.index = 0
+        self.buffer = b""
+
+        self.file.write(ENCRYPTED_FILE_HEADER + self.nonce_prefix)
+
+    def _write_chunk(self, data, is_last):
+        self.file.write(
+            self.aesgcm.encrypt(
+                chunk_nonce(self.nonce_prefix, self.index),
+                data,
+                chunk_aad(self.index, is_last),
+            )
+        )
+        self.index += 1
+
+    def write(self, data):
+        self.buffer += data
+
+        # Keep at least one byte buffered, the last chunk is only known on close
+        while len(self.buffer) > CHUNK_SIZE:
+            self._write_chunk(self.buffer[:CHUNK_SIZE], False)
+            self.buffer = self.buffer[CHUNK_SIZE:]
+
+    def close(self):
+        self._write_chunk(self.buffer, True)
+        self.buffer = b""
+
+
+def iter_encrypted_file(file, aesgcm):
+    with file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+
+            try:
+                header_size = len(ENCRYPTED_FILE_HEADER) + NONCE_PREFIX_SIZE
+                if view[: len(ENCRYPTED_FILE_HEADER)] != ENCRYPTED_FILE_HEADER:
+                    raise ValueError("Not an encrypted document cache file")
+
+                nonce_prefix = bytes(view[len(ENCRYPTED_FILE_HEADER) : header_size])
+                encrypted_chunk_size = CHUNK_SIZE + TAG_SIZE
+                position = header_size
+                index = 0
+
+                while position < len(view):
+                    end = min(position + encrypted_chunk_size, len(view))
+                    # Decrypt straight from the mapped file, the ciphertext is never copied
+                    chunk = view[position:end]
+                    try:
+                        data = aesgcm.decrypt(
+                            chunk_nonce(nonce_prefix, index),
+                            chunk,
+                            chunk_aad(index, end == len(view)),
+                        )
+                    except InvalidTag:
+                        # Raised after the chunk is released, the traceback would keep it exported
+                        data = None
+
+                    chunk.release()
+
+                    if data is None:
+                        raise InvalidTag()
+
+                    yield data
+                    position = end
+                    index += 1
+            finally:
+                view.release()
+
+
+# The decrypted chunks of a cached document. Closing it closes the file, also when the chunks were never read,
+# for example for a 304 response.
+class EncryptedFile:
+    def __init__(self, file, aesgcm):
+        self.file = file
+        self.chunks = iter_encrypted_file(file, aesgcm)
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        self.chunks.close()
+        self.file.close()
+
+
+def remove_purged(path):
+    # Another worker may purge the same file at the same time
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class DocumentCache:
+    def __init__(
+        self,
+        directory,
+        ttl,
+        max_bytes,
+        encryption_key=None,
+        purge_interval=1,
+        purge_grace_seconds=60,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.aesgcm = None
+        self.name_key = None
+
+        if encryption_key:
+            self.aesgcm = create_aesgcm(encryption_key)
+            # Encrypted objects are not named by the hash of their content, that would confirm a known document
+            self.name_key = derive_key(
+                encryption_key, b"mijn-wmoned-document-cache-names"
+            )
+
+        # Another worker may be storing an object that is not referenced by its index entry yet
+        self.purge_grace_seconds = purge_grace_seconds
+        self.purge_interval = purge_interval
+        self.last_purged = 0
+
+        self.objects_directory = os.path.join(directory, "objects")
+        self.index_directory = os.path.join(directory, "index")
+
+        os.makedirs(self.objects_directory, exist_ok=True)
+        os.makedirs(self.index_directory, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_index_path(self, key):
+        return os.path.join(self.index_directory, key)
+
+    def get_object_path(self, etag):
+        return os.path.join(self.objects_directory, etag)
+
+    def read_index(self, key):
+        try:
+            with open(self.get_index_path(key), "r") as index_file:
+                entry = json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if entry["stored_at"] + self.ttl <= time.time():
+            return None
+
+        return entry
+
+    def create_document(self, mimetype, etag, file):
+        return {
+            "Content-Type": mimetype,
+            "etag": etag,
+            # A plain file can be sent by the server without copying it through Python
+            "file_data": EncryptedFile(file, self.aesgcm) if self.aesgcm else file,
+        }
+
+    def get(self, key):
+        entry = self.read_index(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        path = self.get_object_path(entry["etag"])
+
+        try:
+            # Once opened the document can be read, even when it is evicted in the meantime
+            file = open(path, "rb")
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return self.create_document(entry["mimetype"], entry["etag"], file)
+
+    def create_content_hash(self):
+        if self.name_key:
+            return hmac.new(self.name_key, digestmod=hashlib.sha256)
+        return hashlib.sha256()
+
+    def put(self, key, mimetype, chunks):
+        etag, file = self.store(key, mimetype, chunks)
+        file.close()
+
+        return etag
+
+    def put_and_get(self, key, mimetype, chunks):
+        # Served from the file that was just written, also when another worker purges it right away
+        etag, file = self.store(key, mimetype, chunks)
+
+        return self.create_document(mimetype, etag, file)
+
+    def store(self, key, mimetype, chunks):
+        content_hash = self.create_content_hash()
+
+        with tempfile.NamedTemporaryFile(
+            dir=self.objects_directory, prefix=".tmp-", delete=False
+        ) as temp_file:
+            try:
+                writer = (
+                    EncryptedFileWriter(temp_file, self.aesgcm)
+                    if self.aesgcm
+                    else temp_file
+                )
+
+                for chunk in chunks:
+                    content_hash.update(chunk)
+                    writer.write(chunk)
+
+                if self.aesgcm:
+                    writer.close()
+            except Exception:
+                os.unlink(temp_file.name)
+                raise
+
+        # Content addressed, a document that is shared by several keys is stored once
+        etag = content_hash.hexdigest()
+        file = open(temp_file.name, "rb")
+
+        try:
+            # The index entry is written first, a purge never sees the new object without a reference to it
+            self.write_index(
+                key, {"etag": etag, "mimetype": mimetype, "stored_at": time.time()}
+            )
+            os.replace(temp_file.name, self.get_object_path(etag))
+        except BaseException:
+            file.close()
+            raise
+
+        if time.monotonic() - self.last_purged > self.purge_interval:
+            try:
+                self.purge(keep=etag)
+            except OSError as error:
+                logging.error(f"Purging document cache failed: {error}")
+
+        return etag, file
+
+    def write_index(self, key, entry):
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.index_directory, prefix=".tmp-", delete=False
+        ) as index_file:
+            json.dump(entry, index_file)
+
+        os.replace(index_file.name, self.get_index_path(key))
+
+    def purge(self, keep=None):
+        self.last_purged = time.monotonic()
+        referenced = set()
+
+        for key in os.listdir(self.index_directory):
+            if key.startswith(".tmp-"):
+                continue
+
+            entry = self.read_index(key)
+
+            if entry is None:
+                remove_purged(self.get_index_path(key))
+            else:
+                referenced.add(entry["etag"])
+
+        objects = []
+
+        for etag in os.listdir(self.objects_directory):
+            if etag.startswith(".tmp-"):
+                continue
+
+            path = self.get_object_path(etag)
+
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Purged by another worker
+                continue
+
+            if etag not in referenced:
+                # The index entry of an object that was just stored may have been written after the index was read
+                if stat.st_mtime < time.time() - self.purge_grace_seconds:
+                    remove_purged(path)
+                continue
+
+            objects.append((stat.st_mtime, stat.st_size, path, etag))
+
+        size = sum(object_stat[1] for object_stat in objects)
+
+        # Evict the least recently used documents until the cache fits
+        for _, object_size, path, etag in sorted(objects):
+            if size <= self.max_bytes:
+                break
+            if etag == keep:
+                continue
+
+            if remove_purged(path):
+                self.evictions += 1
+            size -= object_size
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
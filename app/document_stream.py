@@ -0,0 +1,251 @@
+import base64
+import json
+import re
+import tempfile
+
+DOCUMENT_SPOOL_MAX_MEMORY_BYTES = 1024 * 1024
+
+RE_STRING_SPECIAL = re.compile(rb'["\\]')
+RE_NOT_BASE64 = re.compile(rb"[^A-Za-z0-9+/=]")
+RE_VALUE_SPECIAL = re.compile(rb'["{}\[\],]')
+
+JSON_ESCAPES = {
+    b'"': b'"',
+    b"\\": b"\\",
+    b"/": b"/",
+    b"b": b"\b",
+    b"f": b"\f",
+    b"n": b"\n",
+    b"r": b"\r",
+    b"t": b"\t",
+}
+
+WHITESPACE = b" \t\r\n"
+
+
+class JSONStreamReader:
+    # Reads a JSON object from an iterable of byte chunks without keeping the whole document in memory.
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.pos = 0
+
+    def fill(self, size=1):
+        # Make sure at least size bytes are available after the current position
+        while len(self.buffer) - self.pos < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return False
+            self.buffer = self.buffer[self.pos :] + chunk
+            self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+            char = self.buffer[self.pos : self.pos + 1]
+
+            if char not in WHITESPACE:
+                return char
+
+            self.pos += 1
+
+    def expect(self, expected):
+        char = self.peek()
+        if char != expected:
+            raise ValueError(f"Expected {expected} but found {char} in JSON stream")
+        self.pos += 1
+
+    def read_escape(self):
+        self.fill(2)
+        char = self.buffer[self.pos + 1 : self.pos + 2]
+
+        if char != b"u":
+            self.pos += 2
+            return JSON_ESCAPES[char]
+
+        size = 6
+        self.fill(size)
+        # A surrogate pair is written as two escapes
+        if (
+            self.buffer[self.pos + 2 : self.pos + 3].lower() == b"d"
+            and self.buffer[self.pos + 3 : self.pos + 4].lower() in b"89ab"
+        ):
+            size = 12
+            self.fill(size)
+
+        escape = self.buffer[self.pos : self.pos + size]
+        self.pos += size
+
+        return json.loads(b'"' + escape + b'"').encode()
+
+    def read_string_chunks(self):
+        self.expect(b'"')
+
+        while True:
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+            match = RE_STRING_SPECIAL.search(self.buffer, self.pos)
+
+            if match is None:
+                data = self.buffer[self.pos :]
+                self.pos = len(self.buffer)
+                yield data
+                continue
+
+            if match.start() > self.pos:
+                yield self.buffer[self.pos : match.start()]
+
+            self.pos = match.start()
+
+            if match.group() == b'"':
+                self.pos += 1
+                return
+
+            yield self.read_escape()
+
+    def read_string(self):
+        return b"".join(self.read_string_chunks()).decode()
+
+    def read_value(self):
+        if self.peek() == b'"':
+            return self.read_string()
+
+        # Numbers, literals, arrays and objects are collected as raw bytes and parsed at once
+        parts = []
+        depth = 0
+
+        while True:
+            if not self.fill():
+                break
+
+            match = RE_VALUE_SPECIAL.search(self.buffer, self.pos)
+            end = len(self.buffer) if match is None else match.start()
+
+            parts.append(self.buffer[self.pos : end])
+            self.pos = end
+
+            if match is None:
+                continue
+
+            char = match.group()
+
+            if char == b'"':
+                parts.append(json.dumps(self.read_string()).encode())
+                continue
+
+            if char in b"{[":
+                depth += 1
+            elif depth == 0:
+                # End of this value, leave the , or } for the object reader
+                break
+            elif char in b"}]":
+                depth -= 1
+
+            parts.append(char)
+            self.pos += 1
+
+        return json.loads(b"".join(parts))
+
+    def iter_object(self):
+        # Yields the keys, the caller consumes the value of every key before asking for the next one.
+        self.expect(b"{")
+
+        if self.peek() == b"}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self.read_string()
+            self.expect(b":")
+
+            yield key
+
+            if self.peek() == b",":
+                self.pos += 1
+                continue
+
+            self.expect(b"}")
+            return
+
+
+def decode_base64_chunks(chunks):
+    remainder = b""
+
+    for chunk in chunks:
+        # Like b64decode, ignore everything outside of the base64 alphabet
+        data = remainder + RE_NOT_BASE64.sub(b"", chunk)
+        usable = len(data) - len(data) % 4
+        remainder = data[usable:]
+
+        if usable:
+            yield base64.b64decode(data[:usable])
+
+    if remainder:
+        yield base64.b64decode(remainder)
+
+
+def iter_file(file, chunk_size):
+    try:
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        file.close()
+
+
+def iter_content(reader, close=None):
+    try:
+        yield from decode_base64_chunks(reader.read_string_chunks())
+    finally:
+        if close:
+            close()
+
+
+# Reads a ZorgNed document response, the decoded "inhoud" is returned as a generator of bytes.
+def read_document(chunks, chunk_size, close=None):
+    reader = JSONStreamReader(chunks)
+    fields = {}
+    spool = None
+
+    try:
+        for key in reader.iter_object():
+            if key != "inhoud":
+                fields[key] = reader.read_value()
+            elif "mimetype" in fields:
+                # The content can be passed on straight from the upstream response
+                return {
+                    "Content-Type": fields["mimetype"],
+                    "file_data": iter_content(reader, close),
+                }
+            else:
+                # The mimetype comes after the content, keep it aside until we know it
+                spool = tempfile.SpooledTemporaryFile(DOCUMENT_SPOOL_MAX_MEMORY_BYTES)
+                for data in decode_base64_chunks(reader.read_string_chunks()):
+                    spool.write(data)
+
+        if close:
+            close()
+            close = None
+
+        if spool is None:
+            raise KeyError("inhoud")
+
+        spool.seek(0)
+
+        return {
+            "Content-Type": fields["mimetype"],
+            "file_data": iter_file(spool, chunk_size),
+        }
+    except Exception:
+        if spool is not None:
+            spool.close()
+        if close:
+            close()
+        raise
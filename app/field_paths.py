@@ -0,0 +1,59 @@
+MISSING = object()
+
+
+def get_segment(value, segment):
+    if isinstance(value, dict):
+        return value.get(segment, MISSING)
+
+    if isinstance(value, list) and segment.isdigit():
+        index = int(segment)
+        return value[index] if index < len(value) else MISSING
+
+    return MISSING
+
+
+# Compiles a "/" separated path into a function that reads it from a source, like dpath.get but without
+# parsing and globbing the path on every call. Without a default a missing path raises a KeyError.
+def compile_path(path, default=MISSING):
+    segments = tuple(path.split("/"))
+
+    def missing():
+        if default is MISSING:
+            raise KeyError(path)
+        return default
+
+    if len(segments) == 1:
+        (key,) = segments
+
+        def get(source):
+            if isinstance(source, dict):
+                value = source.get(key, MISSING)
+            else:
+                value = get_segment(source, key)
+            return missing() if value is MISSING else value
+
+        return get
+
+    def get(source):
+        value = source
+        for segment in segments:
+            value = get_segment(value, segment)
+            if value is MISSING:
+                return missing()
+        return value
+
+    return get
+
+
+# Compiles a mapping of output field -> (source, path[, default]) into a function that builds the output
+# fields from a dict of named sources.
+def compile_plan(fields):
+    steps = tuple(
+        (field, source, compile_path(*path_spec))
+        for field, (source, *path_spec) in fields.items()
+    )
+
+    def extract(sources):
+        return {field: get(sources[source]) for field, source, get in steps}
+
+    return extract
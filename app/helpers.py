@@ -1,19 +1,63 @@
+import base64
+import os
+import threading
+import time
 from datetime import date, datetime
+from functools import lru_cache
 
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESSIV
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from flask import g, has_request_context, request
 from flask.helpers import make_response
 
-from app.config import WMONED_FERNET_ENCRYPTION_KEY
+from app import metrics
+from app.config import (
+    DATE_CACHE_SIZE,
+    DOCUMENT_ID_ENCRYPTION_KEYS,
+    DOCUMENT_ID_VALIDITY_SECONDS,
+    WMONED_FERNET_ENCRYPTION_KEY,
+)
+
+DOCUMENT_ID_VERSION = b"\x01"
 
 
 def success_response_json(response_content):
-    return make_response({"status": "OK", "content": response_content}, 200)
+    with metrics.timer(
+        "wmoned_serialize_seconds", "serialize", endpoint=request.endpoint
+    ):
+        return make_response({"status": "OK", "content": response_content}, 200)
 
 
 def error_response_json(message: str, code: int = 500):
     return make_response({"status": "ERROR", "message": message}, code)
 
 
+# ZorgNed repeats the same dates a lot, the parsed dates are immutable and can be shared.
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(date_input: str) -> date:
+    # Fast path for plain ISO dates, strptime is a lot slower than fromisoformat
+    if len(date_input) == 10 and date_input[4] == "-" and date_input[7] == "-":
+        try:
+            return date.fromisoformat(date_input)
+        except ValueError:
+            pass
+
+    if len(date_input) == 19 and date_input[10] == "T":
+        try:
+            return datetime.fromisoformat(date_input).date()
+        except ValueError:
+            pass
+
+    # Anything else is parsed like before, e.g. dates without zero padding
+    if "T" in date_input:
+        return datetime.strptime(date_input, "%Y-%m-%dT%H:%M:%S").date()
+
+    return datetime.strptime(date_input, "%Y-%m-%d").date()
+
+
 def to_date(date_input):
     if isinstance(date_input, date):
         return date_input
@@ -21,10 +65,18 @@ def to_date(date_input):
     if isinstance(date_input, datetime):
         return date_input.date()
 
-    if "T" in date_input:
-        return datetime.strptime(date_input, "%Y-%m-%dT%H:%M:%S").date()
+    return parse_date(date_input)
 
-    return datetime.strptime(date_input, "%Y-%m-%d").date()
+
+def get_today():
+    # Computed once per request so every record of a request is compared to the same day
+    if not has_request_context():
+        return date.today()
+
+    if "today" not in g:
+        g.today = date.today()
+
+    return g.today
 
 
 def to_date_time(date_input):
@@ -34,11 +86,171 @@ def to_date_time(date_input):
     return datetime.strptime(date_input, "%Y-%m-%dT%H:%M:%S")
 
 
+def to_base64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def from_base64(value: str) -> bytes:
+    try:
+        return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    except ValueError:
+        raise InvalidToken()
+
+
+def create_aessiv(key):
+    # Derive a separate AES-SIV key for the document ids from a Fernet key
+    key_derived = HKDF(
+        algorithm=hashes.SHA256(),
+        length=64,
+        salt=None,
+        info=b"mijn-wmoned-document-id",
+    ).derive(base64.urlsafe_b64decode(key))
+    return AESSIV(key_derived)
+
+
+def is_fernet_token(inputEncrypted: str) -> bool:
+    # Fernet tokens start with version byte 0x80
+    return inputEncrypted.startswith("gAAAAA")
+
+
+class DocumentIdCipher:
+    def __init__(self, keys, fernet_keys=None, validity_seconds=60 * 60):
+        self.pid = os.getpid()
+        self.validity_seconds = validity_seconds
+
+        # Deriving the keys is the expensive part, it is done once instead of for every id.
+        # The first key encrypts, ids encrypted with a previous key stay valid until that key is removed.
+        self.aessivs = [create_aessiv(key) for key in keys]
+        self.fernet = (
+            MultiFernet([Fernet(key) for key in fernet_keys]) if fernet_keys else None
+        )
+
+    def decrypt_aessiv(self, data: bytes, associated_data: list) -> bytes:
+        for aessiv in self.aessivs:
+            try:
+                return aessiv.decrypt(data, associated_data)
+            except InvalidTag:
+                continue
+
+        raise InvalidToken()
+
+    def encrypt_many(self, values: list) -> list:
+        # Deterministic, a document always gets the same id so responses can be cached
+        aessiv = self.aessivs[0]
+        return [
+            to_base64(
+                DOCUMENT_ID_VERSION
+                + aessiv.encrypt(value.encode(), [DOCUMENT_ID_VERSION])
+            )
+            for value in values
+        ]
+
+    def encrypt(self, value: str) -> str:
+        return self.encrypt_many([value])[0]
+
+    def decrypt(self, value: str, ttl=60 * 60) -> str:
+        if is_fernet_token(value):
+            # Ids that were handed out before the deterministic ids, these carry their own ttl
+            if self.fernet is None:
+                raise InvalidToken()
+            return self.fernet.decrypt(value.encode(), ttl=ttl).decode()
+
+        data = from_base64(value)
+
+        if data[:1] != DOCUMENT_ID_VERSION:
+            raise InvalidToken()
+
+        return self.decrypt_aessiv(data[1:], [DOCUMENT_ID_VERSION]).decode()
+
+    def decrypt_many(self, values: list, ttl=60 * 60) -> list:
+        return [self.decrypt(value, ttl) for value in values]
+
+    def create_validity_many(self, ids_encrypted: list, now=None) -> list:
+        window = self.validity_seconds
+        # Rounded up to whole windows so the url of a document only changes once per window
+        expires_at = ((int(now or time.time()) // window + 2) * window).to_bytes(
+            8, "big"
+        )
+
+        aessiv = self.aessivs[0]
+        return [
+            to_base64(aessiv.encrypt(expires_at, [b"validity", id_encrypted.encode()]))
+            for id_encrypted in ids_encrypted
+        ]
+
+    def create_validity(self, id_encrypted: str, now=None) -> str:
+        return self.create_validity_many([id_encrypted], now)[0]
+
+    def decrypt_document_id(self, id_encrypted: str, validity: str = None) -> str:
+        if is_fernet_token(id_encrypted):
+            return self.decrypt(id_encrypted)
+
+        # The validity is bound to the id, it can not be reused for another document
+        if not validity:
+            raise InvalidToken()
+
+        expires_at = int.from_bytes(
+            self.decrypt_aessiv(
+                from_base64(validity), [b"validity", id_encrypted.encode()]
+            ),
+            "big",
+        )
+
+        if expires_at <= time.time():
+            raise InvalidToken()
+
+        return self.decrypt(id_encrypted)
+
+
+_cipher = None
+_cipher_lock = threading.Lock()
+
+
+def get_cipher():
+    global _cipher
+
+    if _cipher is None or _cipher.pid != os.getpid():
+        with _cipher_lock:
+            if _cipher is None or _cipher.pid != os.getpid():
+                # Old Fernet ids can be decrypted with any of the keys
+                fernet_keys = [
+                    key
+                    for key in [WMONED_FERNET_ENCRYPTION_KEY]
+                    + DOCUMENT_ID_ENCRYPTION_KEYS
+                    if key
+                ]
+                _cipher = DocumentIdCipher(
+                    DOCUMENT_ID_ENCRYPTION_KEYS,
+                    fernet_keys,
+                    DOCUMENT_ID_VALIDITY_SECONDS,
+                )
+
+    return _cipher
+
+
 def encrypt(inputUnencrypted: str) -> str:
-    f = Fernet(WMONED_FERNET_ENCRYPTION_KEY)
-    return f.encrypt(inputUnencrypted.encode()).decode()
+    return get_cipher().encrypt(inputUnencrypted)
+
+
+def encrypt_many(inputsUnencrypted: list) -> list:
+    return get_cipher().encrypt_many(inputsUnencrypted)
+
+
+def decrypt(inputEncrypted: str, ttl=60 * 60) -> tuple:
+    return get_cipher().decrypt(inputEncrypted, ttl)
+
+
+def decrypt_many(inputsEncrypted: list, ttl=60 * 60) -> list:
+    return get_cipher().decrypt_many(inputsEncrypted, ttl)
+
+
+def create_validity(idEncrypted: str, now=None) -> str:
+    return get_cipher().create_validity(idEncrypted, now)
+
+
+def create_validity_many(idsEncrypted: list, now=None) -> list:
+    return get_cipher().create_validity_many(idsEncrypted, now)
 
 
-def decrypt(inputEncrypted: str) -> tuple:
-    f = Fernet(WMONED_FERNET_ENCRYPTION_KEY)
-    return f.decrypt(inputEncrypted.encode(), ttl=60 * 60).decode()
+def decrypt_document_id(idEncrypted: str, validity: str = None) -> str:
+    return get_cipher().decrypt_document_id(idEncrypted, validity)
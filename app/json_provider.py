@@ -0,0 +1,52 @@
+from app.config import JSON_ENCODER, UpdatedJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Serializes with orjson and falls back to json for the arguments and values orjson does not support.
+# Dates, times and dataclasses are passed to default() so they come out the same as with json.
+# Unlike json with ensure_ascii, orjson writes non-ascii characters as UTF-8 instead of \u escapes.
+class OrjsonJSONProvider(UpdatedJSONProvider):
+    def dumps_bytes(self, obj, indent=None, separators=None, **kwargs):
+        if kwargs or (indent, separators) not in [(None, (",", ":")), (2, None)]:
+            return self.dumps_json(obj, indent, separators, **kwargs)
+
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+
+        try:
+            return orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            # For example integers over 64 bits or keys that are not strings
+            return self.dumps_json(obj, indent, separators)
+
+    def dumps_json(self, obj, indent=None, separators=None, **kwargs):
+        return (
+            super().dumps(obj, indent=indent, separators=separators, **kwargs).encode()
+        )
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj, **kwargs).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+
+        if self.is_indented():
+            body = self.dumps_bytes(obj, indent=2)
+        else:
+            body = self.dumps_bytes(obj, separators=(",", ":"))
+
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+
+def create_json_provider(app, encoder=JSON_ENCODER):
+    if encoder == "orjson" and orjson is not None:
+        return OrjsonJSONProvider(app)
+
+    return UpdatedJSONProvider(app)
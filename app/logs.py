@@ -0,0 +1,123 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Renders a payload only when the log record is actually written, logging.debug("%s", LazyJson(data)) costs next
+# to nothing when the debug level is off.
+class LazyJson:
+    def __init__(self, value, **kwargs):
+        self.value = value
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return json.dumps(self.value, **self.kwargs)
+
+
+# Drops records that repeat a warning or error that was written less than `seconds` ago. The first record after
+# that mentions how often it was dropped. During an outage every request fails with the same error.
+class RepeatFilter(logging.Filter):
+    def __init__(self, seconds, max_keys=1000):
+        super().__init__()
+        self.seconds = seconds
+        self.max_keys = max_keys
+        # key -> [time written, times dropped since]
+        self.written = {}
+
+        self._lock = threading.Lock()
+
+    def create_key(self, record):
+        if record.exc_info and record.exc_info[1] is not None:
+            error = record.exc_info[1]
+            return (record.pathname, record.lineno, type(error), str(error))
+
+        return (record.pathname, record.lineno, None, record.getMessage())
+
+    def filter(self, record):
+        if not self.seconds or record.levelno < logging.WARNING:
+            return True
+
+        key = self.create_key(record)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self.written.get(key)
+
+            if entry is not None and now - entry[0] < self.seconds:
+                entry[1] += 1
+                return False
+
+            if len(self.written) >= self.max_keys:
+                self.written = {
+                    key: entry
+                    for key, entry in self.written.items()
+                    if now - entry[0] < self.seconds
+                }
+
+            self.written[key] = [now, 0]
+
+        if entry is not None and entry[1]:
+            record.msg = f"{record.msg} (repeated {entry[1]} times)"
+
+        return True
+
+
+# Puts records on a queue, a listener thread formats and writes them. Threads do not survive a fork, so every
+# uwsgi worker starts its own listener on its first record.
+class WorkerQueueHandler(QueueHandler):
+    def __init__(self, *handlers):
+        super().__init__(queue.SimpleQueue())
+        self.handlers = handlers
+        self.pid = None
+        self.listener = None
+
+        self._start_lock = threading.Lock()
+
+        # Writes the records that are still queued
+        atexit.register(self.stop_listener)
+
+    def start_listener(self):
+        with self._start_lock:
+            if self.pid == os.getpid():
+                return
+
+            # The queue of the parent may hold records that its listener writes
+            self.queue = queue.SimpleQueue()
+            self.listener = QueueListener(
+                self.queue, *self.handlers, respect_handler_level=True
+            )
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def stop_listener(self):
+        with self._start_lock:
+            if self.pid == os.getpid():
+                self.listener.stop()
+                self.pid = None
+
+    def prepare(self, record):
+        # The queue stays within the process, the listener thread formats the message and traceback
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self.start_listener()
+
+        super().enqueue(record)
+
+
+def setup_logging(level, log_format, datefmt, repeat_seconds=0):
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(log_format, datefmt))
+
+    queue_handler = WorkerQueueHandler(stream_handler)
+    queue_handler.addFilter(RepeatFilter(repeat_seconds))
+
+    logging.basicConfig(level=level, handlers=[queue_handler])
+
+    return queue_handler
@@ -0,0 +1,173 @@
+import logging
+import os
+import threading
+import tracemalloc
+
+from flask import g, request
+
+from app import metrics
+from app.config import (
+    MEMORY_BUDGET_BYTES,
+    MEMORY_TRACING_ACTIVE,
+    MEMORY_TRACING_FRAMES,
+)
+
+# Allocations of the import machinery and of tracemalloc itself are not interesting
+IGNORED_ALLOCATIONS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+class TracedRequest:
+    def __init__(self, start_bytes):
+        self.start_bytes = start_bytes
+        # Set when another request ran at the same time
+        self.is_overlapping = False
+
+
+# Peak and net allocations per endpoint. tracemalloc traces the whole process and has one peak for it, with more
+# threads per worker a request that overlaps with another request can not be measured. Those requests are counted
+# but left out of the numbers and the budget check.
+class MemoryTracker:
+    def __init__(self, budget=MEMORY_BUDGET_BYTES, frames=MEMORY_TRACING_FRAMES):
+        self.pid = os.getpid()
+        self.budget = budget
+        self.frames = frames
+        self.endpoints = {}
+        self.active_requests = set()
+
+        self._lock = threading.Lock()
+
+    def start_request(self):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+
+            # Resetting the peak would wipe the peak of a request that is still running
+            if not self.active_requests:
+                tracemalloc.reset_peak()
+
+            current, _ = tracemalloc.get_traced_memory()
+            traced_request = TracedRequest(current)
+
+            if self.active_requests:
+                traced_request.is_overlapping = True
+                for active_request in self.active_requests:
+                    active_request.is_overlapping = True
+
+            self.active_requests.add(traced_request)
+
+        return traced_request
+
+    def get_endpoint_stats(self, endpoint):
+        return self.endpoints.setdefault(
+            endpoint,
+            {
+                "requests": 0,
+                "overlapping": 0,
+                "peakBytesMax": 0,
+                "peakBytesTotal": 0,
+                "netBytesTotal": 0,
+                "overBudget": 0,
+            },
+        )
+
+    def finish_request(self, endpoint, traced_request):
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            self.active_requests.discard(traced_request)
+
+            if traced_request.is_overlapping:
+                stats = self.get_endpoint_stats(endpoint)
+                stats["requests"] += 1
+                stats["overlapping"] += 1
+                return None
+
+        peak_bytes = max(peak - traced_request.start_bytes, 0)
+        net_bytes = current - traced_request.start_bytes
+        is_over_budget = peak_bytes > self.budget
+
+        with self._lock:
+            stats = self.get_endpoint_stats(endpoint)
+            stats["requests"] += 1
+            stats["peakBytesMax"] = max(stats["peakBytesMax"], peak_bytes)
+            stats["peakBytesTotal"] += peak_bytes
+            stats["netBytesTotal"] += net_bytes
+            stats["overBudget"] += int(is_over_budget)
+
+        if is_over_budget:
+            metrics.inc("wmoned_memory_budget_exceeded_total", endpoint=endpoint)
+            logging.warning(
+                f"Request to {endpoint} allocated {peak_bytes} bytes at its peak, the budget is {self.budget} bytes"
+            )
+
+        return peak_bytes, net_bytes
+
+    def top_allocations(self, limit=20):
+        if not tracemalloc.is_tracing():
+            return []
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED_ALLOCATIONS)
+
+        return [
+            {
+                "site": f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+                "sizeBytes": statistic.size,
+                "count": statistic.count,
+            }
+            for statistic in snapshot.statistics("lineno")[:limit]
+        ]
+
+    def stats(self, limit=20):
+        traced_bytes, peak_bytes = (
+            tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        )
+
+        with self._lock:
+            endpoints = {
+                endpoint: {**stats} for endpoint, stats in self.endpoints.items()
+            }
+
+        return {
+            "pid": self.pid,
+            "budgetBytes": self.budget,
+            "tracedBytes": traced_bytes,
+            "peakBytes": peak_bytes,
+            "endpoints": endpoints,
+            "topAllocations": self.top_allocations(limit),
+        }
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker():
+    global _tracker
+
+    # uwsgi forks the workers after import, every worker traces its own allocations.
+    if _tracker is None or _tracker.pid != os.getpid():
+        with _tracker_lock:
+            if _tracker is None or _tracker.pid != os.getpid():
+                _tracker = MemoryTracker()
+
+    return _tracker
+
+
+def get_active_tracker():
+    return get_tracker() if MEMORY_TRACING_ACTIVE else None
+
+
+def start_request():
+    if MEMORY_TRACING_ACTIVE:
+        g.traced_request = get_tracker().start_request()
+
+
+def finish_request():
+    if "traced_request" in g:
+        get_tracker().finish_request(
+            request.endpoint or "none", g.pop("traced_request")
+        )
@@ -0,0 +1,383 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from app import spans
+from app.config import METRICS_DIRECTORY, METRICS_FLUSH_SECONDS
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# name -> (type, help), in the order they are rendered
+METRICS = {
+    "wmoned_request_seconds": ("histogram", "Duration of the requests by endpoint"),
+    "wmoned_responses_total": ("counter", "Responses by endpoint and status code"),
+    "wmoned_response_bytes_total": ("counter", "Bytes of the response bodies"),
+    "wmoned_upstream_request_seconds": (
+        "histogram",
+        "Duration of the ZorgNed requests by operation, until the headers are received",
+    ),
+    "wmoned_upstream_errors_total": ("counter", "Failed ZorgNed requests by error"),
+    "wmoned_upstream_response_bytes_total": (
+        "counter",
+        "Bytes of the ZorgNed JSON responses",
+    ),
+    "wmoned_parse_seconds": ("histogram", "Duration of decoding ZorgNed JSON"),
+    "wmoned_format_seconds": ("histogram", "Duration of the formatting pipelines"),
+    "wmoned_encryption_seconds": ("histogram", "Duration of the document id ciphers"),
+    "wmoned_serialize_seconds": ("histogram", "Duration of writing JSON responses"),
+    "wmoned_memory_budget_exceeded_total": (
+        "counter",
+        "Requests that allocated more than the memory budget",
+    ),
+    "wmoned_circuit_breaker_state": (
+        "gauge",
+        "Workers with their ZorgNed circuit breaker in the state",
+    ),
+    "wmoned_circuit_breaker_transitions_total": (
+        "counter",
+        "State transitions of the ZorgNed circuit breakers",
+    ),
+}
+
+
+def create_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels)
+        + "}"
+    )
+
+
+# Gauges are added up like counters, a gauge of every worker counts the workers in a state
+def merge_snapshots(snapshots):
+    counters = {}
+    histograms = {}
+
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"] + snapshot.get("gauges", []):
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+
+        for name, labels, histogram in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.get(key)
+            histograms[key] = (
+                [a + b for a, b in zip(total, histogram)] if total else histogram
+            )
+
+    return counters, histograms
+
+
+def create_snapshot(counters, histograms):
+    return {
+        "counters": [
+            [name, labels, value] for (name, labels), value in counters.items()
+        ],
+        "histograms": [
+            [name, labels, histogram]
+            for (name, labels), histogram in histograms.items()
+        ],
+    }
+
+
+def read_snapshot(path):
+    with open(path, "r") as metrics_file:
+        return json.load(metrics_file)
+
+
+def write_snapshot(path, snapshot):
+    path_tmp = f"{path}.{threading.get_ident()}.tmp"
+
+    with open(path_tmp, "w") as metrics_file:
+        json.dump(snapshot, metrics_file)
+
+    # A scrape never reads a file that is half written
+    os.replace(path_tmp, path)
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Runs as another user
+        return True
+
+    return True
+
+
+# Counters and histograms of one worker. uwsgi runs several worker processes, every worker writes its metrics to
+# its own file in a shared directory and a scrape adds up the files of all workers. The files of workers that
+# exited are added to archive.json, so their counts are kept without a file per worker that ever ran.
+class Metrics:
+    def __init__(
+        self, directory=METRICS_DIRECTORY, flush_seconds=METRICS_FLUSH_SECONDS
+    ):
+        self.pid = os.getpid()
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+
+        self.counters = {}
+        self.gauges = {}
+        # (name, labels) -> count per bucket, the last bucket is +Inf, followed by the sum
+        self.histograms = {}
+
+        self.last_flush = None
+
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = create_key(name, labels)
+
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = create_key(name, labels)
+
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = create_key(name, labels)
+
+        with self._lock:
+            histogram = self.histograms.get(key)
+
+            if histogram is None:
+                histogram = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+                self.histograms[key] = histogram
+
+            histogram[bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    # Also records the timing as a span of the request, for the Server-Timing header
+    @contextmanager
+    def timer(self, name, span=None, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, **labels)
+
+            if span and spans.is_recording():
+                spans.record_span(span, seconds, ",".join(map(str, labels.values())))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [
+                    [name, labels, value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                "gauges": [
+                    [name, labels, value]
+                    for (name, labels), value in self.gauges.items()
+                ],
+                "histograms": [
+                    [name, labels, list(histogram)]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def get_path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    @contextmanager
+    def lock_directory(self):
+        with open(os.path.join(self.directory, "archive.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    # Expects the directory to be locked
+    def archive(self, paths):
+        snapshots = []
+        archived_paths = []
+
+        for path in paths:
+            try:
+                snapshot = read_snapshot(path)
+                # The gauges of an exited worker no longer apply
+                snapshot.pop("gauges", None)
+                snapshots.append(snapshot)
+                archived_paths.append(path)
+            except (OSError, ValueError) as error:
+                logging.error(f"Could not archive metrics {path}: {error}")
+
+        if not archived_paths:
+            return
+
+        archive_path = self.get_path("archive")
+
+        if os.path.exists(archive_path):
+            snapshots.append(read_snapshot(archive_path))
+
+        write_snapshot(archive_path, create_snapshot(*merge_snapshots(snapshots)))
+
+        for path in archived_paths:
+            os.unlink(path)
+
+    # Expects the directory to be locked
+    def archive_exited(self):
+        paths = []
+
+        for file_name in os.listdir(self.directory):
+            pid = file_name.removesuffix(".json")
+
+            if (
+                file_name.endswith(".json")
+                and pid.isdigit()
+                and not is_running(int(pid))
+            ):
+                paths.append(os.path.join(self.directory, file_name))
+
+        self.archive(paths)
+
+    def flush(self):
+        if not self.directory:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        path = self.get_path(self.pid)
+
+        if self.last_flush is None and os.path.exists(path):
+            # Written by a worker that exited before this worker got the same pid
+            with self.lock_directory():
+                self.archive([path])
+
+        write_snapshot(path, self.snapshot())
+
+        self.last_flush = time.monotonic()
+
+    def flush_if_due(self):
+        if self.directory and (
+            self.last_flush is None
+            or time.monotonic() - self.last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def read_snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+
+        self.flush()
+
+        snapshots = []
+
+        # Locked, a file is never counted both by itself and in the archive or not at all
+        with self.lock_directory():
+            try:
+                self.archive_exited()
+            except (OSError, ValueError) as error:
+                logging.error(f"Could not archive metrics: {error}")
+
+            for file_name in sorted(os.listdir(self.directory)):
+                if not file_name.endswith(".json"):
+                    continue
+                try:
+                    snapshots.append(
+                        read_snapshot(os.path.join(self.directory, file_name))
+                    )
+                except (OSError, ValueError) as error:
+                    logging.error(f"Could not read metrics {file_name}: {error}")
+
+        return snapshots
+
+    def collect(self):
+        # The metrics of this worker are current, the other workers are at most flush_seconds behind
+        return merge_snapshots(self.read_snapshots())
+
+    def render(self):
+        counters, histograms = self.collect()
+        lines = []
+
+        for name, (metric_type, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+            if metric_type in ["counter", "gauge"]:
+                for (key_name, labels), value in sorted(counters.items()):
+                    if key_name == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+
+            for (key_name, labels), histogram in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+
+                count = 0
+                for bound, bucket_count in zip(
+                    LATENCY_BUCKETS + ("+Inf",), histogram[:-1]
+                ):
+                    count += bucket_count
+                    bucket_labels = format_labels(labels + (("le", bound),))
+                    lines.append(f"{name}_bucket{bucket_labels} {count}")
+
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+
+    # uwsgi forks the workers after import, every worker counts for itself.
+    if _metrics is None or _metrics.pid != os.getpid():
+        with _metrics_lock:
+            if _metrics is None or _metrics.pid != os.getpid():
+                _metrics = Metrics()
+
+    return _metrics
+
+
+def inc(name, value=1, **labels):
+    get_metrics().inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    get_metrics().set_gauge(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    get_metrics().observe(name, value, **labels)
+
+
+def timer(name, span=None, **labels):
+    return get_metrics().timer(name, span, **labels)
@@ -0,0 +1,148 @@
+import json
+from dataclasses import dataclass
+from datetime import date, time
+from json.encoder import encode_basestring_ascii
+
+
+@dataclass(slots=True)
+class Document:
+    id: str
+    title: str
+    url: str
+    date_published: str
+
+    # (json key, attribute), sorted by json key like the Flask JSON provider does
+    JSON_FIELDS = (
+        ("datePublished", "date_published"),
+        ("id", "id"),
+        ("title", "title"),
+        ("url", "url"),
+    )
+
+    def to_dict(self):
+        return {key: getattr(self, name) for key, name in self.JSON_FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[key] for key, name in cls.JSON_FIELDS})
+
+
+@dataclass(slots=True)
+class Voorziening:
+    date_decision: str
+    title: str
+    item_type_code: str
+    date_start: str
+    date_end: str
+    is_actual: bool
+    delivery_type: str
+    supplier: str
+    service_order_date: str
+    service_date_start: str
+    service_date_end: str
+    documents: list = None
+
+    JSON_FIELDS = (
+        ("dateDecision", "date_decision"),
+        ("dateEnd", "date_end"),
+        ("dateStart", "date_start"),
+        ("deliveryType", "delivery_type"),
+        ("documents", "documents"),
+        ("isActual", "is_actual"),
+        ("itemTypeCode", "item_type_code"),
+        ("serviceDateEnd", "service_date_end"),
+        ("serviceDateStart", "service_date_start"),
+        ("serviceOrderDate", "service_order_date"),
+        ("supplier", "supplier"),
+        ("title", "title"),
+    )
+
+    def to_dict(self):
+        data = {key: getattr(self, name) for key, name in self.JSON_FIELDS}
+
+        if self.documents is not None:
+            data["documents"] = [document.to_dict() for document in self.documents]
+
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        voorziening = cls(**{name: data[key] for key, name in cls.JSON_FIELDS})
+
+        if voorziening.documents is not None:
+            voorziening.documents = [
+                Document.from_dict(document) for document in voorziening.documents
+            ]
+
+        return voorziening
+
+
+def encode_default(obj):
+    if isinstance(obj, time):
+        return obj.isoformat(timespec="minutes")
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# Writes the same JSON as the app JSON provider: sorted keys, compact separators and ascii only.
+def encode_value(value):
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if type(value) is str:
+        return encode_basestring_ascii(value)
+    # Dates without the default() dispatch of the json module
+    if isinstance(value, time):
+        return f'"{value.isoformat(timespec="minutes")}"'
+    if isinstance(value, date):
+        return f'"{value.isoformat()}"'
+
+    return json.dumps(
+        value, sort_keys=True, separators=(",", ":"), default=encode_default
+    )
+
+
+def encode_model(model, parts):
+    separator = "{"
+
+    for key, name in model.JSON_FIELDS:
+        value = getattr(model, name)
+
+        parts.append(separator)
+        parts.append(f'"{key}":')
+
+        if type(value) is list and value and hasattr(value[0], "JSON_FIELDS"):
+            parts.append("[")
+            for index, item in enumerate(value):
+                if index:
+                    parts.append(",")
+                encode_model(item, parts)
+            parts.append("]")
+        else:
+            parts.append(encode_value(value))
+
+        separator = ","
+
+    parts.append("}")
+
+
+def encode_models(models):
+    parts = ["["]
+
+    for index, model in enumerate(models):
+        if index:
+            parts.append(",")
+        encode_model(model, parts)
+
+    parts.append("]")
+
+    return "".join(parts).encode()
+
+
+def encode_success_response(content):
+    # The body of success_response_json around content that is already encoded
+    return b'{"content":' + content + b',"status":"OK"}\n'
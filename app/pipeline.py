@@ -0,0 +1,39 @@
+import threading
+
+
+# Chains generator stages lazily, a stage only sees the items that the stages before it let through.
+# A stage is a (name, fn) pair where fn takes an iterable of items and yields items.
+class Pipeline:
+    def __init__(self, *stages):
+        self.stages = stages
+        self.runs = 0
+        # Items yielded by every stage, summed over all runs
+        self.counts = {name: 0 for name, _ in stages}
+
+        self._lock = threading.Lock()
+
+    def count(self, name, items):
+        count = 0
+
+        try:
+            for item in items:
+                count += 1
+                yield item
+        finally:
+            with self._lock:
+                self.counts[name] += count
+
+    def run(self, source):
+        with self._lock:
+            self.runs += 1
+
+        items = iter(source)
+
+        for name, stage in self.stages:
+            items = self.count(name, stage(items))
+
+        return items
+
+    def stats(self):
+        with self._lock:
+            return {"runs": self.runs, "stages": dict(self.counts)}
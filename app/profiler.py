@@ -0,0 +1,199 @@
+import cProfile
+import hashlib
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request
+
+from app.config import (
+    PROFILER_ACTIVE,
+    PROFILER_DIRECTORY,
+    PROFILER_HEADER,
+    PROFILER_INTERVAL_SECONDS,
+    PROFILER_SAMPLE_RATE,
+    PROFILER_SECRET,
+    SAMPLING_PROFILER_ACTIVE,
+    SAMPLING_PROFILER_INTERVAL_SECONDS,
+)
+
+
+def get_frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+def get_stack(frame):
+    names = []
+
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+
+    # Root first, the collapsed stack format of flamegraph.pl and speedscope
+    return ";".join(reversed(names))
+
+
+# Samples the stacks of threads from a background thread, the counts of the stacks make a flamegraph.
+class StackSampler:
+    def __init__(self, interval=PROFILER_INTERVAL_SECONDS, thread_ids=None):
+        self.pid = os.getpid()
+        self.interval = interval
+        # Samples all threads when None
+        self.thread_ids = thread_ids
+        self.counts = {}
+        self.samples = 0
+
+        self.started = time.time()
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def sample(self):
+        frames = sys._current_frames()
+        thread_ids = self.thread_ids or frames.keys()
+        own_thread_id = threading.get_ident()
+
+        with self._lock:
+            self.samples += 1
+
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+
+                if frame is None or thread_id == own_thread_id:
+                    continue
+
+                stack = get_stack(frame)
+                self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {}
+            self.samples = 0
+            self.started = time.time()
+
+    def collapsed(self):
+        with self._lock:
+            return "".join(
+                f"{stack} {count}\n" for stack, count in sorted(self.counts.items())
+            )
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+
+    # uwsgi forks the workers after import, threads do not survive a fork so every worker starts its own.
+    if _sampler is None or _sampler.pid != os.getpid():
+        with _sampler_lock:
+            if _sampler is None or _sampler.pid != os.getpid():
+                _sampler = StackSampler(SAMPLING_PROFILER_INTERVAL_SECONDS)
+                _sampler.start()
+
+    return _sampler
+
+
+def get_active_sampler():
+    return get_sampler() if SAMPLING_PROFILER_ACTIVE else None
+
+
+def create_signature(secret, path, expires):
+    message = f"{expires}:{path}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def create_profile_header(secret, path, expires):
+    return f"{expires}.{create_signature(secret, path, expires)}"
+
+
+def is_valid_profile_header(header, path, secret):
+    if not secret:
+        return False
+
+    expires, _, signature = header.partition(".")
+
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+
+    return hmac.compare_digest(signature, create_signature(secret, path, expires))
+
+
+def should_profile():
+    header = request.headers.get(PROFILER_HEADER)
+
+    if header:
+        return is_valid_profile_header(header, request.path, PROFILER_SECRET)
+
+    return PROFILER_SAMPLE_RATE > 0 and random.random() < PROFILER_SAMPLE_RATE
+
+
+# One profiled request at a time per worker, the profiles of concurrent requests would get in each other's way
+_profile_lock = threading.Lock()
+
+
+def start_profile():
+    if not PROFILER_ACTIVE or not should_profile():
+        return
+
+    if not _profile_lock.acquire(blocking=False):
+        return
+
+    # cProfile only sees this thread, the sampler only samples this thread
+    sampler = StackSampler(thread_ids=[threading.get_ident()])
+    sampler.start()
+
+    profile = cProfile.Profile()
+    profile.enable()
+
+    g.profile = (profile, sampler)
+
+
+def finish_profile(exception=None):
+    if "profile" not in g:
+        return
+
+    profile, sampler = g.pop("profile")
+
+    try:
+        profile.disable()
+        sampler.stop()
+
+        os.makedirs(PROFILER_DIRECTORY, exist_ok=True)
+
+        path = os.path.join(
+            PROFILER_DIRECTORY,
+            f"{datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}-{request.endpoint}",
+        )
+
+        # cProfile dump for pstats or snakeviz, collapsed stacks for a flamegraph
+        profile.dump_stats(f"{path}.prof")
+
+        with open(f"{path}.collapsed", "w") as collapsed_file:
+            collapsed_file.write(sampler.collapsed())
+
+        logging.warning(f"Profile of {request.path} written to {path}.prof/.collapsed")
+    except OSError as error:
+        logging.error(f"Could not write profile: {error}")
+    finally:
+        _profile_lock.release()
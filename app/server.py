@@ -1,18 +1,26 @@
+import json
 import logging
+import time
 
 import sentry_sdk
 import os
-from flask import Flask, make_response
-from requests.exceptions import HTTPError
+from flask import Flask, g, make_response, request
+from requests.exceptions import HTTPError, Timeout
 from sentry_sdk.integrations.flask import FlaskIntegration
+from werkzeug.wsgi import wrap_file
 
 import app.zorgned_service as zorgned
-from app import auth
-from app.config import IS_AZ, IS_OT, SENTRY_DSN, SENTRY_ENV, UpdatedJSONProvider
-from app.helpers import decrypt, error_response_json, success_response_json
+from app import auth, memory, metrics, profiler, spans
+from app.circuit_breaker import CircuitOpenError
+from app.deadline import start_deadline
+from app.config import IS_AZ, IS_OT, SENTRY_DSN, SENTRY_ENV
+from app.helpers import decrypt_document_id, error_response_json, success_response_json
+from app.json_provider import create_json_provider
+from app.models import encode_success_response
+from app.zorgned_client import get_client
 
 app = Flask(__name__)
-app.json = UpdatedJSONProvider(app)
+app.json = create_json_provider(app)
 
 if SENTRY_DSN:
     sentry_sdk.init(
@@ -23,24 +31,105 @@ if SENTRY_DSN:
     )
 
 
+@app.before_request
+def before_request():
+    # Starts the sampling profiler of this worker, when it is active
+    profiler.get_active_sampler()
+    profiler.start_profile()
+    memory.start_request()
+    g.request_start = time.perf_counter()
+    start_deadline()
+    spans.start_spans()
+
+
+@app.after_request
+def after_request(response):
+    endpoint = request.endpoint or "none"
+
+    if "request_start" in g:
+        request_seconds = time.perf_counter() - g.request_start
+        metrics.observe("wmoned_request_seconds", request_seconds, endpoint=endpoint)
+        spans.finish_spans(response, request_seconds)
+
+    metrics.inc(
+        "wmoned_responses_total", endpoint=endpoint, status=response.status_code
+    )
+
+    # Streamed documents have no length up front
+    if response.content_length is not None:
+        metrics.inc(
+            "wmoned_response_bytes_total", response.content_length, endpoint=endpoint
+        )
+
+    # The other workers see the metrics of this worker once they are written
+    metrics.get_metrics().flush_if_due()
+
+    return response
+
+
+@app.teardown_request
+def teardown_request(exception=None):
+    memory.finish_request()
+    profiler.finish_profile(exception)
+
+
 @app.route("/wmoned/voorzieningen", methods=["GET"])
 @auth.login_required
 def get_voorzieningen():
     user = auth.get_current_user()
-    voorzieningen = zorgned.get_voorzieningen(user["id"])
-    return success_response_json(voorzieningen)
+    voorzieningen_entry = zorgned.get_voorzieningen_entry(user["id"])
+    etag = voorzieningen_entry["etag"]
+
+    # Equal ETags mean byte-equal voorzieningen, the document ids are deterministic and the urls are hashed too
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    elif app.json.is_indented():
+        # Indented JSON in debug mode
+        response = success_response_json(json.loads(voorzieningen_entry["content"]))
+    else:
+        # The voorzieningen are serialized once when they are fetched, with either JSON provider
+        response = app.response_class(
+            encode_success_response(voorzieningen_entry["content"]),
+            mimetype=app.json.mimetype,
+        )
+
+    # The indented JSON of debug mode is not byte-equal to the compact JSON the ETag is the hash of
+    response.set_etag(etag, weak=app.json.is_indented())
+
+    if voorzieningen_entry["is_stale"]:
+        response.headers["Warning"] = '110 - "Response is Stale"'
+
+    return response
 
 
 @app.route("/wmoned/document/<string:doc_id_encrypted>", methods=["GET"])
 @auth.login_required
 def get_document(doc_id_encrypted):
     user = auth.get_current_user()
-    doc_id = decrypt(doc_id_encrypted)
+
+    with metrics.timer("wmoned_encryption_seconds", "encryption", operation="decrypt"):
+        doc_id = decrypt_document_id(doc_id_encrypted, request.args.get("validity"))
+
     document_response = zorgned.get_document(user["id"], doc_id)
 
-    new_response = make_response(document_response["file_data"])
+    file_data = document_response["file_data"]
+
+    if hasattr(file_data, "read"):
+        # Plain file from the document cache, lets the server use sendfile
+        file_data = wrap_file(request.environ, file_data)
+
+    # Otherwise file_data is a generator, the document is streamed to the client while it is decoded
+    new_response = app.response_class(file_data, direct_passthrough=True)
     new_response.headers["Content-Type"] = document_response["Content-Type"]
 
+    if document_response.get("etag"):
+        new_response.set_etag(document_response["etag"])
+        # Responds with a 304 when the If-None-Match header matches
+        new_response.make_conditional(request)
+
+        if new_response.status_code == 304:
+            file_data.close()
+
     return new_response
 
 
@@ -56,6 +145,77 @@ def health_check():
     )
 
 
+@app.route("/status/connection-pool")
+def connection_pool_status():
+    return success_response_json(get_client().stats())
+
+
+@app.route("/status/cache")
+def cache_status():
+    return success_response_json(
+        {
+            "aanvragen": zorgned.aanvragen_cache.stats(),
+            "voorzieningen": zorgned.voorzieningen_cache.stats(),
+            "singleFlight": zorgned.upstream_flights.stats(),
+        }
+    )
+
+
+@app.route("/status/pipeline")
+def pipeline_status():
+    return success_response_json(
+        {
+            "aanvragen": zorgned.aanvragen_pipeline.stats(),
+            "voorzieningen": zorgned.voorzieningen_pipeline.stats(),
+        }
+    )
+
+
+@app.route("/status/circuit-breaker")
+def circuit_breaker_status():
+    return success_response_json(get_client().circuit_breaker.stats())
+
+
+@app.route("/status/metrics")
+def metrics_status():
+    # Prometheus text format, with the metrics of all workers
+    return app.response_class(
+        metrics.get_metrics().render(), mimetype="text/plain; version=0.0.4"
+    )
+
+
+@app.route("/status/profile")
+@auth.status_login_required
+def profile_status():
+    sampler = profiler.get_active_sampler()
+
+    if sampler is None:
+        return error_response_json("Sampling profiler not active", 404)
+
+    # Collapsed stacks of this worker, for flamegraph.pl or speedscope
+    response = app.response_class(sampler.collapsed(), mimetype="text/plain")
+    response.headers["X-Profile-Pid"] = sampler.pid
+    response.headers["X-Profile-Samples"] = sampler.samples
+    response.headers["X-Profile-Seconds"] = round(time.time() - sampler.started)
+
+    if request.args.get("reset") == "true":
+        sampler.reset()
+
+    return response
+
+
+@app.route("/status/memory")
+@auth.status_login_required
+def memory_status():
+    tracker = memory.get_active_tracker()
+
+    if tracker is None:
+        return error_response_json("Memory tracing not active", 404)
+
+    # Allocations of this worker
+    return success_response_json(tracker.stats(request.args.get("limit", 20, type=int)))
+
+
 @app.errorhandler(Exception)
 def handle_error(error):
     error_message_original = f"{type(error)}:{str(error)}"
@@ -63,15 +223,26 @@ def handle_error(error):
     msg_auth_exception = "Auth error occurred"
     msg_request_http_error = "Request error occurred"
     msg_server_error = "Server error occurred"
+    msg_circuit_open = "Service unavailable"
+    msg_timeout = "Request timed out"
+
+    if isinstance(error, CircuitOpenError):
+        # Fail fast, no need for a traceback of every rejected request
+        logging.warning(error_message_original)
+        return error_response_json(msg_circuit_open, 503)
 
+    # The same error is logged once per LOG_REPEAT_SECONDS, see app/logs.py
     logging.exception(error, extra={"error_message_original": error_message_original})
 
     if IS_OT:  # pragma: no cover
         msg_auth_exception = error_message_original
         msg_request_http_error = error_message_original
         msg_server_error = error_message_original
+        msg_timeout = error_message_original
 
-    if isinstance(error, HTTPError):
+    if isinstance(error, (TimeoutError, Timeout)):
+        return error_response_json(msg_timeout, 504)
+    elif isinstance(error, HTTPError):
         return error_response_json(
             msg_request_http_error,
             error.response.status_code,
@@ -0,0 +1,79 @@
+import logging
+import threading
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.flights = {}
+        self.calls = 0
+        self.shared = 0
+
+        self._lock = threading.Lock()
+
+    def _run(self, key, flight, fn, *args, **kwargs):
+        try:
+            flight.result = fn(*args, **kwargs)
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self.flights[key]
+            flight.done.set()
+
+        return flight.result
+
+    def do(self, key, fn, *args, wait_timeout=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            flight = self.flights.get(key)
+            is_leader = flight is None
+
+            if is_leader:
+                flight = Flight()
+                self.flights[key] = flight
+            else:
+                self.shared += 1
+
+        if not is_leader:
+            # Wait for the call that is already in flight and share its outcome
+            if not flight.done.wait(wait_timeout):
+                raise TimeoutError("Timed out waiting for call in flight")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        return self._run(key, flight, fn, *args, **kwargs)
+
+    def do_in_background(self, key, fn, *args, **kwargs):
+        with self._lock:
+            if key in self.flights:
+                return False
+
+            self.calls += 1
+            flight = Flight()
+            self.flights[key] = flight
+
+        def run():
+            try:
+                self._run(key, flight, fn, *args, **kwargs)
+            except Exception as error:
+                logging.error(f"Background call failed: {error}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+        return True
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "inFlight": len(self.flights),
+        }
@@ -0,0 +1,102 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+from app.config import SERVER_TIMING_ACTIVE, SERVER_TIMING_LOG_ACTIVE
+
+timing_logger = logging.getLogger("app.timing")
+
+if SERVER_TIMING_LOG_ACTIVE:
+    # The log line is wanted even when the rest of the app only logs errors
+    timing_logger.setLevel(logging.INFO)
+
+
+def is_active():
+    return SERVER_TIMING_ACTIVE or SERVER_TIMING_LOG_ACTIVE
+
+
+def start_spans():
+    if is_active():
+        g.spans = []
+
+
+def is_recording():
+    # Work outside of a request, e.g. a background refresh, is not part of a response
+    return is_active() and has_request_context() and "spans" in g
+
+
+def record_span(name, seconds, description=None):
+    if is_recording():
+        g.spans.append((name, seconds, description))
+
+
+@contextmanager
+def span(name, description=None):
+    if not is_recording():
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start, description)
+
+
+def merge_spans(spans):
+    # Steps that run for every product, like the encryption of its documents, are reported once
+    merged = {}
+
+    for name, seconds, description in spans:
+        merged[(name, description)] = merged.get((name, description), 0) + seconds
+
+    return [
+        (name, seconds, description) for (name, description), seconds in merged.items()
+    ]
+
+
+def format_server_timing(spans):
+    entries = []
+
+    for name, seconds, description in spans:
+        entry = f"{name};dur={seconds * 1000:.1f}"
+        if description:
+            description = description.replace("\\", "\\\\").replace('"', '\\"')
+            entry += f';desc="{description}"'
+        entries.append(entry)
+
+    return ", ".join(entries)
+
+
+def finish_spans(response, total_seconds):
+    if not is_active() or "spans" not in g:
+        return
+
+    spans = merge_spans(g.spans) + [("total", total_seconds, None)]
+
+    if SERVER_TIMING_ACTIVE:
+        response.headers["Server-Timing"] = format_server_timing(spans)
+
+    if SERVER_TIMING_LOG_ACTIVE:
+        # No url, the path of a document contains its id
+        timing_logger.info(
+            json.dumps(
+                {
+                    "endpoint": request.endpoint,
+                    "method": request.method,
+                    "status": response.status_code,
+                    "spans": [
+                        {
+                            "name": name,
+                            "durationMs": round(seconds * 1000, 1),
+                            "description": description,
+                        }
+                        for name, seconds, description in spans
+                    ],
+                },
+                sort_keys=True,
+            )
+        )
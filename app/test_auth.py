@@ -0,0 +1,86 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+import jwt
+
+from app import auth
+from app.auth import (
+    PROFILE_TYPE_PRIVATE,
+    FlaskServerTestCase,
+    SigningKeyStore,
+    get_verified_token_data,
+)
+
+KID = FlaskServerTestCase.rsa_private_key_test["kid"]
+
+
+@patch.object(
+    jwt.PyJWKClient,
+    "fetch_data",
+    return_value=FlaskServerTestCase.rsa_public_key_test,
+)
+class SigningKeyStoreTest(TestCase):
+    def test_get_signing_key(self, fetch_data_mock):
+        store = SigningKeyStore("https://jwks", refresh_interval=3600)
+
+        signing_key = store.get_signing_key(KID)
+        self.assertEqual(signing_key.key_id, KID)
+
+        store.get_signing_key(KID)
+        fetch_data_mock.assert_called_once()
+
+    def test_unknown_kid_refetch_limited(self, fetch_data_mock):
+        store = SigningKeyStore(
+            "https://jwks", refresh_interval=3600, min_refetch_interval=10
+        )
+        store.get_signing_key(KID)
+
+        with self.assertRaises(jwt.PyJWKClientError):
+            store.get_signing_key("unknown-kid")
+
+        # Fetched for the first kid only, the unknown kid is within the refetch interval
+        self.assertEqual(fetch_data_mock.call_count, 1)
+
+        store.last_attempted -= 10
+
+        with self.assertRaises(jwt.PyJWKClientError):
+            store.get_signing_key("unknown-kid")
+
+        self.assertEqual(fetch_data_mock.call_count, 2)
+
+    def test_unknown_kid_refetch_limited_when_down(self, fetch_data_mock):
+        fetch_data_mock.side_effect = jwt.PyJWKClientConnectionError("down")
+
+        store = SigningKeyStore(
+            "https://jwks", refresh_interval=3600, min_refetch_interval=10
+        )
+
+        with self.assertRaises(jwt.PyJWKClientConnectionError):
+            store.get_signing_key(KID)
+
+        for _ in range(4):
+            with self.assertRaises(jwt.PyJWKClientError):
+                store.get_signing_key(KID)
+
+        # The failed fetch counts for the refetch interval
+        fetch_data_mock.assert_called_once()
+
+    def test_timeout(self, fetch_data_mock):
+        store = SigningKeyStore("https://jwks", timeout=3)
+        self.assertEqual(store.jwks_client.timeout, 3)
+
+    def test_get_verified_token_data(self, fetch_data_mock):
+        token = (
+            FlaskServerTestCase()
+            .get_token_header_value(PROFILE_TYPE_PRIVATE)
+            .replace("Bearer ", "")
+        )
+
+        store = SigningKeyStore("https://jwks", refresh_interval=3600)
+
+        with patch.object(auth, "signing_key_store", store):
+            token_data = get_verified_token_data(token)
+            get_verified_token_data(token)
+
+        self.assertEqual(token_data["sub"], FlaskServerTestCase.TEST_BSN)
+        fetch_data_mock.assert_called_once()
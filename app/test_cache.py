@@ -0,0 +1,303 @@
+import os
+import socketserver
+import sqlite3
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from cryptography.fernet import Fernet
+
+from app.cache import (
+    Cache,
+    MemoryCacheBackend,
+    RedisCacheBackend,
+    RedisError,
+    SQLiteCacheBackend,
+    create_cache_key,
+)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+
+        return args
+
+    def write_bulk(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        else:
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+
+    def handle(self):
+        data = self.server.data
+
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+
+            command = args[0].upper()
+
+            if command == b"GET":
+                value, expires_at = data.get(args[1], (None, None))
+                if expires_at is not None and expires_at <= time.time():
+                    value = None
+                self.write_bulk(value)
+            elif command == b"SET":
+                data[args[1]] = (args[2], time.time() + int(args[4]) / 1000)
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"DEL":
+                deleted = [data.pop(key, None) for key in args[1:]]
+                self.wfile.write(b":%d\r\n" % len([d for d in deleted if d]))
+            elif command == b"KEYS":
+                prefix = args[1].rstrip(b"*")
+                keys = [key for key in data if key.startswith(prefix)]
+                self.wfile.write(b"*%d\r\n" % len(keys))
+                for key in keys:
+                    self.write_bulk(key)
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.data = {}
+
+
+class CacheBackendTestMixin:
+    def test_get_set(self):
+        self.assertIsNone(self.backend.get("a"))
+
+        self.backend.set("a", b"value", 60)
+        self.assertEqual(self.backend.get("a"), b"value")
+
+        self.backend.set("a", b"value2", 60)
+        self.assertEqual(self.backend.get("a"), b"value2")
+
+    def test_expired(self):
+        self.backend.set("a", b"value", 0.001)
+        time.sleep(0.01)
+
+        self.assertIsNone(self.backend.get("a"))
+
+    def test_delete_clear(self):
+        self.backend.set("a", b"value", 60)
+        self.backend.set("b", b"value", 60)
+
+        self.backend.delete("a")
+        self.assertIsNone(self.backend.get("a"))
+        self.assertEqual(self.backend.get("b"), b"value")
+
+        self.backend.clear()
+        self.assertIsNone(self.backend.get("b"))
+
+
+class MemoryCacheBackendTest(CacheBackendTestMixin, TestCase):
+    def setUp(self):
+        self.backend = MemoryCacheBackend(max_entries=10, max_bytes=1024)
+
+    def test_purge_expired(self):
+        self.backend.set("a", b"value", 0)
+        self.backend.set("b", b"value", 0)
+
+        self.assertEqual(self.backend.purge_expired(), 2)
+        self.assertEqual(self.backend.stats()["bytes"], 0)
+
+    def test_evict_max_entries(self):
+        self.backend.max_entries = 2
+        self.backend.set("a", b"1", 60)
+        self.backend.set("b", b"2", 60)
+        self.backend.get("a")
+        self.backend.set("c", b"3", 60)
+
+        # b is least recently used
+        self.assertIsNone(self.backend.get("b"))
+        self.assertEqual(self.backend.get("a"), b"1")
+        self.assertEqual(self.backend.get("c"), b"3")
+        self.assertEqual(self.backend.stats()["evictions"], 1)
+
+    def test_evict_max_bytes(self):
+        self.backend.max_bytes = 15
+        self.backend.set("a", b"x" * 8, 60)
+        self.backend.set("b", b"x" * 8, 60)
+
+        self.assertIsNone(self.backend.get("a"))
+        self.assertEqual(self.backend.get("b"), b"x" * 8)
+
+        self.backend.set("c", b"x" * 30, 60)
+        self.assertIsNone(self.backend.get("c"))
+
+
+class SQLiteCacheBackendTest(CacheBackendTestMixin, TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache.sqlite")
+        self.backend = SQLiteCacheBackend(self.path, max_entries=10, max_bytes=1024)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_shared(self):
+        self.backend.set("a", b"value", 60)
+
+        # Another worker on the same node opens the same file
+        other_backend = SQLiteCacheBackend(self.path, max_entries=10, max_bytes=1024)
+        self.assertEqual(other_backend.get("a"), b"value")
+
+    def test_purge(self):
+        self.backend.max_entries = 2
+        self.backend.set("a", b"1", 0)
+        self.backend.set("b", b"2", 60)
+        self.backend.set("c", b"3", 61)
+        self.backend.set("d", b"4", 62)
+        self.backend.purge()
+
+        self.assertEqual(self.backend.stats()["entries"], 2)
+        self.assertIsNone(self.backend.get("b"))
+        self.assertEqual(self.backend.get("d"), b"4")
+
+    def test_evict_least_recently_used(self):
+        self.backend.max_entries = 2
+        self.backend.set("a", b"1", 60)
+        self.backend.set("b", b"2", 60)
+        self.backend.get("a")
+        self.backend.set("c", b"3", 60)
+        self.backend.purge()
+
+        # b is least recently used
+        self.assertIsNone(self.backend.get("b"))
+        self.assertEqual(self.backend.get("a"), b"1")
+        self.assertEqual(self.backend.get("c"), b"3")
+        self.assertEqual(self.backend.stats()["evictions"], 1)
+
+    def test_evict_max_bytes(self):
+        self.backend.max_bytes = 15
+        self.backend.set("a", b"x" * 8, 60)
+        self.backend.set("b", b"x" * 8, 60)
+        self.backend.purge()
+
+        self.assertIsNone(self.backend.get("a"))
+        self.assertEqual(self.backend.get("b"), b"x" * 8)
+        self.assertEqual(self.backend.stats()["bytes"], 8)
+
+        self.backend.set("c", b"x" * 30, 60)
+        self.assertIsNone(self.backend.get("c"))
+
+    def test_migrate(self):
+        path = os.path.join(self.directory.name, "old.sqlite")
+
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute(
+                "CREATE TABLE cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)"
+            )
+            connection.execute(
+                "INSERT INTO cache VALUES ('a', x'31', ?)", (time.time() + 60,)
+            )
+        connection.close()
+
+        backend = SQLiteCacheBackend(path, max_entries=10, max_bytes=1024)
+        backend.set("b", b"2", 60)
+        backend.purge()
+
+        self.assertEqual(backend.get("a"), b"1")
+        self.assertEqual(backend.get("b"), b"2")
+
+
+class RedisCacheBackendTest(CacheBackendTestMixin, TestCase):
+    def setUp(self):
+        self.server = FakeRedisServer()
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.01,), daemon=True
+        ).start()
+
+        host, port = self.server.server_address
+        self.backend = RedisCacheBackend(f"redis://{host}:{port}/0")
+
+    def tearDown(self):
+        self.backend.disconnect()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_key_prefix(self):
+        self.backend.set("a", b"value", 60)
+        self.assertIn(b"wmoned:a", self.server.data)
+
+    def test_error_reply(self):
+        with self.assertRaises(RedisError):
+            self.backend.execute("PING")
+
+    def test_reconnect(self):
+        self.backend.set("a", b"value", 60)
+        self.backend._socket.close()
+
+        self.assertEqual(self.backend.get("a"), b"value")
+
+
+class CacheTest(TestCase):
+    def get_cache(self, **kwargs):
+        backend = MemoryCacheBackend(max_entries=10, max_bytes=1024 * 1024)
+        return Cache(backend, ttl=60, **kwargs)
+
+    def test_create_cache_key(self):
+        secret = os.urandom(32)
+        key = create_cache_key("/aanvragen", 123, {"regeling": "wmo"}, secret)
+
+        self.assertEqual(
+            key, create_cache_key("/aanvragen", "123", {"regeling": "wmo"}, secret)
+        )
+        self.assertNotEqual(key, create_cache_key("/aanvragen", 123, {}, secret))
+        self.assertNotIn("123", key)
+        # Keyed, the key of a BSN can not be computed without the secret
+        self.assertNotEqual(
+            key,
+            create_cache_key("/aanvragen", 123, {"regeling": "wmo"}, os.urandom(32)),
+        )
+
+    def test_get_set(self):
+        cache = self.get_cache()
+
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", [{"title": "autozitje"}])
+
+        self.assertEqual(cache.get("a"), [{"title": "autozitje"}])
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_get_stale(self):
+        cache = self.get_cache(max_stale=60)
+        cache.ttl = -1
+        cache.set("a", [1])
+
+        self.assertEqual(cache.get_stale("a"), ([1], True))
+        self.assertIsNone(cache.get("a"))
+
+        cache.max_stale = 0
+        self.assertEqual(cache.get_stale("a"), (None, False))
+
+    def test_encrypted(self):
+        cache = self.get_cache(encryptor=Fernet(Fernet.generate_key()))
+        cache.set("a", {"title": "autozitje"})
+
+        _, value_bytes = cache.backend.entries["a"]
+        self.assertNotIn(b"autozitje", value_bytes)
+        self.assertEqual(cache.get("a"), {"title": "autozitje"})
+
+    def test_backend_error(self):
+        cache = Cache(RedisCacheBackend("redis://127.0.0.1:1/0"), ttl=60)
+
+        cache.set("a", [])
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["errors"], 2)
@@ -0,0 +1,142 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from app.circuit_breaker import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from app.metrics import Metrics
+
+
+def fail():
+    raise ConnectionError("ZorgNed down")
+
+
+class CircuitBreakerTest(TestCase):
+    def get_breaker(self, **kwargs):
+        options = {"window_size": 4, "min_calls": 4, "open_seconds": 10}
+        options.update(kwargs)
+        return CircuitBreaker(**options)
+
+    def open_breaker(self, breaker):
+        for _ in range(breaker.min_calls):
+            with self.assertRaises(ConnectionError):
+                breaker.call(fail)
+
+    def test_closed(self):
+        breaker = self.get_breaker()
+
+        self.assertEqual(breaker.call(lambda a: a, 1), 1)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+
+    def test_open_on_error_rate(self):
+        breaker = self.get_breaker()
+
+        breaker.call(lambda: None)
+        breaker.call(lambda: None)
+
+        with self.assertRaises(ConnectionError):
+            breaker.call(fail)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+
+        with self.assertRaises(ConnectionError):
+            breaker.call(fail)
+        self.assertEqual(breaker.state, STATE_OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(lambda: None)
+
+        self.assertEqual(
+            breaker.stats(),
+            {"state": STATE_OPEN, "transitions": {"closed->open": 1}, "rejected": 1},
+        )
+
+    def test_open_on_error_result(self):
+        breaker = self.get_breaker()
+
+        for _ in range(4):
+            breaker.call(lambda: 500, is_error=lambda status: status >= 500)
+
+        self.assertEqual(breaker.state, STATE_OPEN)
+
+    def test_open_on_slow_calls(self):
+        breaker = self.get_breaker(slow_call_seconds=0)
+
+        for _ in range(4):
+            breaker.call(lambda: None)
+
+        self.assertEqual(breaker.state, STATE_OPEN)
+
+    def test_half_open_probe_success(self):
+        breaker = self.get_breaker()
+        self.open_breaker(breaker)
+
+        breaker.opened_at -= 10
+        generation = breaker.before_call()
+        self.assertEqual(breaker.state, STATE_HALF_OPEN)
+
+        # Only one probe at a time
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        breaker.record(generation, 0, False)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+        self.assertEqual(len(breaker.outcomes), 0)
+
+    def test_outcome_of_earlier_state(self):
+        breaker = self.get_breaker()
+
+        # Admitted while the circuit was closed, still running when it opens
+        closed_generation = breaker.before_call()
+        self.open_breaker(breaker)
+
+        breaker.opened_at -= 10
+        probe_generation = breaker.before_call()
+        self.assertEqual(breaker.state, STATE_HALF_OPEN)
+
+        # Does not close the circuit while the probe is running
+        breaker.record(closed_generation, 0, False)
+        self.assertEqual(breaker.state, STATE_HALF_OPEN)
+        self.assertEqual(breaker.probes_in_flight, 1)
+
+        breaker.record(probe_generation, 0, False)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+        self.assertEqual(breaker.probes_in_flight, 0)
+
+    def test_metrics(self):
+        with patch("app.metrics._metrics", Metrics(None)) as metrics:
+            breaker = self.get_breaker()
+            self.assertEqual(
+                metrics.gauges[
+                    ("wmoned_circuit_breaker_state", (("state", "closed"),))
+                ],
+                1,
+            )
+
+            self.open_breaker(breaker)
+
+        self.assertEqual(
+            metrics.gauges[("wmoned_circuit_breaker_state", (("state", "closed"),))], 0
+        )
+        self.assertEqual(
+            metrics.gauges[("wmoned_circuit_breaker_state", (("state", "open"),))], 1
+        )
+        self.assertIn(
+            'wmoned_circuit_breaker_transitions_total{from_state="closed",to_state="open"} 1\n',
+            metrics.render(),
+        )
+
+    def test_half_open_probe_failure(self):
+        breaker = self.get_breaker()
+        self.open_breaker(breaker)
+
+        breaker.opened_at -= 10
+        with self.assertRaises(ConnectionError):
+            breaker.call(fail)
+
+        self.assertEqual(breaker.state, STATE_OPEN)
+        # Next probe is scheduled with a backoff
+        self.assertEqual(breaker.current_open_seconds, 20)
@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+from flask import Flask
+
+from app.deadline import (
+    DeadlineExceeded,
+    get_remaining_seconds,
+    get_upstream_timeout,
+    start_deadline,
+)
+
+app = Flask(__name__)
+
+
+class DeadlineTest(TestCase):
+    def test_no_request_context(self):
+        self.assertIsNone(get_remaining_seconds())
+        self.assertEqual(get_upstream_timeout(5, 30), (5, 30))
+
+    def test_no_deadline(self):
+        with app.test_request_context():
+            self.assertEqual(get_upstream_timeout(5, 30), (5, 30))
+
+    def test_remaining(self):
+        with app.test_request_context():
+            start_deadline(10)
+
+            connect_timeout, read_timeout = get_upstream_timeout(5, 30)
+
+            self.assertEqual(connect_timeout, 5)
+            self.assertLessEqual(read_timeout, 10)
+            self.assertGreater(read_timeout, 9)
+
+    def test_exceeded(self):
+        with app.test_request_context():
+            start_deadline(0)
+
+            with self.assertRaises(DeadlineExceeded):
+                get_upstream_timeout(5, 30)
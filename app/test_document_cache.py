@@ -0,0 +1,210 @@
+import hashlib
+import hmac
+import os
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet
+
+from app.document_cache import CHUNK_SIZE, DocumentCache
+
+CONTENT = os.urandom(CHUNK_SIZE * 2 + 100)
+
+
+class DocumentCacheTest(TestCase):
+    encryption_key = None
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = DocumentCache(
+            self.directory.name,
+            ttl=60,
+            max_bytes=1024 * 1024,
+            encryption_key=self.encryption_key,
+            purge_interval=0,
+            purge_grace_seconds=0,
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_etag(self, content):
+        return hashlib.sha256(content).hexdigest()
+
+    def read(self, document):
+        file_data = document["file_data"]
+
+        if hasattr(file_data, "read"):
+            with file_data:
+                return file_data.read()
+
+        return b"".join(file_data)
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get("key"))
+
+        etag = self.cache.put("key", "application/pdf", [CONTENT[:10], CONTENT[10:]])
+        self.assertEqual(etag, self.create_etag(CONTENT))
+
+        document = self.cache.get("key")
+
+        self.assertEqual(document["Content-Type"], "application/pdf")
+        self.assertEqual(document["etag"], etag)
+        self.assertEqual(self.read(document), CONTENT)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "evictions": 0})
+
+    def test_empty_document(self):
+        self.cache.put("key", "application/pdf", [])
+        self.assertEqual(self.read(self.cache.get("key")), b"")
+
+    def test_content_addressed(self):
+        self.cache.put("key1", "application/pdf", [CONTENT])
+        self.cache.put("key2", "application/pdf", [CONTENT])
+
+        self.assertEqual(len(os.listdir(self.cache.objects_directory)), 1)
+        self.assertEqual(self.read(self.cache.get("key2")), CONTENT)
+
+    def test_expired(self):
+        self.cache.put("key", "application/pdf", [CONTENT])
+        self.cache.ttl = 0
+
+        self.assertIsNone(self.cache.get("key"))
+
+        self.cache.purge()
+        self.assertEqual(os.listdir(self.cache.objects_directory), [])
+        self.assertEqual(os.listdir(self.cache.index_directory), [])
+
+    def test_evict_max_bytes(self):
+        self.cache.max_bytes = (len(CONTENT) + 200) * 2
+        self.cache.put("key1", "application/pdf", [b"1" + CONTENT])
+        time.sleep(0.01)
+        self.cache.put("key2", "application/pdf", [b"2" + CONTENT])
+        time.sleep(0.01)
+        self.cache.put("key3", "application/pdf", [b"3" + CONTENT])
+
+        self.assertIsNone(self.cache.get("key1"))
+        self.assertEqual(self.read(self.cache.get("key3")), b"3" + CONTENT)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_purge_throttled(self):
+        self.cache.purge_interval = 60
+        self.cache.max_bytes = 0
+        self.cache.purge()
+
+        self.cache.put("key", "application/pdf", [CONTENT])
+
+        self.assertEqual(self.read(self.cache.get("key")), CONTENT)
+
+    def test_purge_grace(self):
+        # Stored by another worker that has not written the index entry yet
+        other_cache = DocumentCache(
+            self.directory.name,
+            ttl=60,
+            max_bytes=1024 * 1024,
+            encryption_key=self.encryption_key,
+        )
+        other_cache.put("key", "application/pdf", [CONTENT])
+        os.unlink(other_cache.get_index_path("key"))
+
+        self.cache.purge_grace_seconds = 60
+        self.cache.purge()
+        self.assertEqual(len(os.listdir(self.cache.objects_directory)), 1)
+
+        self.cache.purge_grace_seconds = 0
+        self.cache.purge()
+        self.assertEqual(os.listdir(self.cache.objects_directory), [])
+
+    def test_put_and_get_purged(self):
+        document = self.cache.put_and_get("key", "application/pdf", [CONTENT])
+
+        # Purged by another worker before the document is sent
+        self.cache.ttl = 0
+        self.cache.purge()
+        self.assertEqual(os.listdir(self.cache.objects_directory), [])
+
+        self.assertEqual(document["Content-Type"], "application/pdf")
+        self.assertEqual(document["etag"], self.create_etag(CONTENT))
+        self.assertEqual(self.read(document), CONTENT)
+
+    def test_purge_removed_concurrently(self):
+        self.cache.put("key", "application/pdf", [CONTENT])
+        self.cache.ttl = 0
+
+        read_index = self.cache.read_index
+
+        def read_index_purged(key):
+            entry = read_index(key)
+            # Purged by another worker in the meantime
+            os.unlink(self.cache.get_index_path(key))
+            return entry
+
+        with patch.object(self.cache, "read_index", read_index_purged):
+            self.cache.purge()
+
+        self.assertEqual(os.listdir(self.cache.objects_directory), [])
+
+    def test_failed_put(self):
+        def chunks():
+            yield CONTENT
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            self.cache.put("key", "application/pdf", chunks())
+
+        self.assertEqual(os.listdir(self.cache.objects_directory), [])
+
+
+class EncryptedDocumentCacheTest(DocumentCacheTest):
+    encryption_key = Fernet.generate_key()
+
+    def create_etag(self, content):
+        return hmac.new(self.cache.name_key, content, hashlib.sha256).hexdigest()
+
+    def test_close_unread(self):
+        self.cache.put("key", "application/pdf", [CONTENT])
+
+        # A 304 response closes the document without reading it
+        file_data = self.cache.get("key")["file_data"]
+        file_data.close()
+
+        self.assertTrue(file_data.file.closed)
+
+    def test_etag_not_content_hash(self):
+        etag = self.cache.put("key", "application/pdf", [CONTENT])
+
+        self.assertNotEqual(etag, hashlib.sha256(CONTENT).hexdigest())
+        self.assertNotIn(
+            hashlib.sha256(CONTENT).hexdigest(),
+            os.listdir(self.cache.objects_directory),
+        )
+
+    def get_object_path(self, key):
+        return self.cache.get_object_path(self.cache.read_index(key)["etag"])
+
+    def test_encrypted_at_rest(self):
+        self.cache.put("key", "application/pdf", [CONTENT])
+
+        with open(self.get_object_path("key"), "rb") as file:
+            self.assertNotIn(CONTENT[:100], file.read())
+
+    def test_tampered(self):
+        self.cache.put("key", "application/pdf", [CONTENT])
+
+        with open(self.get_object_path("key"), "r+b") as file:
+            file.seek(-1, os.SEEK_END)
+            file.write(b"x")
+
+        with self.assertRaises(InvalidTag):
+            self.read(self.cache.get("key"))
+
+    def test_truncated(self):
+        self.cache.put("key", "application/pdf", [CONTENT])
+
+        with open(self.get_object_path("key"), "r+b") as file:
+            file.truncate(CHUNK_SIZE + 100)
+
+        with self.assertRaises(InvalidTag):
+            self.read(self.cache.get("key"))
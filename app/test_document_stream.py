@@ -0,0 +1,109 @@
+import base64
+import json
+from unittest import TestCase
+from unittest.mock import Mock
+
+from app.document_stream import JSONStreamReader, decode_base64_chunks, read_document
+
+CONTENT = bytes(range(256)) * 50
+
+
+def split_chunks(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+class JSONStreamReaderTest(TestCase):
+    def read_object(self, data, chunk_size=3):
+        reader = JSONStreamReader(split_chunks(data, chunk_size))
+        return {key: reader.read_value() for key in reader.iter_object()}
+
+    def test_read_object(self):
+        source = {
+            "omschrijving": 'Beschikking "WRV" \\ café \U0001f600',
+            "nummer": 12,
+            "leeg": None,
+            "actueel": True,
+            "lijst": [1, {"a": "}"}, "]"],
+            "object": {"b": [None, False]},
+        }
+
+        for chunk_size in [1, 2, 3, 7, 1000]:
+            self.assertEqual(
+                self.read_object(json.dumps(source).encode(), chunk_size), source
+            )
+
+        self.assertEqual(
+            self.read_object(json.dumps(source, ensure_ascii=False).encode()), source
+        )
+
+    def test_read_object_whitespace(self):
+        self.assertEqual(
+            self.read_object(b' { "a" : 1 ,\n "b" : "x\\/y" } '), {"a": 1, "b": "x/y"}
+        )
+
+    def test_read_empty_object(self):
+        self.assertEqual(self.read_object(b"{}"), {})
+
+    def test_unexpected_end(self):
+        with self.assertRaises(ValueError):
+            self.read_object(b'{"a": "abc')
+
+
+class DecodeBase64Test(TestCase):
+    def test_decode_chunks(self):
+        encoded = base64.b64encode(CONTENT)
+
+        for chunk_size in [1, 5, 4096]:
+            decoded = b"".join(decode_base64_chunks(split_chunks(encoded, chunk_size)))
+            self.assertEqual(decoded, CONTENT)
+
+    def test_decode_line_breaks(self):
+        encoded = base64.encodebytes(CONTENT)
+        self.assertIn(b"\n", encoded)
+
+        decoded = b"".join(decode_base64_chunks(split_chunks(encoded, 10)))
+        self.assertEqual(decoded, CONTENT)
+
+
+class ReadDocumentTest(TestCase):
+    def get_response_chunks(self, document, chunk_size=100):
+        return split_chunks(json.dumps(document).encode(), chunk_size)
+
+    def test_mimetype_first(self):
+        close = Mock()
+        document = {
+            "mimetype": "application/pdf",
+            "inhoud": base64.b64encode(CONTENT).decode(),
+            "omschrijving": "WRV rapport",
+        }
+
+        result = read_document(self.get_response_chunks(document), 1024, close)
+
+        self.assertEqual(result["Content-Type"], "application/pdf")
+        close.assert_not_called()
+
+        self.assertEqual(b"".join(result["file_data"]), CONTENT)
+        close.assert_called_once()
+
+    def test_mimetype_last(self):
+        close = Mock()
+        document = {
+            "inhoud": base64.b64encode(CONTENT).decode(),
+            "mimetype": "application/pdf",
+        }
+
+        result = read_document(self.get_response_chunks(document), 1024, close)
+
+        self.assertEqual(result["Content-Type"], "application/pdf")
+        close.assert_called_once()
+        self.assertEqual(b"".join(result["file_data"]), CONTENT)
+
+    def test_no_content(self):
+        close = Mock()
+
+        with self.assertRaises(KeyError):
+            read_document(
+                self.get_response_chunks({"mimetype": "application/pdf"}), 1024, close
+            )
+
+        close.assert_called_once()
@@ -0,0 +1,95 @@
+import json
+from unittest import TestCase
+
+import dpath
+
+from app import config
+from app.field_paths import compile_path, compile_plan
+from app.zorgned_service import AANVRAAG_FIELDS
+
+BASE_PATH = config.BASE_PATH
+
+
+class FieldPathsTest(TestCase):
+    def test_compile_path(self):
+        source = {"a": {"b": "value", "c": None, "d": [{"e": 1}]}, "f": 0}
+
+        self.assertEqual(compile_path("f")(source), 0)
+        self.assertEqual(compile_path("a/b")(source), "value")
+        self.assertEqual(compile_path("a/d/0/e")(source), 1)
+        self.assertIsNone(compile_path("a/c", "default")(source))
+
+        self.assertEqual(compile_path("g", "default")(source), "default")
+        self.assertEqual(compile_path("a/c/x", "default")(source), "default")
+        self.assertEqual(compile_path("a/b/x", "default")(source), "default")
+        self.assertEqual(compile_path("a/d/1/e", "default")(source), "default")
+        self.assertEqual(compile_path("a", "default")(None), "default")
+
+        with self.assertRaises(KeyError):
+            compile_path("g")(source)
+
+        with self.assertRaises(KeyError):
+            compile_path("a/x")(None)
+
+    def test_compile_plan(self):
+        extract = compile_plan(
+            {
+                "title": ("product", "omschrijving"),
+                "supplier": ("toegewezen", "leverancier/omschrijving", None),
+            }
+        )
+
+        self.assertEqual(
+            extract({"product": {"omschrijving": "traplift"}, "toegewezen": None}),
+            {"title": "traplift", "supplier": None},
+        )
+
+        with self.assertRaises(KeyError):
+            extract({"product": {}, "toegewezen": None})
+
+    def test_same_as_dpath(self):
+        paths = [
+            "beschikking",
+            "datumAanvraag",
+            "documenten",
+            "beschikking/datumAfgifte",
+            "beschikking/beschikteProducten",
+            "toegewezenProduct",
+            "toegewezenProduct/toewijzingen",
+            "toegewezenProduct/leverancier/omschrijving",
+            "product/omschrijving",
+            "product/productsoortCode",
+            "actueel",
+            "leveringsvorm",
+        ]
+
+        for fixture in ["aanvragen.json", "aanvragen-2.json"]:
+            with open(f"{BASE_PATH}/fixtures/{fixture}", "r") as fixture_file:
+                aanvragen = json.load(fixture_file)["_embedded"]["aanvraag"]
+
+            sources = [None, {}]
+            for aanvraag in aanvragen:
+                sources.append(aanvraag)
+                beschikking = aanvraag.get("beschikking") or {}
+                for product in beschikking.get("beschikteProducten") or []:
+                    sources.append(product)
+                    sources.append(product.get("toegewezenProduct"))
+
+            for source in sources:
+                for path in paths:
+                    with self.subTest(fixture=fixture, path=path):
+                        self.assertEqual(
+                            compile_path(path, "default")(source),
+                            dpath.get(source, path, default="default"),
+                        )
+
+    def test_missing_product(self):
+        with self.assertRaises(KeyError):
+            AANVRAAG_FIELDS(
+                {
+                    "beschikt_product": {"resultaat": "toegewezen"},
+                    "toegewezen_product": None,
+                    "toewijzing": None,
+                    "levering": None,
+                }
+            )
@@ -1,8 +1,26 @@
+import time
+from datetime import date
 from unittest import TestCase
+from unittest.mock import patch
 
+from cryptography.fernet import Fernet, InvalidToken
+from flask import g
 from flask.app import Flask
 
-from app.helpers import error_response_json, success_response_json, to_date
+from app.helpers import (
+    DocumentIdCipher,
+    decrypt,
+    encrypt,
+    error_response_json,
+    get_cipher,
+    get_today,
+    parse_date,
+    success_response_json,
+    to_date,
+)
+
+KEY1 = Fernet.generate_key()
+KEY2 = Fernet.generate_key()
 
 
 class HelpersTest(TestCase):
@@ -12,6 +30,109 @@ class HelpersTest(TestCase):
         self.assertEqual(d.day, 30)
         self.assertEqual(d.month, 4)
 
+    def test_parse_date(self):
+        self.assertEqual(parse_date("2021-04-30"), date(2021, 4, 30))
+        self.assertEqual(parse_date("2021-03-31T15:28:05"), date(2021, 3, 31))
+        # Parsed like strptime does
+        self.assertEqual(parse_date("2021-4-3"), date(2021, 4, 3))
+
+        with self.assertRaises(ValueError):
+            parse_date("2021-W17-5")
+        with self.assertRaises(ValueError):
+            parse_date("2021-02-30")
+
+    def test_parse_date_memoized(self):
+        parse_date.cache_clear()
+
+        parse_date("2021-04-30")
+        self.assertIs(parse_date("2021-04-30"), parse_date("2021-04-30"))
+        self.assertEqual(parse_date.cache_info().hits, 2)
+
+        parse_date.cache_clear()
+
+
+class DocumentIdCipherTest(TestCase):
+    cipher = DocumentIdCipher([KEY1], [KEY2], validity_seconds=60)
+
+    def test_encrypt_deterministic(self):
+        id_encrypted = self.cipher.encrypt("B744593")
+
+        self.assertEqual(self.cipher.encrypt("B744593"), id_encrypted)
+        self.assertNotEqual(self.cipher.encrypt("B740440"), id_encrypted)
+        self.assertEqual(self.cipher.decrypt(id_encrypted), "B744593")
+
+    def test_encrypt_many(self):
+        ids_encrypted = self.cipher.encrypt_many(["B744593", "B740440"])
+
+        self.assertEqual(ids_encrypted[0], self.cipher.encrypt("B744593"))
+        self.assertEqual(
+            self.cipher.decrypt_many(ids_encrypted), ["B744593", "B740440"]
+        )
+        self.assertEqual(self.cipher.encrypt_many([]), [])
+
+    def test_decrypt_invalid(self):
+        id_encrypted = self.cipher.encrypt("B744593")
+
+        with self.assertRaises(InvalidToken):
+            self.cipher.decrypt(id_encrypted[:-2] + "AA")
+        with self.assertRaises(InvalidToken):
+            self.cipher.decrypt("not-an-id!")
+
+    def test_decrypt_key_rotation(self):
+        id_encrypted = self.cipher.encrypt("B744593")
+
+        cipher_rotated = DocumentIdCipher([KEY2, KEY1])
+        self.assertEqual(cipher_rotated.decrypt(id_encrypted), "B744593")
+        self.assertNotEqual(cipher_rotated.encrypt("B744593"), id_encrypted)
+
+        with self.assertRaises(InvalidToken):
+            DocumentIdCipher([KEY2]).decrypt(id_encrypted)
+
+    def test_decrypt_fernet(self):
+        id_encrypted = Fernet(KEY2).encrypt(b"B744593").decode()
+
+        self.assertEqual(self.cipher.decrypt(id_encrypted), "B744593")
+        self.assertEqual(self.cipher.decrypt_document_id(id_encrypted), "B744593")
+
+        id_expired = Fernet(KEY2).encrypt_at_time(b"B744593", 0).decode()
+
+        with self.assertRaises(InvalidToken):
+            self.cipher.decrypt_document_id(id_expired)
+
+        with self.assertRaises(InvalidToken):
+            DocumentIdCipher([KEY1]).decrypt(id_encrypted)
+
+    def test_validity(self):
+        id_encrypted = self.cipher.encrypt("B744593")
+        validity = self.cipher.create_validity(id_encrypted)
+
+        self.assertEqual(self.cipher.create_validity(id_encrypted), validity)
+        self.assertEqual(
+            self.cipher.decrypt_document_id(id_encrypted, validity), "B744593"
+        )
+
+        # Bound to the id
+        with self.assertRaises(InvalidToken):
+            self.cipher.decrypt_document_id(self.cipher.encrypt("B740440"), validity)
+
+        with self.assertRaises(InvalidToken):
+            self.cipher.decrypt_document_id(id_encrypted)
+
+        validity_expired = self.cipher.create_validity(id_encrypted, time.time() - 120)
+
+        with self.assertRaises(InvalidToken):
+            self.cipher.decrypt_document_id(id_encrypted, validity_expired)
+
+    @patch("app.helpers._cipher", None)
+    @patch("app.helpers.DOCUMENT_ID_ENCRYPTION_KEYS", [KEY1])
+    def test_get_cipher_per_process(self):
+        cipher = get_cipher()
+        self.assertIs(get_cipher(), cipher)
+        self.assertEqual(decrypt(encrypt("B744593")), "B744593")
+
+        with patch("app.helpers.os.getpid", return_value=cipher.pid + 1):
+            self.assertIsNot(get_cipher(), cipher)
+
 
 app = Flask(__name__)
 
@@ -30,3 +151,14 @@ class RequestHelpersTest(TestCase):
             self.assertEqual(
                 resp.json, {"message": "Things went south", "status": "ERROR"}
             )
+
+    def test_get_today(self):
+        self.assertEqual(get_today(), date.today())
+
+        with app.test_request_context():
+            today = get_today()
+            self.assertEqual(today, date.today())
+
+            # Once per request
+            g.today = date(2000, 1, 1)
+            self.assertEqual(get_today(), date(2000, 1, 1))
@@ -0,0 +1,85 @@
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from decimal import Decimal
+from unittest import TestCase, skipIf
+
+from flask import Flask
+
+from app.config import UpdatedJSONProvider
+from app.json_provider import OrjsonJSONProvider, create_json_provider, orjson
+
+
+@dataclass
+class Product:
+    title: str
+    date_start: date
+
+
+VALUES = [
+    None,
+    {"status": "OK", "content": [{"b": 1, "a": [True, False, None, 1.5]}]},
+    {"date": date(2021, 3, 31), "time": time(9, 5, 1), "nested": {"z": "", "y": []}},
+    [datetime(2021, 3, 31, 15, 28, 5), datetime(2021, 3, 31, 15, 28, 5, 120)],
+    [Product("traplift", date(2021, 3, 4)), Decimal("1.10")],
+    # Not supported by orjson, these go through json
+    {"big": 2**70},
+    {1: "one", 2: "two"},
+]
+
+
+@skipIf(orjson is None, "orjson is not installed")
+class JSONProviderTest(TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.orjson_provider = OrjsonJSONProvider(self.app)
+        self.json_provider = UpdatedJSONProvider(self.app)
+
+    def test_create_json_provider(self):
+        self.assertIsInstance(
+            create_json_provider(self.app, "orjson"), OrjsonJSONProvider
+        )
+        self.assertIs(type(create_json_provider(self.app, "json")), UpdatedJSONProvider)
+        # Opt-in, orjson does not escape non-ascii characters
+        self.assertIs(type(create_json_provider(self.app)), UpdatedJSONProvider)
+
+    def test_dumps(self):
+        for value in VALUES:
+            for args in [{"separators": (",", ":")}, {"indent": 2}, {}]:
+                with self.subTest(value=value, args=args):
+                    self.assertEqual(
+                        self.orjson_provider.dumps(value, **args),
+                        self.json_provider.dumps(value, **args),
+                    )
+
+    def test_dumps_unicode(self):
+        value = {"title": "financiële tegemoetkoming 😀", "escaped": '"\\\n\t\x01'}
+        dumped = self.orjson_provider.dumps(value, separators=(",", ":"))
+
+        self.assertEqual(json.loads(dumped), value)
+        self.assertIn("financiële", dumped)
+
+    def test_dumps_error(self):
+        with self.assertRaises(TypeError):
+            self.orjson_provider.dumps({"value": object()})
+
+    def test_response(self):
+        for value in VALUES:
+            with self.subTest(value=value), self.app.app_context():
+                response = self.orjson_provider.response(value)
+
+                self.assertEqual(response.data, self.json_provider.response(value).data)
+                self.assertEqual(response.mimetype, "application/json")
+
+    def test_response_indented(self):
+        self.app.debug = True
+
+        with self.app.app_context():
+            response = self.orjson_provider.response(
+                {"b": [1, {}], "a": date(2021, 3, 31)}
+            )
+
+        self.assertEqual(
+            response.data,
+            b'{\n  "a": "2021-03-31",\n  "b": [\n    1,\n    {}\n  ]\n}\n',
+        )
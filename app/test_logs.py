@@ -0,0 +1,102 @@
+import logging
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from app.logs import LazyJson, RepeatFilter, WorkerQueueHandler
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.threads = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+        self.threads.append(threading.get_ident())
+
+
+def create_record(msg, level=logging.ERROR, lineno=1, exc_info=None):
+    return logging.LogRecord("test", level, "test.py", lineno, msg, None, exc_info)
+
+
+class LogsTest(TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("app.test_logs")
+        self.logger.propagate = False
+        self.handler = ListHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_lazy_json(self):
+        self.logger.setLevel(logging.INFO)
+
+        with patch("app.logs.json.dumps", return_value="{}") as dumps_mock:
+            self.logger.debug("%s", LazyJson({"a": 1}, indent=4))
+            dumps_mock.assert_not_called()
+
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.debug("%s", LazyJson({"a": 1}))
+
+        self.assertEqual(self.handler.messages, ['{"a": 1}'])
+
+    def test_repeat_filter(self):
+        repeat_filter = RepeatFilter(60)
+
+        with patch("app.logs.time.monotonic", return_value=100):
+            self.assertTrue(repeat_filter.filter(create_record("down")))
+            self.assertFalse(repeat_filter.filter(create_record("down")))
+            self.assertFalse(repeat_filter.filter(create_record("down")))
+
+            # Another message, line or level
+            self.assertTrue(repeat_filter.filter(create_record("other")))
+            self.assertTrue(repeat_filter.filter(create_record("down", lineno=2)))
+            self.assertTrue(repeat_filter.filter(create_record("down", logging.INFO)))
+            self.assertTrue(repeat_filter.filter(create_record("down", logging.INFO)))
+
+        with patch("app.logs.time.monotonic", return_value=160):
+            record = create_record("down")
+            self.assertTrue(repeat_filter.filter(record))
+            self.assertEqual(record.getMessage(), "down (repeated 2 times)")
+
+            self.assertFalse(repeat_filter.filter(create_record("down")))
+
+    def test_repeat_filter_exceptions(self):
+        repeat_filter = RepeatFilter(60)
+
+        def create_error_record(error):
+            return create_record(error, exc_info=(type(error), error, None))
+
+        self.assertTrue(repeat_filter.filter(create_error_record(ValueError("a"))))
+        self.assertFalse(repeat_filter.filter(create_error_record(ValueError("a"))))
+        self.assertTrue(repeat_filter.filter(create_error_record(ValueError("b"))))
+        self.assertTrue(repeat_filter.filter(create_error_record(KeyError("a"))))
+
+    def test_repeat_filter_inactive(self):
+        repeat_filter = RepeatFilter(0)
+
+        self.assertTrue(repeat_filter.filter(create_record("down")))
+        self.assertTrue(repeat_filter.filter(create_record("down")))
+
+    def test_worker_queue_handler(self):
+        queue_handler = WorkerQueueHandler(self.handler)
+        self.logger.removeHandler(self.handler)
+        self.logger.addHandler(queue_handler)
+        self.logger.setLevel(logging.DEBUG)
+
+        try:
+            raise ValueError("upstream down")
+        except ValueError:
+            self.logger.exception("Request failed %s", 1)
+
+        queue_handler.stop_listener()
+        self.logger.removeHandler(queue_handler)
+
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertTrue(self.handler.messages[0].startswith("Request failed 1\n"))
+        self.assertIn("ValueError: upstream down", self.handler.messages[0])
+        # Written by the listener thread
+        self.assertNotEqual(self.handler.threads[0], threading.get_ident())
@@ -0,0 +1,109 @@
+import tracemalloc
+from unittest import TestCase
+from unittest.mock import patch
+
+from app.memory import MemoryTracker
+from app.metrics import Metrics
+from app.server import app
+
+
+class MemoryTrackerTest(TestCase):
+    def tearDown(self):
+        tracemalloc.stop()
+
+    def test_finish_request(self):
+        tracker = MemoryTracker(budget=1024 * 1024)
+
+        traced_request = tracker.start_request()
+        kept = bytearray(100_000)
+        peak_bytes, net_bytes = tracker.finish_request("small", traced_request)
+
+        # tracemalloc traces the whole process, other allocations and frees move the numbers a little
+        self.assertGreater(peak_bytes, 90_000)
+        self.assertGreater(net_bytes, 90_000)
+
+        traced_request = tracker.start_request()
+        temporary = bytearray(4 * 1024 * 1024)
+        del temporary
+
+        with self.assertLogs(level="WARNING") as logs:
+            peak_bytes, net_bytes = tracker.finish_request("large", traced_request)
+
+        self.assertGreater(peak_bytes, 3 * 1024 * 1024)
+        self.assertLess(net_bytes, 1024 * 1024)
+        self.assertIn("Request to large allocated", logs.output[0])
+
+        stats = tracker.stats()
+
+        self.assertEqual(stats["endpoints"]["small"]["requests"], 1)
+        self.assertEqual(stats["endpoints"]["small"]["overBudget"], 0)
+        self.assertEqual(stats["endpoints"]["large"]["overBudget"], 1)
+        # The bytearray that is kept
+        self.assertIn("test_memory.py:", stats["topAllocations"][0]["site"])
+
+        del kept
+
+    def test_overlapping_requests(self):
+        tracker = MemoryTracker(budget=1024 * 1024)
+
+        first_request = tracker.start_request()
+        temporary = bytearray(4 * 1024 * 1024)
+        del temporary
+
+        # Starts while the first request is running, its peak is not reset
+        second_request = tracker.start_request()
+        self.assertIsNone(tracker.finish_request("second", second_request))
+        self.assertIsNone(tracker.finish_request("first", first_request))
+
+        third_request = tracker.start_request()
+        self.assertIsNotNone(tracker.finish_request("third", third_request))
+
+        stats = tracker.stats()
+
+        self.assertEqual(stats["endpoints"]["first"]["requests"], 1)
+        self.assertEqual(stats["endpoints"]["first"]["overlapping"], 1)
+        self.assertEqual(stats["endpoints"]["first"]["peakBytesMax"], 0)
+        self.assertEqual(stats["endpoints"]["second"]["overlapping"], 1)
+        self.assertEqual(stats["endpoints"]["third"]["overlapping"], 0)
+        self.assertEqual(tracker.active_requests, set())
+
+    def test_not_tracing(self):
+        tracemalloc.stop()
+
+        stats = MemoryTracker().stats()
+
+        self.assertEqual(stats["tracedBytes"], 0)
+        self.assertEqual(stats["topAllocations"], [])
+
+
+@patch("app.auth.STATUS_TOKEN", "status-token")
+@patch("app.metrics._metrics", Metrics(None))
+class MemoryStatusTest(TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        tracemalloc.stop()
+
+    def get_memory_status(self, token="status-token"):
+        return self.client.get(
+            "/status/memory?limit=5", headers={"Authorization": f"Bearer {token}"}
+        )
+
+    def test_memory_status_protected(self):
+        self.assertEqual(self.get_memory_status("other").status_code, 401)
+        # Not active
+        self.assertEqual(self.get_memory_status().status_code, 404)
+
+    @patch("app.memory.MEMORY_TRACING_ACTIVE", True)
+    @patch("app.memory._tracker", MemoryTracker())
+    def test_memory_status(self):
+        self.client.get("/status/health")
+
+        response = self.get_memory_status()
+        content = response.json["content"]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content["endpoints"]["health_check"]["requests"], 1)
+        self.assertLessEqual(len(content["topAllocations"]), 5)
+        self.assertGreater(content["tracedBytes"], 0)
@@ -0,0 +1,167 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from app.metrics import Metrics
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.metrics = Metrics(self.directory.name, flush_seconds=60)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def list_files(self):
+        return sorted(
+            file_name
+            for file_name in os.listdir(self.directory.name)
+            if file_name.endswith(".json")
+        )
+
+    def create_exited_worker(self):
+        process = subprocess.Popen([sys.executable, "-c", ""])
+        process.wait()
+        worker = Metrics(self.directory.name)
+        worker.pid = process.pid
+        return worker
+
+    def test_counter(self):
+        self.metrics.inc("wmoned_responses_total", endpoint="a", status=200)
+        self.metrics.inc("wmoned_responses_total", 2, status=200, endpoint="a")
+        self.metrics.inc("wmoned_response_bytes_total", 10, endpoint='x"y')
+
+        text = self.metrics.render()
+
+        self.assertIn("# TYPE wmoned_responses_total counter\n", text)
+        self.assertIn('wmoned_responses_total{endpoint="a",status="200"} 3\n', text)
+        self.assertIn('wmoned_response_bytes_total{endpoint="x\\"y"} 10\n', text)
+
+    def test_histogram(self):
+        for value in [0.0005, 0.003, 0.003, 20]:
+            self.metrics.observe("wmoned_parse_seconds", value, operation="/aanvragen")
+
+        text = self.metrics.render()
+        labels = 'operation="/aanvragen"'
+
+        self.assertIn("# TYPE wmoned_parse_seconds histogram\n", text)
+        self.assertIn(f'wmoned_parse_seconds_bucket{{{labels},le="0.001"}} 1\n', text)
+        self.assertIn(f'wmoned_parse_seconds_bucket{{{labels},le="0.0025"}} 1\n', text)
+        self.assertIn(f'wmoned_parse_seconds_bucket{{{labels},le="0.005"}} 3\n', text)
+        self.assertIn(f'wmoned_parse_seconds_bucket{{{labels},le="10.0"}} 3\n', text)
+        self.assertIn(f'wmoned_parse_seconds_bucket{{{labels},le="+Inf"}} 4\n', text)
+        self.assertIn(f"wmoned_parse_seconds_sum{{{labels}}} 20.0065\n", text)
+        self.assertIn(f"wmoned_parse_seconds_count{{{labels}}} 4\n", text)
+
+    def test_timer(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.timer("wmoned_format_seconds", pipeline="aanvragen"):
+                raise ValueError()
+
+        counters, histograms = self.metrics.collect()
+
+        histogram = histograms[("wmoned_format_seconds", (("pipeline", "aanvragen"),))]
+        self.assertEqual(sum(histogram[:-1]), 1)
+
+    def test_workers(self):
+        other_worker = Metrics(self.directory.name)
+        other_worker.pid = 1
+        other_worker.inc("wmoned_upstream_errors_total", error="timeout")
+        other_worker.observe("wmoned_serialize_seconds", 0.2)
+
+        self.metrics.inc("wmoned_upstream_errors_total", error="timeout")
+        self.metrics.observe("wmoned_serialize_seconds", 0.3)
+
+        # Not written yet
+        self.assertIn(
+            'wmoned_upstream_errors_total{error="timeout"} 1\n', self.metrics.render()
+        )
+
+        other_worker.flush_if_due()
+        text = self.metrics.render()
+
+        self.assertIn('wmoned_upstream_errors_total{error="timeout"} 2\n', text)
+        self.assertIn('wmoned_serialize_seconds_bucket{le="0.25"} 1\n', text)
+        self.assertIn('wmoned_serialize_seconds_bucket{le="0.5"} 2\n', text)
+        self.assertIn("wmoned_serialize_seconds_count 2\n", text)
+
+        self.assertEqual(self.list_files(), ["1.json", f"{os.getpid()}.json"])
+
+        with open(os.path.join(self.directory.name, "1.json")) as metrics_file:
+            self.assertEqual(len(json.load(metrics_file)["counters"]), 1)
+
+    def test_exited_workers(self):
+        for _ in range(3):
+            worker = self.create_exited_worker()
+            worker.inc("wmoned_responses_total", status=200)
+            worker.observe("wmoned_serialize_seconds", 0.2)
+            worker.flush()
+
+            self.metrics.inc("wmoned_responses_total", status=200)
+            text = self.metrics.render()
+
+            # The files of exited workers are added to the archive
+            self.assertEqual(
+                self.list_files(), sorted(["archive.json", f"{os.getpid()}.json"])
+            )
+
+        self.assertIn('wmoned_responses_total{status="200"} 6\n', text)
+        self.assertIn("wmoned_serialize_seconds_count 3\n", text)
+
+    def test_gauge(self):
+        self.metrics.set_gauge("wmoned_circuit_breaker_state", 1, state="open")
+
+        worker = self.create_exited_worker()
+        worker.set_gauge("wmoned_circuit_breaker_state", 1, state="open")
+        worker.inc("wmoned_circuit_breaker_transitions_total")
+        worker.flush()
+
+        text = self.metrics.render()
+
+        self.assertIn("# TYPE wmoned_circuit_breaker_state gauge\n", text)
+        # The gauge of the exited worker is dropped, its counters are kept
+        self.assertIn('wmoned_circuit_breaker_state{state="open"} 1\n', text)
+        self.assertIn("wmoned_circuit_breaker_transitions_total 1\n", text)
+
+        other_worker = Metrics(self.directory.name)
+        other_worker.pid = 1
+        other_worker.set_gauge("wmoned_circuit_breaker_state", 1, state="open")
+        other_worker.flush()
+
+        # Workers in the state
+        self.assertIn(
+            'wmoned_circuit_breaker_state{state="open"} 2\n', self.metrics.render()
+        )
+
+    def test_reused_pid(self):
+        worker = self.create_exited_worker()
+        worker.inc("wmoned_responses_total", 5)
+        worker.flush()
+
+        # A new worker that got the pid of the exited worker
+        new_worker = Metrics(self.directory.name)
+        new_worker.pid = worker.pid
+        new_worker.inc("wmoned_responses_total")
+        new_worker.flush()
+
+        self.assertIn("wmoned_responses_total 6\n", self.metrics.render())
+
+    def test_flush_if_due(self):
+        self.metrics.flush_if_due()
+        self.metrics.inc("wmoned_responses_total")
+        self.metrics.flush_if_due()
+
+        with open(
+            os.path.join(self.directory.name, f"{os.getpid()}.json")
+        ) as metrics_file:
+            self.assertEqual(json.load(metrics_file)["counters"], [])
+
+    def test_without_directory(self):
+        metrics = Metrics(None)
+        metrics.inc("wmoned_responses_total")
+
+        self.assertIn("wmoned_responses_total 1\n", metrics.render())
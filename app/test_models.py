@@ -0,0 +1,111 @@
+import json
+from datetime import date, datetime, time
+from unittest import TestCase
+
+from flask import Flask
+
+from app.config import UpdatedJSONProvider
+from app.helpers import success_response_json
+from app.models import (
+    Document,
+    Voorziening,
+    encode_models,
+    encode_success_response,
+    encode_value,
+)
+
+app = Flask(__name__)
+app.json = UpdatedJSONProvider(app)
+
+
+def create_voorziening(**kwargs):
+    return Voorziening(
+        **{
+            "date_decision": "2021-03-31",
+            "title": "traplift recht",
+            "item_type_code": "WRA1",
+            "date_start": "2021-03-04",
+            "date_end": None,
+            "is_actual": True,
+            "delivery_type": "ZIN",
+            "supplier": "Handicare Stairlifts B.V.",
+            "service_order_date": "2021-03-31",
+            "service_date_start": "2021-04-22",
+            "service_date_end": None,
+            "documents": None,
+            **kwargs,
+        }
+    )
+
+
+class ModelsTest(TestCase):
+    def test_dict_round_trip(self):
+        voorziening = create_voorziening(
+            documents=[
+                Document(
+                    id="xx1234567890xx",
+                    title="WRV rapport",
+                    url="/wmoned/document/xx1234567890xx?validity=yy",
+                    date_published="2021-03-31T15:28:05",
+                )
+            ]
+        )
+
+        data = voorziening.to_dict()
+
+        self.assertEqual(data["itemTypeCode"], "WRA1")
+        self.assertEqual(data["documents"][0]["datePublished"], "2021-03-31T15:28:05")
+        self.assertEqual(
+            Voorziening.from_dict(json.loads(json.dumps(data))), voorziening
+        )
+
+    def test_encode_value(self):
+        for value in [
+            None,
+            True,
+            False,
+            0,
+            1.5,
+            'é€😀"\\</\n',
+            [None, {"b": 1, "a": 2}],
+        ]:
+            self.assertEqual(
+                encode_value(value),
+                json.dumps(value, sort_keys=True, separators=(",", ":")),
+            )
+
+        with app.app_context():
+            for value in [
+                date(2021, 3, 31),
+                datetime(2021, 3, 31, 15, 28),
+                time(9, 5, 1),
+            ]:
+                self.assertEqual(encode_value(value), app.json.dumps(value))
+
+    def test_encode_success_response(self):
+        voorzieningen = [
+            create_voorziening(title="douchezitje aan de wand (opklapbaar)"),
+            create_voorziening(
+                title="financiële tegemoetkoming",
+                is_actual=False,
+                supplier=None,
+                documents=[
+                    Document(
+                        id="xx1234567890xx",
+                        title='Besluit "rolstoel"',
+                        url="/wmoned/document/xx1234567890xx?validity=yy",
+                        date_published="2021-03-31T15:28:05",
+                    )
+                ],
+            ),
+        ]
+
+        with app.test_request_context():
+            response = success_response_json(
+                [voorziening.to_dict() for voorziening in voorzieningen]
+            )
+
+        self.assertEqual(
+            encode_success_response(encode_models(voorzieningen)), response.data
+        )
+        self.assertEqual(encode_models([]), b"[]")
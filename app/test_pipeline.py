@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from app.pipeline import Pipeline
+
+
+def double(items):
+    for item in items:
+        yield item * 2
+
+
+def only_even(items):
+    for item in items:
+        if item % 2 == 0:
+            yield item
+
+
+class PipelineTest(TestCase):
+    def test_run(self):
+        pipeline = Pipeline(("even", only_even), ("double", double))
+
+        self.assertEqual(list(pipeline.run(range(5))), [0, 4, 8])
+        self.assertEqual(list(pipeline.run([])), [])
+        self.assertEqual(
+            pipeline.stats(), {"runs": 2, "stages": {"even": 3, "double": 3}}
+        )
+
+    def test_run_lazy(self):
+        consumed = []
+
+        def source():
+            for item in range(100):
+                consumed.append(item)
+                yield item
+
+        pipeline = Pipeline(("even", only_even), ("double", double))
+        items = pipeline.run(source())
+
+        self.assertEqual(consumed, [])
+        self.assertEqual(next(items), 0)
+        self.assertEqual(next(items), 4)
+        self.assertEqual(consumed, [0, 1, 2])
+
+        items.close()
+
+        # Counted when the run is stopped early too
+        self.assertEqual(pipeline.stats()["stages"], {"even": 2, "double": 2})
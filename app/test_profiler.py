@@ -0,0 +1,139 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from app.metrics import Metrics
+from app.profiler import (
+    StackSampler,
+    create_profile_header,
+    is_valid_profile_header,
+)
+from app.server import app
+
+
+def busy_wait(stop):
+    while not stop.is_set():
+        pass
+
+
+class ProfilerTest(TestCase):
+    def test_is_valid_profile_header(self):
+        expires = int(time.time()) + 60
+        header = create_profile_header("secret", "/status/health", expires)
+
+        self.assertTrue(is_valid_profile_header(header, "/status/health", "secret"))
+
+        self.assertFalse(is_valid_profile_header(header, "/status/health", None))
+        self.assertFalse(is_valid_profile_header(header, "/status/health", "other"))
+        self.assertFalse(is_valid_profile_header(header, "/status/cache", "secret"))
+        self.assertFalse(is_valid_profile_header("x.y", "/status/health", "secret"))
+        self.assertFalse(
+            is_valid_profile_header(
+                create_profile_header("secret", "/status/health", expires - 120),
+                "/status/health",
+                "secret",
+            )
+        )
+
+    def test_stack_sampler(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_wait, args=(stop,))
+        thread.start()
+
+        sampler = StackSampler(0.001, [thread.ident])
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+
+        stop.set()
+        thread.join()
+
+        collapsed = sampler.collapsed()
+
+        self.assertGreater(sampler.samples, 0)
+        self.assertIn("test_profiler.py:busy_wait", collapsed)
+        self.assertTrue(collapsed.startswith("threading.py:Thread._bootstrap;"))
+        self.assertNotIn("StackSampler.run", collapsed)
+
+
+@patch("app.metrics._metrics", Metrics(None))
+class ProfilerServerTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_health(self, headers={}):
+        with patch("app.profiler.PROFILER_DIRECTORY", self.directory.name):
+            self.client.get("/status/health", headers=headers)
+
+        return sorted(os.listdir(self.directory.name))
+
+    def test_inactive(self):
+        with patch("app.profiler.PROFILER_SAMPLE_RATE", 1):
+            self.assertEqual(self.get_health(), [])
+
+    @patch("app.profiler.PROFILER_ACTIVE", True)
+    @patch("app.profiler.PROFILER_SECRET", "secret")
+    def test_signed_header(self):
+        self.assertEqual(self.get_health(), [])
+        self.assertEqual(self.get_health({"X-Profile": "1.invalid"}), [])
+
+        header = create_profile_header(
+            "secret", "/status/health", int(time.time()) + 60
+        )
+        files = self.get_health({"X-Profile": header})
+
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].endswith("-health_check.collapsed"))
+        self.assertTrue(files[1].endswith("-health_check.prof"))
+
+    @patch("app.profiler.PROFILER_ACTIVE", True)
+    @patch("app.profiler.PROFILER_SAMPLE_RATE", 1)
+    def test_sample_rate(self):
+        self.assertEqual(len(self.get_health()), 2)
+
+    def get_profile_status(self, token="status-token", query=""):
+        return self.client.get(
+            f"/status/profile{query}", headers={"Authorization": f"Bearer {token}"}
+        )
+
+    def test_profile_status_protected(self):
+        self.assertEqual(self.get_profile_status().status_code, 401)
+
+        with patch("app.auth.STATUS_TOKEN", "status-token"):
+            self.assertEqual(self.get_profile_status("other").status_code, 401)
+            self.assertEqual(self.get_profile_status("").status_code, 401)
+            # Not active
+            self.assertEqual(self.get_profile_status().status_code, 404)
+
+    @patch("app.auth.STATUS_TOKEN", "status-token")
+    @patch("app.profiler.SAMPLING_PROFILER_ACTIVE", True)
+    def test_profile_status(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_wait, args=(stop,))
+        thread.start()
+
+        # Sampled by hand instead of a background thread
+        sampler = StackSampler(0.01)
+        sampler.sample()
+        sampler.sample()
+
+        stop.set()
+        thread.join()
+
+        with patch("app.profiler._sampler", sampler):
+            response = self.get_profile_status(query="?reset=true")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Profile-Samples"], "2")
+        self.assertEqual(response.headers["X-Profile-Pid"], str(os.getpid()))
+        self.assertIn(";test_profiler.py:busy_wait", response.data.decode())
+
+        self.assertEqual(sampler.samples, 0)
+        self.assertEqual(sampler.collapsed(), "")
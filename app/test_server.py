@@ -1,8 +1,20 @@
+import base64
 import json
 import os
+import tempfile
+from datetime import date
 from unittest.mock import patch
 
+from cryptography.fernet import Fernet
+
 from app.auth import FlaskServerTestCase
+from app.circuit_breaker import CircuitOpenError
+from app.deadline import DeadlineExceeded
+from app.document_cache import DocumentCache
+from app.helpers import DocumentIdCipher
+from app.metrics import Metrics
+
+CIPHER = DocumentIdCipher([Fernet.generate_key()])
 
 MOCK_ENV_VARIABLES = {
     "WMO_NED_API_TOKEN": "123123",
@@ -30,6 +42,18 @@ class ZorgnedApiMock:
     def json(self):
         return self.response_json
 
+    @property
+    def content(self):
+        return json.dumps(self.response_json).encode()
+
+    def iter_content(self, chunk_size=1):
+        content = self.content
+        for i in range(0, len(content), chunk_size):
+            yield content[i : i + chunk_size]
+
+    def close(self):
+        pass
+
     def raise_for_status(self):
         if self.status_code != 200:
             raise Exception("Request failed")
@@ -50,11 +74,13 @@ class ZorgnedApiMockError(ZorgnedApiMock):
         "MA_OTAP_ENV": "unittesting",
     },
 )
+# The metrics of the test requests are not written to the metrics directory
+@patch("app.metrics._metrics", Metrics(None))
 class TestAPI(FlaskServerTestCase):
     app = app
     TEST_BSN = "111222333"
 
-    @patch("app.zorgned_service.requests.post", autospec=True)
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
     def test_get_voorzieningen(self, api_mocked):
         api_mocked.return_value = ZorgnedApiMock(BASE_PATH + "/fixtures/aanvragen.json")
 
@@ -139,7 +165,7 @@ class TestAPI(FlaskServerTestCase):
             ],
         )
 
-    @patch("app.zorgned_service.requests.post", autospec=True)
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
     def test_get_voorzieningen_2(self, api_mocked):
         api_mocked.return_value = ZorgnedApiMock(
             BASE_PATH + "/fixtures/aanvragen-2.json"
@@ -150,7 +176,57 @@ class TestAPI(FlaskServerTestCase):
         self.assertEqual(res.status_code, 200, res.data)
         self.assertEqual(res.json["status"], "OK")
 
-    @patch("app.zorgned_service.requests.post", autospec=True)
+    @patch("app.helpers.get_cipher", lambda: CIPHER)
+    @patch("app.zorgned_service.ZORGNED_DOCUMENT_ATTACHMENTS_ACTIVE", True)
+    @patch("app.zorgned_service.MINIMUM_REQUEST_DATE_FOR_DOCUMENTS", date(2018, 1, 1))
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
+    def test_get_voorzieningen_etag(self, api_mocked):
+        # A fresh response for every call, like ZorgNed
+        api_mocked.side_effect = lambda *args, **kwargs: ZorgnedApiMock(
+            BASE_PATH + "/fixtures/aanvragen-2.json"
+        )
+
+        res1 = self.get_secure("/wmoned/voorzieningen")
+        res2 = self.get_secure("/wmoned/voorzieningen")
+
+        # Document ids are deterministic, the same voorzieningen give the same response
+        self.assertIn(b"?validity=", res1.data)
+        self.assertEqual(res1.data, res2.data)
+        self.assertEqual(res1.headers["ETag"], res2.headers["ETag"])
+        # Strong, equal ETags mean byte-equal responses
+        self.assertFalse(res1.headers["ETag"].startswith("W/"))
+
+        res3 = self.get_secure(
+            "/wmoned/voorzieningen",
+            headers={"If-None-Match": res1.headers["ETag"]},
+        )
+
+        self.assertEqual(res3.status_code, 304)
+        self.assertEqual(res3.data, b"")
+        self.assertEqual(res3.headers["ETag"], res1.headers["ETag"])
+
+        res4 = self.get_secure(
+            "/wmoned/voorzieningen", headers={"If-None-Match": 'W/"other"'}
+        )
+
+        self.assertEqual(res4.status_code, 200)
+
+    @patch("app.server.zorgned.get_voorzieningen_entry")
+    def test_get_voorzieningen_stale(self, get_entry_mocked):
+        get_entry_mocked.return_value = {
+            "content": b"[]",
+            "etag": "abc",
+            "is_stale": True,
+        }
+
+        res = self.get_secure("/wmoned/voorzieningen")
+
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual(res.json["content"], [])
+        self.assertEqual(res.headers["Warning"], '110 - "Response is Stale"')
+        self.assertEqual(res.headers["ETag"], '"abc"')
+
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
     def test_get_voorzieningen_error(self, api_mocked):
         api_mocked.return_value = ZorgnedApiMockError()
 
@@ -160,7 +236,25 @@ class TestAPI(FlaskServerTestCase):
         self.assertEqual(res.json["status"], "ERROR")
         self.assertTrue("content" not in res.json)
 
-    @patch("app.zorgned_service.requests.post", autospec=True)
+    @patch("app.zorgned_service.get_voorzieningen_entry")
+    def test_get_voorzieningen_circuit_open(self, get_entry_mocked):
+        get_entry_mocked.side_effect = CircuitOpenError("Circuit breaker is open")
+
+        res = self.get_secure("/wmoned/voorzieningen")
+
+        self.assertEqual(res.status_code, 503, res.data)
+        self.assertEqual(res.json["status"], "ERROR")
+
+    @patch("app.zorgned_service.get_voorzieningen_entry")
+    def test_get_voorzieningen_deadline_exceeded(self, get_entry_mocked):
+        get_entry_mocked.side_effect = DeadlineExceeded("Request deadline exceeded")
+
+        res = self.get_secure("/wmoned/voorzieningen")
+
+        self.assertEqual(res.status_code, 504, res.data)
+        self.assertEqual(res.json["status"], "ERROR")
+
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
     def test_get_voorzieningen_token_error(self, api_mocked):
         api_mocked.return_value = ZorgnedApiMock(None)
 
@@ -169,6 +263,76 @@ class TestAPI(FlaskServerTestCase):
         self.assertEqual(res.status_code, 401, res.data)
         self.assertEqual(res.json["status"], "ERROR")
 
+    @patch("app.server.decrypt_document_id", return_value="B744593")
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
+    def test_get_document(self, api_mocked, decrypt_mocked):
+        api_mocked.return_value = ZorgnedApiMock(
+            {
+                "inhoud": base64.b64encode(b"%PDF-1.4 some pdf").decode(),
+                "mimetype": "application/pdf",
+                "omschrijving": "WRV rapport",
+            }
+        )
+
+        res = self.get_secure("/wmoned/document/xx1234567890xx")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Content-Type"], "application/pdf")
+        self.assertEqual(res.data, b"%PDF-1.4 some pdf")
+        self.assertEqual(api_mocked.call_args.kwargs["stream"], True)
+
+    @patch("app.server.decrypt_document_id", return_value="B744593")
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
+    def test_get_document_cached(self, api_mocked, decrypt_mocked):
+        api_mocked.return_value = ZorgnedApiMock(
+            {
+                "inhoud": base64.b64encode(b"%PDF-1.4 some pdf").decode(),
+                "mimetype": "application/pdf",
+            }
+        )
+
+        with tempfile.TemporaryDirectory() as directory, patch(
+            "app.zorgned_service.document_cache",
+            DocumentCache(directory, ttl=60, max_bytes=1024),
+        ):
+            res1 = self.get_secure("/wmoned/document/xx1234567890xx")
+            res2 = self.get_secure("/wmoned/document/xx1234567890xx")
+            res3 = self.get_secure(
+                "/wmoned/document/xx1234567890xx",
+                headers={"If-None-Match": res1.headers["ETag"]},
+            )
+
+        self.assertEqual(api_mocked.call_count, 1)
+
+        self.assertEqual(res1.status_code, 200)
+        self.assertEqual(res1.data, b"%PDF-1.4 some pdf")
+        self.assertEqual(res2.data, b"%PDF-1.4 some pdf")
+        self.assertEqual(res1.headers["ETag"], res2.headers["ETag"])
+        self.assertFalse(res1.headers["ETag"].startswith("W/"))
+
+        self.assertEqual(res3.status_code, 304)
+        self.assertEqual(res3.data, b"")
+
+    @patch("app.server.decrypt_document_id", return_value="B744593")
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
+    def test_get_document_purged(self, api_mocked, decrypt_mocked):
+        api_mocked.return_value = ZorgnedApiMock(
+            {
+                "inhoud": base64.b64encode(b"%PDF-1.4 some pdf").decode(),
+                "mimetype": "application/pdf",
+            }
+        )
+
+        # Another worker purges every document right after it is stored
+        with tempfile.TemporaryDirectory() as directory, patch(
+            "app.zorgned_service.document_cache",
+            DocumentCache(directory, ttl=0, max_bytes=0, purge_grace_seconds=0),
+        ):
+            res = self.get_secure("/wmoned/document/xx1234567890xx")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, b"%PDF-1.4 some pdf")
+
     def test_status(self):
         response = self.client.get("/status/health")
         self.assertEqual(response.status_code, 200)
@@ -176,3 +340,44 @@ class TestAPI(FlaskServerTestCase):
             response.data.decode(),
             '{"content":{"buildId":"999","gitSha":"abcdefghijk","otapEnv":"unittesting"},"status":"OK"}\n',
         )
+
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
+    def test_metrics(self, api_mocked):
+        api_mocked.return_value = ZorgnedApiMock(BASE_PATH + "/fixtures/aanvragen.json")
+
+        with tempfile.TemporaryDirectory() as directory, patch(
+            "app.metrics._metrics", Metrics(directory)
+        ):
+            self.get_secure("/wmoned/voorzieningen")
+            self.client.get("/status/health")
+
+            response = self.client.get("/status/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+
+        text = response.data.decode()
+
+        for line in [
+            "# TYPE wmoned_request_seconds histogram",
+            'wmoned_responses_total{endpoint="get_voorzieningen",status="200"} 1',
+            'wmoned_responses_total{endpoint="health_check",status="200"} 1',
+            'wmoned_upstream_request_seconds_count{operation="/aanvragen"} 1',
+            'wmoned_parse_seconds_count{operation="/aanvragen"} 1',
+            'wmoned_format_seconds_count{pipeline="voorzieningen"} 1',
+            'wmoned_serialize_seconds_count{endpoint="get_voorzieningen"} 1',
+        ]:
+            self.assertIn(line, text)
+
+    @patch("app.spans.SERVER_TIMING_ACTIVE", True)
+    @patch("app.zorgned_client.requests.Session.post", autospec=True)
+    def test_server_timing(self, api_mocked):
+        api_mocked.return_value = ZorgnedApiMock(BASE_PATH + "/fixtures/aanvragen.json")
+
+        res = self.get_secure("/wmoned/voorzieningen")
+
+        names = [
+            entry.split(";")[0] for entry in res.headers["Server-Timing"].split(", ")
+        ]
+
+        self.assertEqual(names, ["upstream", "parse", "format", "serialize", "total"])
@@ -0,0 +1,85 @@
+import threading
+from unittest import TestCase
+
+from app.singleflight import SingleFlight
+
+
+class SingleFlightTest(TestCase):
+    def run_concurrent(self, single_flight, fn, count=3):
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(single_flight.do("key", fn))
+            except Exception as error:
+                outcomes.append(error)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+
+        return threads, outcomes
+
+    def wait_for_followers(self, single_flight, count):
+        while single_flight.shared < count:
+            pass
+
+    def test_do(self):
+        self.assertEqual(SingleFlight().do("key", lambda a: a + 1, 1), 2)
+
+    def test_do_shared_result(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait()
+            return ["result"]
+
+        threads, outcomes = self.run_concurrent(single_flight, fn)
+        self.wait_for_followers(single_flight, 2)
+        release.set()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [["result"]] * 3)
+        self.assertIs(outcomes[0], outcomes[1])
+        self.assertEqual(single_flight.stats()["inFlight"], 0)
+
+    def test_do_shared_error(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        error = ValueError("upstream failed")
+
+        def fn():
+            release.wait()
+            raise error
+
+        threads, outcomes = self.run_concurrent(single_flight, fn)
+        self.wait_for_followers(single_flight, 2)
+        release.set()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes, [error] * 3)
+
+        # The next call is not affected by the failed flight
+        self.assertEqual(single_flight.do("key", lambda: "ok"), "ok")
+
+    def test_do_wait_timeout(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+
+        threads, outcomes = self.run_concurrent(single_flight, release.wait, count=1)
+        while not single_flight.flights:
+            pass
+
+        with self.assertRaises(TimeoutError):
+            single_flight.do("key", lambda: None, wait_timeout=0.01)
+
+        release.set()
+        threads[0].join()
@@ -0,0 +1,106 @@
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask, g
+
+from app.spans import (
+    finish_spans,
+    format_server_timing,
+    merge_spans,
+    record_span,
+    span,
+    start_spans,
+)
+
+app = Flask(__name__)
+
+
+class SpansTest(TestCase):
+    def test_format_server_timing(self):
+        self.assertEqual(
+            format_server_timing(
+                [("upstream", 0.12345, "/aanvragen"), ("total", 0.2, None)]
+            ),
+            'upstream;dur=123.5;desc="/aanvragen", total;dur=200.0',
+        )
+        self.assertEqual(
+            format_server_timing([("format", 0.001, 'a"b')]),
+            'format;dur=1.0;desc="a\\"b"',
+        )
+
+    def test_merge_spans(self):
+        self.assertEqual(
+            merge_spans(
+                [
+                    ("encryption", 0.25, "encrypt"),
+                    ("format", 1, None),
+                    ("encryption", 0.5, "encrypt"),
+                ]
+            ),
+            [("encryption", 0.75, "encrypt"), ("format", 1, None)],
+        )
+
+    def test_inactive(self):
+        with app.test_request_context():
+            start_spans()
+
+            with span("format"):
+                pass
+            record_span("upstream", 1)
+
+            self.assertNotIn("spans", g)
+
+            response = app.response_class()
+            finish_spans(response, 1)
+
+            self.assertNotIn("Server-Timing", response.headers)
+
+    @patch("app.spans.SERVER_TIMING_ACTIVE", True)
+    def test_server_timing(self):
+        # Outside of a request nothing is recorded
+        record_span("upstream", 1)
+
+        with app.test_request_context():
+            start_spans()
+
+            with span("format", "voorzieningen"):
+                pass
+            record_span("upstream", 0.1, "/aanvragen")
+
+            response = app.response_class()
+            finish_spans(response, 0.5)
+
+        server_timing = response.headers["Server-Timing"]
+
+        self.assertTrue(server_timing.startswith('format;dur=0.0;desc="voorzieningen"'))
+        self.assertTrue(
+            server_timing.endswith(
+                'upstream;dur=100.0;desc="/aanvragen", total;dur=500.0'
+            )
+        )
+
+    @patch("app.spans.SERVER_TIMING_LOG_ACTIVE", True)
+    def test_log(self):
+        with app.test_request_context("/wmoned/voorzieningen"):
+            start_spans()
+            record_span("parse", 0.002, "/aanvragen")
+
+            response = app.response_class(status=200)
+
+            with self.assertLogs("app.timing", "INFO") as logs:
+                finish_spans(response, 0.01)
+
+        self.assertNotIn("Server-Timing", response.headers)
+
+        log_line = json.loads(logs.records[0].getMessage())
+
+        self.assertEqual(log_line["method"], "GET")
+        self.assertEqual(log_line["status"], 200)
+        self.assertEqual(
+            log_line["spans"],
+            [
+                {"name": "parse", "durationMs": 2.0, "description": "/aanvragen"},
+                {"name": "total", "durationMs": 10.0, "description": None},
+            ],
+        )
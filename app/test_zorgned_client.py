@@ -0,0 +1,58 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import zorgned_client
+from app.zorgned_client import ZorgnedClient, get_client
+
+
+class ZorgnedClientTest(TestCase):
+    def test_get_client_per_process(self):
+        client = get_client()
+        self.assertIs(get_client(), client)
+
+        with patch("app.zorgned_client.os.getpid", return_value=client.pid + 1):
+            client_forked = get_client()
+
+        self.assertIsNot(client_forked, client)
+        zorgned_client._client = client
+
+    def test_stats_empty(self):
+        client = ZorgnedClient()
+        self.assertEqual(
+            client.stats(), {"requests": 0, "hits": 0, "misses": 0, "evictions": 0}
+        )
+
+    def test_evict_idle(self):
+        client = ZorgnedClient(idle_timeout=10)
+        pool = client.adapter.poolmanager.connection_from_url("https://some-server")
+        pool.num_requests = 3
+        pool.num_connections = 1
+
+        self.assertFalse(client.evict_idle())
+        self.assertEqual(len(client.adapter.poolmanager.pools), 1)
+
+        client.last_used -= 11
+        self.assertTrue(client.evict_idle())
+        self.assertEqual(len(client.adapter.poolmanager.pools), 0)
+
+        self.assertEqual(
+            client.stats(), {"requests": 3, "hits": 2, "misses": 1, "evictions": 1}
+        )
+
+    @patch("app.zorgned_client.requests.Session.post")
+    def test_post(self, post_mock):
+        post_mock.return_value.status_code = 200
+
+        client = ZorgnedClient()
+        client.post("https://some-server/aanvragen", timeout=1)
+
+        post_mock.assert_called_once_with("https://some-server/aanvragen", timeout=1)
+
+    @patch("app.zorgned_client.requests.Session.post")
+    def test_post_server_error(self, post_mock):
+        post_mock.return_value.status_code = 503
+
+        client = ZorgnedClient()
+        client.post("https://some-server/aanvragen")
+
+        self.assertEqual(list(client.circuit_breaker.outcomes), [(True, False)])
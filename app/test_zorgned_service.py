@@ -1,21 +1,61 @@
+import json
+import threading
 from unittest import TestCase
 from unittest.mock import patch
 
+from cryptography.fernet import Fernet
+
 from app import config
+from app.deadline import start_deadline
+from app.helpers import DocumentIdCipher, create_validity, encrypt
+from app.cache import create_cache_key
+from app.models import Document, Voorziening, encode_models
+from app.pipeline import Pipeline
+from app.server import app
 from app.test_server import ZorgnedApiMock
 from app.zorgned_service import (
+    aanvragen_cache,
+    cache_key_secret,
+    create_voorzieningen_etag,
     format_aanvraag,
     format_aanvragen,
     get_aanvragen,
+    get_aanvragen_source,
     get_voorzieningen,
+    get_voorzieningen_entry,
+    upstream_flights,
+    voorzieningen_pipeline,
+    voorzieningen_cache,
 )
 
 BASE_PATH = config.BASE_PATH
+CIPHER = DocumentIdCipher([Fernet.generate_key()])
+
+
+def aanvraag_source(
+    date_decision, toegewezen_product, product_code="rls", resultaat="toegewezen"
+):
+    return {
+        "datumAanvraag": "2017-01-01",
+        "beschikking": {
+            "datumAfgifte": date_decision,
+            "beschikteProducten": [
+                {
+                    "resultaat": resultaat,
+                    "product": {
+                        "omschrijving": "rolstoel",
+                        "productsoortCode": product_code,
+                    },
+                    "toegewezenProduct": toegewezen_product,
+                }
+            ],
+        },
+    }
 
 
 class ZorgnedServiceTest(TestCase):
     @patch("app.zorgned_service.format_aanvragen")
-    @patch("app.zorgned_service.requests.post")
+    @patch("app.zorgned_client.requests.Session.post")
     def test_get_aanvragen(self, get_mock, format_mock):
         get_mock.return_value = ZorgnedApiMock(
             {"_embedded": {"aanvraag": [{"foo": "bar"}]}}
@@ -28,7 +68,27 @@ class ZorgnedServiceTest(TestCase):
 
         format_mock.assert_called_with([{"foo": "bar"}])
 
-    @patch("app.zorgned_service.requests.post")
+    @patch("app.zorgned_service.ZORGNED_CACHE_ACTIVE", True)
+    @patch("app.zorgned_service.format_aanvragen")
+    @patch("app.zorgned_client.requests.Session.post")
+    def test_get_aanvragen_cached(self, get_mock, format_mock):
+        get_mock.return_value = ZorgnedApiMock(
+            {"_embedded": {"aanvraag": [{"foo": "bar"}]}}
+        )
+        format_mock.return_value = [{"title": "autozitje"}]
+
+        aanvragen_cache.clear()
+
+        aanvragen1 = get_aanvragen(123)
+        aanvragen2 = get_aanvragen(123)
+
+        self.assertEqual(aanvragen1, [{"title": "autozitje"}])
+        self.assertEqual(aanvragen1, aanvragen2)
+        get_mock.assert_called_once()
+
+        aanvragen_cache.clear()
+
+    @patch("app.zorgned_client.requests.Session.post")
     def test_get_aanvragen_fail(self, get_mock):
         get_mock.return_value = ZorgnedApiMock(None)
 
@@ -73,7 +133,7 @@ class ZorgnedServiceTest(TestCase):
         source3_formatted = format_aanvraag("2022-01-01", source3, None)
 
         self.assertEqual(
-            source3_formatted,
+            source3_formatted.to_dict(),
             {
                 "title": "een WMO product",
                 "itemTypeCode": "ABC",
@@ -142,7 +202,7 @@ class ZorgnedServiceTest(TestCase):
             "serviceDateEnd": "2018-02-23",
             "documents": None,
         }
-        self.assertEqual(source1_formatted, source1_formatted_expected)
+        self.assertEqual(source1_formatted.to_dict(), source1_formatted_expected)
 
     def test_format_aanvraag_complete_2(self):
         source1 = {
@@ -220,12 +280,27 @@ class ZorgnedServiceTest(TestCase):
             "title": "rolstoelfiets met hulpmotor",
             "documents": None,
         }
-        self.assertEqual(source1_formatted, source1_formatted_expected)
+        self.assertEqual(source1_formatted.to_dict(), source1_formatted_expected)
+
+    def test_format_aanvragen_read_only(self):
+        with open(BASE_PATH + "/fixtures/aanvragen-2.json", "r") as fixture_file:
+            aanvragen_source = json.load(fixture_file)["_embedded"]["aanvraag"]
 
-    @patch("app.zorgned_service.encrypt")
-    def test_format_aanvragen(self, encrypt_mock):
+        source_serialized = json.dumps(aanvragen_source)
+
+        aanvragen1 = format_aanvragen(aanvragen_source)
+        aanvragen2 = format_aanvragen(aanvragen_source)
+
+        self.assertEqual(aanvragen1, aanvragen2)
+        # The last toewijzing and levering are still taken, not removed
+        self.assertEqual(aanvragen1[0].service_order_date, "2019-01-14")
+        self.assertEqual(json.dumps(aanvragen_source), source_serialized)
+
+    @patch("app.zorgned_service.create_validity_many", return_value=["yy1234"])
+    @patch("app.zorgned_service.encrypt_many")
+    def test_format_aanvragen(self, encrypt_mock, validity_mock):
         id_encrypted_mock = "xx1234567890xx"
-        encrypt_mock.return_value = id_encrypted_mock
+        encrypt_mock.return_value = [id_encrypted_mock]
 
         source1 = [
             {
@@ -332,7 +407,7 @@ class ZorgnedServiceTest(TestCase):
         document = {
             "id": id_encrypted_mock,
             "title": "WRV rapport",
-            "url": f"/wmoned/document/{id_encrypted_mock}",
+            "url": f"/wmoned/document/{id_encrypted_mock}?validity=yy1234",
             "datePublished": "2021-03-31T15:28:05",
         }
 
@@ -373,35 +448,37 @@ class ZorgnedServiceTest(TestCase):
             aanvraag2["documents"] = [document]
 
         self.assertEqual(len(source1_formatted), 2)
-        self.assertEqual(source1_formatted, [aanvraag1, aanvraag2])
+        self.assertEqual(
+            [aanvraag.to_dict() for aanvraag in source1_formatted],
+            [aanvraag1, aanvraag2],
+        )
 
     @patch(
-        "app.zorgned_service.get_aanvragen",
+        "app.zorgned_service.get_aanvragen_source",
         side_effect=[
+            [aanvraag_source("2018-01-01", {"actueel": False})],
             [
-                {"isActual": False, "dateDecision": "2018-01-01"},
+                aanvraag_source(
+                    "2018-01-01",
+                    {"actueel": False, "datumIngangGeldigheid": "2018-02-01"},
+                )
             ],
             [
-                {
-                    "isActual": False,
-                    "dateDecision": "2018-01-01",
-                    "dateStart": "2018-02-01",
-                },
+                aanvraag_source(
+                    "1999-12-31",
+                    {"actueel": True, "datumIngangGeldigheid": "2999-02-01"},
+                )
             ],
             [
-                {
-                    "isActual": True,
-                    "dateDecision": "1999-12-31",
-                    "serviceDateStart": "2000-02-01",
-                },
-            ],
-            [
-                {
-                    "isActual": True,
-                    "dateDecision": "2017-01-01",
-                    "serviceDateStart": None,
-                    "dateStart": "2022-02-01",
-                },
+                aanvraag_source(
+                    "2017-01-01",
+                    {
+                        "actueel": False,
+                        "datumIngangGeldigheid": "2022-02-01",
+                        "leveringsvorm": "zin",
+                    },
+                    product_code="wra",
+                )
             ],
         ],
     )
@@ -411,29 +488,227 @@ class ZorgnedServiceTest(TestCase):
 
         voorzieningen1 = get_voorzieningen(123)
         self.assertEqual(
-            voorzieningen1,
+            [voorziening.to_dict() for voorziening in voorzieningen1],
             [
                 {
-                    "isActual": False,
                     "dateDecision": "2018-01-01",
+                    "title": "rolstoel",
+                    "itemTypeCode": "RLS",
                     "dateStart": "2018-02-01",
+                    "dateEnd": None,
+                    "isActual": False,
+                    "deliveryType": "",
+                    "supplier": None,
+                    "serviceOrderDate": None,
+                    "serviceDateStart": None,
+                    "serviceDateEnd": None,
+                    "documents": None,
                 }
             ],
         )
 
+        # Starts in the future
         voorzieningen2 = get_voorzieningen(123)
         self.assertEqual(voorzieningen2, [])
 
         voorzieningen3 = get_voorzieningen(123)
         # Does not have serviceDateStart but is considered actual
+        self.assertEqual(len(voorzieningen3), 1)
+        self.assertEqual(voorzieningen3[0].is_actual, True)
+        self.assertEqual(voorzieningen3[0].delivery_type, "ZIN")
+
+    def test_voorzieningen_pipeline(self):
+        aanvragen_source = [
+            aanvraag_source("2018-01-01", {"datumIngangGeldigheid": "2018-02-01"}),
+            aanvraag_source("2018-01-01", {"datumIngangGeldigheid": "2999-02-01"}),
+            aanvraag_source(
+                "2018-01-01",
+                {"datumIngangGeldigheid": "2018-02-01"},
+                resultaat="afgewezen",
+            ),
+            aanvraag_source(None, {"datumIngangGeldigheid": "2018-02-01"}),
+        ]
+
+        pipeline = Pipeline(*voorzieningen_pipeline.stages)
+
+        format_patch = patch(
+            "app.zorgned_service.format_aanvraag", wraps=format_aanvraag
+        )
+
+        with format_patch as format_mock:
+            voorzieningen = list(pipeline.run(aanvragen_source))
+
+        self.assertEqual(len(voorzieningen), 1)
+        # Only the products that passed the filters are formatted
+        self.assertEqual(format_mock.call_count, 2)
         self.assertEqual(
-            voorzieningen3,
-            [
-                {
-                    "isActual": True,
-                    "dateDecision": "2017-01-01",
-                    "serviceDateStart": None,
-                    "dateStart": "2022-02-01",
-                }
-            ],
+            pipeline.stats(),
+            {
+                "runs": 1,
+                "stages": {
+                    "parse": 4,
+                    "result": 3,
+                    "startDate": 2,
+                    "format": 1,
+                    "encrypt": 1,
+                },
+            },
+        )
+
+    @patch("app.helpers.get_cipher", lambda: CIPHER)
+    def test_create_voorzieningen_etag(self):
+        def voorzieningen(document_id, title="WRV rapport", now=None):
+            id_encrypted = encrypt(document_id)
+            validity = create_validity(id_encrypted, now)
+            return [
+                Voorziening(
+                    date_decision="2021-03-31",
+                    title="traplift recht",
+                    item_type_code="WRA1",
+                    date_start="2021-03-04",
+                    date_end=None,
+                    is_actual=True,
+                    delivery_type="ZIN",
+                    supplier=None,
+                    service_order_date=None,
+                    service_date_start=None,
+                    service_date_end=None,
+                    documents=[
+                        Document(
+                            id=id_encrypted,
+                            title=title,
+                            url=f"/wmoned/document/{id_encrypted}?validity={validity}",
+                            date_published="2021-03-31T15:28:05",
+                        )
+                    ],
+                )
+            ]
+
+        def create_etag(voorzieningen):
+            return create_voorzieningen_etag(encode_models(voorzieningen))
+
+        etag = create_etag(voorzieningen("B744593"))
+
+        self.assertEqual(create_etag(voorzieningen("B744593")), etag)
+        # A renewed validity of the url changes the ETag
+        self.assertNotEqual(create_etag(voorzieningen("B744593", now=1)), etag)
+        self.assertNotEqual(create_etag(voorzieningen("B740440")), etag)
+        self.assertNotEqual(create_etag(voorzieningen("B744593", "Besluit")), etag)
+        self.assertNotEqual(create_etag([]), etag)
+
+    @patch("app.zorgned_service.ZORGNED_CACHE_ACTIVE", True)
+    @patch("app.zorgned_service.get_aanvragen_source")
+    def test_get_voorzieningen_cached(self, get_aanvragen_mock):
+        get_aanvragen_mock.return_value = [
+            aanvraag_source("2017-01-01", {"datumIngangGeldigheid": "2017-02-01"})
+        ]
+
+        voorzieningen_cache.clear()
+
+        entry1 = get_voorzieningen_entry(123)
+        voorzieningen2 = get_voorzieningen(123)
+
+        self.assertEqual(
+            entry1["content"],
+            encode_models(format_aanvragen(get_aanvragen_mock.return_value)),
         )
+        self.assertEqual(
+            voorzieningen2, format_aanvragen(get_aanvragen_mock.return_value)
+        )
+        get_aanvragen_mock.assert_called_once()
+
+        # The ETag and the serialized voorzieningen are cached
+        with patch("app.zorgned_service.create_voorzieningen_etag") as etag_mock, patch(
+            "app.zorgned_service.encode_models"
+        ) as encode_mock:
+            entry2 = get_voorzieningen_entry(123)
+
+        self.assertEqual(entry2["etag"], entry1["etag"])
+        self.assertEqual(entry2["content"], entry1["content"])
+        etag_mock.assert_not_called()
+        encode_mock.assert_not_called()
+
+    @patch("app.zorgned_service.ZORGNED_CACHE_ACTIVE", True)
+    @patch("app.zorgned_service.get_aanvragen_source")
+    def test_get_voorzieningen_cached_old_entry(self, get_aanvragen_mock):
+        get_aanvragen_mock.return_value = []
+
+        voorzieningen_cache.clear()
+
+        # Cached before the voorzieningen were cached as JSON
+        cache_key = create_cache_key(
+            "voorzieningen",
+            123,
+            {
+                "maxeinddatum": config.DATE_END_NOT_OLDER_THAN,
+                "regeling": config.REGELING_IDENTIFICATIE,
+            },
+            cache_key_secret,
+        )
+        voorzieningen_cache.set(cache_key, {"voorzieningen": [], "etag": "abc"})
+
+        self.assertEqual(get_voorzieningen_entry(123)["content"], b"[]")
+        get_aanvragen_mock.assert_called_once()
+
+        voorzieningen_cache.clear()
+
+        voorzieningen_cache.clear()
+
+    @patch("app.zorgned_service.fetch_aanvragen_source")
+    def test_get_aanvragen_source_wait_deadline(self, fetch_mock):
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch(*args):
+            started.set()
+            release.wait(5)
+            return []
+
+        fetch_mock.side_effect = fetch
+
+        leader = threading.Thread(target=get_aanvragen_source, args=(123,))
+        leader.start()
+        started.wait(5)
+
+        try:
+            # The waiting request gives up when its deadline passes
+            with app.test_request_context():
+                start_deadline(0.01)
+
+                with self.assertRaises(TimeoutError):
+                    get_aanvragen_source(123)
+        finally:
+            release.set()
+            leader.join()
+
+        fetch_mock.assert_called_once()
+
+    @patch("app.zorgned_service.ZORGNED_CACHE_ACTIVE", True)
+    @patch("app.zorgned_service.get_aanvragen_source")
+    def test_get_voorzieningen_entry_stale(self, get_aanvragen_mock):
+        get_aanvragen_mock.return_value = [
+            aanvraag_source("2017-01-01", {"datumIngangGeldigheid": "2017-02-01"})
+        ]
+
+        voorzieningen_cache.clear()
+
+        with patch.object(voorzieningen_cache, "ttl", -1), patch.object(
+            voorzieningen_cache, "max_stale", 60
+        ):
+            entry1 = get_voorzieningen_entry(123)
+            self.assertFalse(entry1["is_stale"])
+
+            get_aanvragen_mock.return_value = []
+            entry2 = get_voorzieningen_entry(123)
+
+            # The stale entry is served while it is refreshed in the background
+            self.assertTrue(entry2["is_stale"])
+            self.assertEqual(entry2["content"], entry1["content"])
+
+            while upstream_flights.flights:
+                pass
+
+            entry3 = get_voorzieningen_entry(123)
+            self.assertEqual(entry3["content"], b"[]")
+
+        voorzieningen_cache.clear()
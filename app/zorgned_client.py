@@ -0,0 +1,162 @@
+import os
+import ssl
+import threading
+import time
+
+import requests
+from requests.adapters import DEFAULT_CA_BUNDLE_PATH, HTTPAdapter
+
+from app.circuit_breaker import CircuitBreaker
+from app.config import (
+    SERVER_CLIENT_CERT,
+    SERVER_CLIENT_KEY,
+    ZORGNED_CIRCUIT_ERROR_RATE,
+    ZORGNED_CIRCUIT_HALF_OPEN_PROBES,
+    ZORGNED_CIRCUIT_MAX_OPEN_SECONDS,
+    ZORGNED_CIRCUIT_MIN_CALLS,
+    ZORGNED_CIRCUIT_OPEN_SECONDS,
+    ZORGNED_CIRCUIT_SLOW_CALL_RATE,
+    ZORGNED_CIRCUIT_SLOW_CALL_SECONDS,
+    ZORGNED_CIRCUIT_WINDOW_SIZE,
+    ZORGNED_POOL_IDLE_TIMEOUT_SECONDS,
+    ZORGNED_POOL_MAXSIZE,
+)
+
+
+def create_ssl_context(cert_file, key_file):
+    # Load the CA bundle and the mTLS client certificate once per worker instead of once per connection.
+    context = ssl.create_default_context(cafile=DEFAULT_CA_BUNDLE_PATH)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def is_server_error(response):
+    return response.status_code >= 500
+
+
+class ZorgnedAdapter(HTTPAdapter):
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs["ssl_context"] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        if self.ssl_context is None:
+            return super().cert_verify(conn, url, verify, cert)
+
+        # Certificates are already part of the shared ssl context.
+        conn.cert_reqs = "CERT_REQUIRED"
+
+
+class ZorgnedClient:
+    def __init__(
+        self,
+        pool_maxsize=ZORGNED_POOL_MAXSIZE,
+        idle_timeout=ZORGNED_POOL_IDLE_TIMEOUT_SECONDS,
+        cert_file=SERVER_CLIENT_CERT,
+        key_file=SERVER_CLIENT_KEY,
+    ):
+        self.pid = os.getpid()
+        self.idle_timeout = idle_timeout
+
+        ssl_context = None
+        if cert_file and key_file:
+            ssl_context = create_ssl_context(cert_file, key_file)
+
+        self.adapter = ZorgnedAdapter(
+            ssl_context=ssl_context,
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+        )
+
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+        self.circuit_breaker = CircuitBreaker(
+            window_size=ZORGNED_CIRCUIT_WINDOW_SIZE,
+            min_calls=ZORGNED_CIRCUIT_MIN_CALLS,
+            error_rate_threshold=ZORGNED_CIRCUIT_ERROR_RATE,
+            slow_call_seconds=ZORGNED_CIRCUIT_SLOW_CALL_SECONDS,
+            slow_call_rate_threshold=ZORGNED_CIRCUIT_SLOW_CALL_RATE,
+            open_seconds=ZORGNED_CIRCUIT_OPEN_SECONDS,
+            max_open_seconds=ZORGNED_CIRCUIT_MAX_OPEN_SECONDS,
+            half_open_probes=ZORGNED_CIRCUIT_HALF_OPEN_PROBES,
+        )
+
+        self.last_used = time.monotonic()
+        self.evictions = 0
+
+        # Totals of pools that were already evicted
+        self._evicted_requests = 0
+        self._evicted_connections = 0
+
+        self._lock = threading.Lock()
+
+    def _pools(self):
+        pools = self.adapter.poolmanager.pools
+        return [pools[key] for key in pools.keys()]
+
+    def evict_idle(self):
+        with self._lock:
+            now = time.monotonic()
+            is_idle = now - self.last_used > self.idle_timeout
+            self.last_used = now
+
+            if not is_idle:
+                return False
+
+            for pool in self._pools():
+                self._evicted_requests += pool.num_requests
+                self._evicted_connections += pool.num_connections
+
+            # Connections idle this long are likely closed by the server or a loadbalancer in between.
+            self.adapter.poolmanager.clear()
+            self.evictions += 1
+
+            return True
+
+    def post(self, url, **kwargs):
+        self.evict_idle()
+        # Fails fast with a CircuitOpenError while ZorgNed is considered down
+        return self.circuit_breaker.call(
+            self.session.post, url, is_error=is_server_error, **kwargs
+        )
+
+    def stats(self):
+        num_requests = self._evicted_requests
+        num_connections = self._evicted_connections
+
+        for pool in self._pools():
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+
+        return {
+            "requests": num_requests,
+            "hits": num_requests - num_connections,
+            "misses": num_connections,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+
+    # uwsgi forks the workers after import, sockets must not be shared between processes.
+    if _client is None or _client.pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client.pid != os.getpid():
+                _client = ZorgnedClient()
+
+    return _client
@@ -1,31 +1,95 @@
-import base64
+import hashlib
 import json
 import logging
-from datetime import date
+import os
 
-import dpath
-import requests
+from cryptography.fernet import Fernet
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import HTTPError, Timeout
 
+from app import metrics
+from app.cache import Cache, create_cache_backend, create_cache_key
 from app.config import (
     BESCHIKT_PRODUCT_RESULTAAT,
     DATE_END_NOT_OLDER_THAN,
+    DOCUMENT_CACHE_ACTIVE,
+    DOCUMENT_CACHE_DIRECTORY,
+    DOCUMENT_CACHE_ENCRYPTION_KEY,
+    DOCUMENT_CACHE_MAX_BYTES,
+    DOCUMENT_CACHE_TTL_SECONDS,
+    DOCUMENT_STREAM_CHUNK_SIZE,
     MINIMUM_REQUEST_DATE_FOR_DOCUMENTS,
     PRODUCTS_WITH_DELIVERY,
     REGELING_IDENTIFICATIE,
-    SERVER_CLIENT_CERT,
-    SERVER_CLIENT_KEY,
-    ZORGNED_API_REQUEST_TIMEOUT_SECONDS,
     ZORGNED_API_TOKEN,
     ZORGNED_API_URL,
+    ZORGNED_CACHE_ACTIVE,
+    ZORGNED_CACHE_BACKEND,
+    ZORGNED_CACHE_ENCRYPTION_KEY,
+    ZORGNED_CACHE_MAX_BYTES,
+    ZORGNED_CACHE_MAX_ENTRIES,
+    ZORGNED_CACHE_MAX_STALE_SECONDS,
+    ZORGNED_CACHE_REDIS_URL,
+    ZORGNED_CACHE_SQLITE_PATH,
+    ZORGNED_CACHE_TTL_SECONDS,
     ZORGNED_DOCUMENT_ATTACHMENTS_ACTIVE,
     ZORGNED_GEMEENTE_CODE,
 )
-from app.helpers import encrypt, to_date
+from app.circuit_breaker import CircuitOpenError
+from app.deadline import get_remaining_seconds, get_upstream_timeout
+from app.document_cache import DocumentCache, derive_key
+from app.document_stream import read_document
+from app.field_paths import compile_path, compile_plan
+from app.helpers import create_validity_many, encrypt_many, get_today, to_date
+from app.logs import LazyJson
+from app.models import Document, Voorziening, encode_models
+from app.pipeline import Pipeline
+from app.singleflight import SingleFlight
+from app.zorgned_client import get_client
+
+cache_encryptor = (
+    Fernet(ZORGNED_CACHE_ENCRYPTION_KEY) if ZORGNED_CACHE_ENCRYPTION_KEY else None
+)
+# Without a configured key the cache keys only match within this process and the workers forked from it
+cache_key_secret = (
+    derive_key(ZORGNED_CACHE_ENCRYPTION_KEY, b"mijn-wmoned-cache-keys")
+    if ZORGNED_CACHE_ENCRYPTION_KEY
+    else os.urandom(32)
+)
+cache_backend = create_cache_backend(
+    ZORGNED_CACHE_BACKEND,
+    max_entries=ZORGNED_CACHE_MAX_ENTRIES,
+    max_bytes=ZORGNED_CACHE_MAX_BYTES,
+    sqlite_path=ZORGNED_CACHE_SQLITE_PATH,
+    redis_url=ZORGNED_CACHE_REDIS_URL,
+)
+
+# Raw aanvragen as returned by ZorgNed and the formatted voorzieningen share one backend
+aanvragen_cache = Cache(cache_backend, ZORGNED_CACHE_TTL_SECONDS, cache_encryptor)
+voorzieningen_cache = Cache(
+    cache_backend,
+    ZORGNED_CACHE_TTL_SECONDS,
+    cache_encryptor,
+    max_stale=ZORGNED_CACHE_MAX_STALE_SECONDS,
+)
+
+document_cache = None
+
+if DOCUMENT_CACHE_ACTIVE:
+    document_cache = DocumentCache(
+        DOCUMENT_CACHE_DIRECTORY,
+        ttl=DOCUMENT_CACHE_TTL_SECONDS,
+        max_bytes=DOCUMENT_CACHE_MAX_BYTES,
+        encryption_key=DOCUMENT_CACHE_ENCRYPTION_KEY,
+    )
+
+# Concurrent identical requests to ZorgNed wait for the one that is already in flight
+upstream_flights = SingleFlight()
 
 
-def is_product_with_delivery(aanvraag_formatted):
-    delivery_type = aanvraag_formatted.get("deliveryType", "").upper()
-    item_type_code = aanvraag_formatted.get("itemTypeCode", "").upper()
+def is_product_with_delivery(voorziening):
+    delivery_type = voorziening.delivery_type.upper()
+    item_type_code = voorziening.item_type_code.upper()
 
     # This check matches the products that should/can/will receive a delivery of goods/service/product (eventually).
     if delivery_type in PRODUCTS_WITH_DELIVERY:
@@ -35,20 +99,65 @@ def is_product_with_delivery(aanvraag_formatted):
     return False
 
 
+# Field extraction is compiled once at import, formatting runs for every product of every request.
+# Model attribute: (source, ZorgNed path[, default]), without a default a missing path raises a KeyError.
+DOCUMENT_FIELDS = compile_plan(
+    {
+        # Like before, a document without omschrijving or datumDefinitief raises a KeyError
+        "title": ("document", "omschrijving"),
+        "date_published": ("document", "datumDefinitief"),
+    }
+)
+
+AANVRAAG_FIELDS = compile_plan(
+    {
+        # Product
+        "title": ("beschikt_product", "product/omschrijving"),
+        "item_type_code": ("beschikt_product", "product/productsoortCode"),
+        # Toegewezen product
+        "date_start": ("toegewezen_product", "datumIngangGeldigheid", None),
+        "date_end": ("toegewezen_product", "datumEindeGeldigheid", None),
+        "is_actual": ("toegewezen_product", "actueel", False),
+        "delivery_type": ("toegewezen_product", "leveringsvorm", ""),
+        "supplier": ("toegewezen_product", "leverancier/omschrijving", None),
+        # Levering
+        "service_order_date": ("toewijzing", "datumOpdracht", None),
+        "service_date_start": ("levering", "begindatum", None),
+        "service_date_end": ("levering", "einddatum", None),
+    }
+)
+
+get_toegewezen_product = compile_path("toegewezenProduct", None)
+get_toewijzingen = compile_path("toewijzingen", None)
+get_leveringen = compile_path("leveringen", None)
+
+get_date_start = compile_path("toegewezenProduct/datumIngangGeldigheid", None)
+
+get_date_request = compile_path("datumAanvraag", None)
+get_date_decision = compile_path("beschikking/datumAfgifte", None)
+get_beschikte_producten = compile_path("beschikking/beschikteProducten", None)
+get_documenten = compile_path("documenten", None)
+
+
 def format_documenten(documenten):
     if not documenten:
         return None
 
+    # The ciphers are set up once for all documents. The validity is a separate field, the id of a document never changes.
+    with metrics.timer("wmoned_encryption_seconds", "encryption", operation="encrypt"):
+        ids_encrypted = encrypt_many(
+            [document["documentidentificatie"] for document in documenten]
+        )
+        validities = create_validity_many(ids_encrypted)
+
     parsed_documents = []
-    for document in documenten:
-        id_encrypted = encrypt(document["documentidentificatie"])
+    for document, id_encrypted, validity in zip(documenten, ids_encrypted, validities):
         parsed_documents.append(
-            {
-                "id": id_encrypted,
-                "title": dpath.get(document, "omschrijving", None),
-                "url": f"/wmoned/document/{id_encrypted}",
-                "datePublished": dpath.get(document, "datumDefinitief", None),
-            }
+            Document(
+                id=id_encrypted,
+                url=f"/wmoned/document/{id_encrypted}?validity={validity}",
+                **DOCUMENT_FIELDS({"document": document}),
+            )
         )
 
     return parsed_documents
@@ -58,120 +167,198 @@ def format_aanvraag(date_decision, beschikt_product, documenten):
     if not beschikt_product or not date_decision:
         return None
 
-    toegewezen_product = dpath.get(beschikt_product, "toegewezenProduct", default=None)
-    is_actual = dpath.get(toegewezen_product, "actueel", default=False)
-    date_end = dpath.get(toegewezen_product, "datumEindeGeldigheid", default=None)
+    toegewezen_product = get_toegewezen_product(beschikt_product)
 
-    toewijzingen = dpath.get(toegewezen_product, "toewijzingen", default=[])
+    # The source is read-only, it can be shared with the cache and formatted again
+    toewijzingen = get_toewijzingen(toegewezen_product)
     # Take last toewijzing from incoming data
-    toewijzing = toewijzingen.pop() if toewijzingen else None
+    toewijzing = toewijzingen[-1] if toewijzingen else None
 
-    leveringen = dpath.get(toewijzing, "leveringen", default=[])
+    leveringen = get_leveringen(toewijzing)
     # Take last levering from incoming data
-    levering = leveringen.pop() if leveringen else None
-
-    item_type_code = dpath.get(beschikt_product, "product/productsoortCode")
-    if item_type_code:
-        item_type_code = item_type_code.upper()
+    levering = leveringen[-1] if leveringen else None
 
-    delivery_type = dpath.get(toegewezen_product, "leveringsvorm", default="")
-    if delivery_type:
-        delivery_type = delivery_type.upper()
-    if delivery_type is None:
-        delivery_type = ""
-
-    service_date_start = dpath.get(levering, "begindatum", default=None)
-
-    aanvraag = {
+    aanvraag = Voorziening(
         # Beschikking
-        "dateDecision": date_decision,
-        # Product
-        "title": dpath.get(beschikt_product, "product/omschrijving"),
-        "itemTypeCode": item_type_code,
-        # Toegewezen product
-        "dateStart": dpath.get(
-            toegewezen_product, "datumIngangGeldigheid", default=None
-        ),
-        "dateEnd": date_end,
-        "isActual": is_actual,
-        "deliveryType": delivery_type,
-        "supplier": dpath.get(
-            toegewezen_product, "leverancier/omschrijving", default=None
+        date_decision=date_decision,
+        **AANVRAAG_FIELDS(
+            {
+                "beschikt_product": beschikt_product,
+                "toegewezen_product": toegewezen_product,
+                "toewijzing": toewijzing,
+                "levering": levering,
+            }
         ),
-        # Levering
-        "serviceOrderDate": dpath.get(toewijzing, "datumOpdracht", default=None),
-        "serviceDateStart": service_date_start,
-        "serviceDateEnd": dpath.get(levering, "einddatum", default=None),
-        "documents": format_documenten(documenten),
-    }
+        documents=format_documenten(documenten),
+    )
+
+    if aanvraag.item_type_code:
+        aanvraag.item_type_code = aanvraag.item_type_code.upper()
+
+    if aanvraag.delivery_type:
+        aanvraag.delivery_type = aanvraag.delivery_type.upper()
+    if aanvraag.delivery_type is None:
+        aanvraag.delivery_type = ""
 
     # Voorzieningen without a delivery should be considered actual. The api data returns these items as not-actual.
     # In the front-end we use the isActual boolean to determine if the voorziening is historic or present.
     if (
         is_product_with_delivery(aanvraag)
-        and not is_actual
-        and not date_end
-        and not service_date_start
+        and not aanvraag.is_actual
+        and not aanvraag.date_end
+        and not aanvraag.service_date_start
     ):
-        aanvraag["isActual"] = True
+        aanvraag.is_actual = True
 
     return aanvraag
 
 
-def format_aanvragen(aanvragen_source=[]):
-    aanvragen = []
+class ProductRecord:
+    # A beschikt product on its way through the pipeline, with its dates parsed once
+    __slots__ = (
+        "aanvraag_source",
+        "beschikt_product",
+        "date_request",
+        "date_start",
+        "aanvraag",
+    )
+
+    def __init__(self, aanvraag_source, beschikt_product, date_request, date_start):
+        self.aanvraag_source = aanvraag_source
+        self.beschikt_product = beschikt_product
+        self.date_request = date_request
+        self.date_start = date_start
+        self.aanvraag = None
+
+
+def parse_optional_date(date_input):
+    return to_date(date_input) if date_input else None
 
+
+def iter_products(aanvragen_source):
     for aanvraag_source in aanvragen_source:
-        beschikking = dpath.get(aanvraag_source, "beschikking", default=None)
-        date_request = dpath.get(aanvraag_source, "datumAanvraag", default=None)
-        should_show_documents = (
-            to_date(date_request) >= MINIMUM_REQUEST_DATE_FOR_DOCUMENTS
-            and ZORGNED_DOCUMENT_ATTACHMENTS_ACTIVE
+        date_request = parse_optional_date(get_date_request(aanvraag_source))
+
+        for beschikt_product in get_beschikte_producten(aanvraag_source) or []:
+            yield ProductRecord(
+                aanvraag_source,
+                beschikt_product,
+                date_request,
+                parse_optional_date(get_date_start(beschikt_product)),
+            )
+
+
+def filter_result(records):
+    for record in records:
+        # Only select products with certain result
+        if record.beschikt_product.get("resultaat") in BESCHIKT_PRODUCT_RESULTAAT:
+            yield record
+
+
+def filter_start_date_in_past(records):
+    today = get_today()
+
+    for record in records:
+        if record.date_start and record.date_start <= today:
+            yield record
+
+
+def format_products(records):
+    for record in records:
+        # Documents are added by the last stage, only for the aanvragen that are kept
+        record.aanvraag = format_aanvraag(
+            get_date_decision(record.aanvraag_source), record.beschikt_product, None
         )
-        date_decision = dpath.get(beschikking, "datumAfgifte", default=None)
-        beschikte_producten = dpath.get(beschikking, "beschikteProducten", default=None)
-        documenten = []
-        if should_show_documents:
-            documenten = dpath.get(aanvraag_source, "documenten", default=None)
 
-        if beschikte_producten:
-            for beschikt_product in beschikte_producten:
-                # Only select products with certain result
-                if beschikt_product.get("resultaat") in BESCHIKT_PRODUCT_RESULTAAT:
-                    aanvraag_formatted = format_aanvraag(
-                        date_decision, beschikt_product, documenten
-                    )
+        if record.aanvraag:
+            yield record
 
-                    if aanvraag_formatted:
-                        aanvragen.append(aanvraag_formatted)
 
-    return aanvragen
+def should_show_documents(record):
+    return (
+        ZORGNED_DOCUMENT_ATTACHMENTS_ACTIVE
+        and record.date_request is not None
+        and record.date_request >= MINIMUM_REQUEST_DATE_FOR_DOCUMENTS
+    )
+
+
+def encrypt_documents(records):
+    for record in records:
+        if should_show_documents(record):
+            record.aanvraag.documents = format_documenten(
+                get_documenten(record.aanvraag_source)
+            )
+
+        yield record.aanvraag
+
+
+# Every stage only runs for the products that are still needed, the counters are shown at /status/pipeline
+aanvragen_pipeline = Pipeline(
+    ("parse", iter_products),
+    ("result", filter_result),
+    ("format", format_products),
+    ("encrypt", encrypt_documents),
+)
+
+voorzieningen_pipeline = Pipeline(
+    ("parse", iter_products),
+    ("result", filter_result),
+    ("startDate", filter_start_date_in_past),
+    ("format", format_products),
+    ("encrypt", encrypt_documents),
+)
+
+
+def format_aanvragen(aanvragen_source=[]):
+    with metrics.timer("wmoned_format_seconds", "format", pipeline="aanvragen"):
+        return list(aanvragen_pipeline.run(aanvragen_source))
 
 
-def send_api_request(bsn, operation="", post_message={}):
-    headers = None
-    cert = None
+def get_upstream_error_name(error):
+    if isinstance(error, HTTPError) and error.response is not None:
+        return f"http_{error.response.status_code}"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, (TimeoutError, Timeout)):
+        return "timeout"
+    if isinstance(error, RequestsConnectionError):
+        return "connection"
+    return type(error).__name__
 
+
+def send_api_request(bsn, operation="", post_message={}, stream=False):
     headers = {
         "Token": ZORGNED_API_TOKEN,
         "Content-type": "application/json; charset=utf-8",
     }
-    cert = (SERVER_CLIENT_CERT, SERVER_CLIENT_KEY)
     url = f"{ZORGNED_API_URL}{operation}"
     default_post_params = {
         "burgerservicenummer": bsn,
         "gemeentecode": ZORGNED_GEMEENTE_CODE,
     }
 
-    res = requests.post(
-        url,
-        timeout=ZORGNED_API_REQUEST_TIMEOUT_SECONDS,
-        headers=headers,
-        cert=cert,
-        json={**default_post_params, **post_message},
-    )
-
-    res.raise_for_status()
+    try:
+        # The client keeps a pool of mTLS connections alive, the certificate is part of its ssl context.
+        with metrics.timer(
+            "wmoned_upstream_request_seconds", "upstream", operation=operation
+        ):
+            res = get_client().post(
+                url,
+                # Only the time that is left of the request deadline, as (connect, read) timeouts
+                timeout=get_upstream_timeout(),
+                headers=headers,
+                json={**default_post_params, **post_message},
+                stream=stream,
+            )
+
+        res.raise_for_status()
+    except Exception as error:
+        metrics.inc(
+            "wmoned_upstream_errors_total",
+            operation=operation,
+            error=get_upstream_error_name(error),
+        )
+        raise
 
     return res
 
@@ -179,55 +366,152 @@ def send_api_request(bsn, operation="", post_message={}):
 def send_api_request_json(bsn, operation="", post_message={}):
     res = send_api_request(bsn, operation, post_message)
 
-    response_data = res.json()
+    metrics.inc(
+        "wmoned_upstream_response_bytes_total", len(res.content), operation=operation
+    )
+
+    with metrics.timer("wmoned_parse_seconds", "parse", operation=operation):
+        response_data = res.json()
 
-    logging.debug(json.dumps(response_data, indent=4))
+    # Only rendered when the debug level is on
+    logging.debug("%s", LazyJson(response_data, indent=4))
 
     return response_data
 
 
-def get_aanvragen(bsn, post_message={}):
-    response_data = send_api_request_json(bsn, "/aanvragen", post_message)
+def fetch_aanvragen_source(bsn, post_message={}, cache_key=None):
+    response_aanvragen = None
 
-    response_aanvragen = response_data["_embedded"]["aanvraag"]
+    if ZORGNED_CACHE_ACTIVE:
+        response_aanvragen = aanvragen_cache.get(cache_key)
 
-    return format_aanvragen(response_aanvragen)
+    if response_aanvragen is None:
+        response_data = send_api_request_json(bsn, "/aanvragen", post_message)
 
+        response_aanvragen = response_data["_embedded"]["aanvraag"]
 
-def has_start_date_in_past(aanvraag_source):
-    return (
-        aanvraag_source.get("dateStart")
-        and to_date(aanvraag_source.get("dateStart")) <= date.today()
+        if ZORGNED_CACHE_ACTIVE:
+            aanvragen_cache.set(cache_key, response_aanvragen)
+
+    return response_aanvragen
+
+
+def get_aanvragen_source(bsn, post_message={}):
+    cache_key = create_cache_key("/aanvragen", bsn, post_message, cache_key_secret)
+
+    # The raw aanvragen are shared by the waiting requests, formatting does not change them. A waiting request
+    # gives up when its own deadline passes, the call in flight may belong to a request with more time left.
+    return upstream_flights.do(
+        cache_key,
+        fetch_aanvragen_source,
+        bsn,
+        post_message,
+        cache_key,
+        wait_timeout=get_remaining_seconds(),
     )
 
 
-def get_voorzieningen(bsn):
+def get_aanvragen(bsn, post_message={}):
+    return format_aanvragen(get_aanvragen_source(bsn, post_message))
+
+
+def create_voorzieningen_etag(content):
+    # The hash of the serialized voorzieningen, document urls included. A client gets the new url when the validity
+    # of the old one runs out.
+    return hashlib.sha256(content).hexdigest()
+
+
+def fetch_voorzieningen(bsn, post_message, cache_key):
+    aanvragen_source = get_aanvragen_source(bsn, post_message)
+
+    # Products that did not start yet are dropped before they are formatted
+    with metrics.timer("wmoned_format_seconds", "format", pipeline="voorzieningen"):
+        voorzieningen = list(voorzieningen_pipeline.run(aanvragen_source))
+
+    # Serialized once, a cached response is sent without building the voorzieningen again
+    with metrics.timer(
+        "wmoned_serialize_seconds", "serialize", endpoint="get_voorzieningen"
+    ):
+        content = encode_models(voorzieningen)
+
+    # The ETag is stored with the voorzieningen, a conditional request is answered without hashing them
+    etag = create_voorzieningen_etag(content)
+
+    if ZORGNED_CACHE_ACTIVE:
+        voorzieningen_cache.set(cache_key, {"content": content.decode(), "etag": etag})
+
+    return {"content": content, "etag": etag}
+
+
+def get_voorzieningen_entry(bsn):
     post_message = {
         "maxeinddatum": DATE_END_NOT_OLDER_THAN,
         "regeling": REGELING_IDENTIFICATIE,
     }
 
-    aanvragen = get_aanvragen(bsn, post_message)
+    cache_key = create_cache_key("voorzieningen", bsn, post_message, cache_key_secret)
 
-    voorzieningen = []
+    if ZORGNED_CACHE_ACTIVE:
+        entry, is_stale = voorzieningen_cache.get_stale(cache_key)
 
-    for aanvraag_source in aanvragen:
-        if has_start_date_in_past(aanvraag_source):
-            voorzieningen.append(aanvraag_source)
+        # Entries cached before the voorzieningen were cached as JSON are refetched
+        if entry is not None and "content" in entry:
+            if is_stale:
+                # Serve the expired voorzieningen right away and refresh them for the next request
+                upstream_flights.do_in_background(
+                    cache_key, fetch_voorzieningen, bsn, post_message, cache_key
+                )
 
-    return voorzieningen
+            return {
+                "content": entry["content"].encode(),
+                "etag": entry["etag"],
+                "is_stale": is_stale,
+            }
+
+    entry = fetch_voorzieningen(bsn, post_message, cache_key)
+
+    return {**entry, "is_stale": False}
+
+
+def get_voorzieningen(bsn):
+    content = get_voorzieningen_entry(bsn)["content"]
+    return [Voorziening.from_dict(voorziening) for voorziening in json.loads(content)]
+
+
+def fetch_document(bsn, documentidentificatie):
+    res = send_api_request(
+        bsn,
+        "/document",
+        {"documentidentificatie": documentidentificatie},
+        stream=True,
+    )
+
+    # Decode the base64 "inhoud" while it comes in instead of holding the whole document in memory
+    return read_document(
+        res.iter_content(DOCUMENT_STREAM_CHUNK_SIZE),
+        DOCUMENT_STREAM_CHUNK_SIZE,
+        close=res.close,
+    )
 
 
 def get_document(bsn, documentidentificatie):
-    response_data = send_api_request_json(
-        bsn, "/document", {"documentidentificatie": documentidentificatie}
+    if not document_cache:
+        return fetch_document(bsn, documentidentificatie)
+
+    # The bsn is part of the key, a cached document is only served to the user ZorgNed served it to
+    cache_key = create_cache_key(
+        "/document",
+        bsn,
+        {"documentidentificatie": documentidentificatie},
+        cache_key_secret,
     )
 
-    logging.debug(response_data)
+    document = document_cache.get(cache_key)
 
-    message_bytes = base64.b64decode(response_data["inhoud"])
+    if document is None:
+        document = fetch_document(bsn, documentidentificatie)
+        document = document_cache.put_and_get(
+            cache_key, document["Content-Type"], document["file_data"]
+        )
 
-    return {
-        "Content-Type": response_data["mimetype"],
-        "file_data": message_bytes,
-    }
+    return document
@@ -0,0 +1,310 @@
+from sys import argv
+import copy
+import json
+import re
+import time
+import timeit
+import tracemalloc
+from datetime import date, datetime
+
+import dpath
+from cryptography.fernet import Fernet
+
+from app.config import BASE_PATH, BESCHIKT_PRODUCT_RESULTAAT, UpdatedJSONProvider
+from app.helpers import (
+    DocumentIdCipher,
+    create_aessiv,
+    parse_date,
+    success_response_json,
+    to_base64,
+)
+from app.json_provider import OrjsonJSONProvider
+from app.models import Voorziening, encode_models, encode_success_response
+from app.server import app
+from app.zorgned_service import format_aanvragen, is_product_with_delivery
+
+# Usage: python -m scripts.benchmark [name ...]
+
+
+def report(name, seconds, number, unit="document"):
+    print(f"{name:<48} {seconds / number * 1_000_000:>10.2f} us/{unit}")
+
+
+def benchmark_document_ids(documents=50, number=200):
+    key = Fernet.generate_key()
+    document_ids = [f"B{744593 + i}" for i in range(documents)]
+    cipher = DocumentIdCipher([key], [key])
+
+    def fernet_per_document():
+        # The former helpers.encrypt, a new Fernet for every document id
+        return [
+            Fernet(key).encrypt(document_id.encode()) for document_id in document_ids
+        ]
+
+    def aessiv_per_document():
+        # Deterministic ids with the key derived for every document id
+        return [
+            to_base64(create_aessiv(key).encrypt(document_id.encode(), [b"\x01"]))
+            for document_id in document_ids
+        ]
+
+    def cipher_encrypt_many():
+        ids_encrypted = cipher.encrypt_many(document_ids)
+        return cipher.create_validity_many(ids_encrypted)
+
+    ids_encrypted = cipher.encrypt_many(document_ids)
+
+    def cipher_decrypt_many():
+        return cipher.decrypt_many(ids_encrypted)
+
+    print(f"Document ids, {documents} documents per user")
+
+    for name, fn in [
+        ("Fernet per document", fernet_per_document),
+        ("AES-SIV, key derived per document", aessiv_per_document),
+        ("Cipher service, encrypt_many + validity", cipher_encrypt_many),
+        ("Cipher service, decrypt_many", cipher_decrypt_many),
+    ]:
+        report(name, timeit.timeit(fn, number=number), number * documents)
+
+
+def load_aanvragen():
+    aanvragen = []
+    for fixture in ["aanvragen.json", "aanvragen-2.json"]:
+        with open(f"{BASE_PATH}/fixtures/{fixture}", "r") as fixture_file:
+            aanvragen += json.load(fixture_file)["_embedded"]["aanvraag"]
+    return aanvragen
+
+
+def format_aanvraag_dpath(date_decision, beschikt_product):
+    # The dpath based formatter as it was before the compiled field paths, without documents
+    toegewezen_product = dpath.get(beschikt_product, "toegewezenProduct", default=None)
+    is_actual = dpath.get(toegewezen_product, "actueel", default=False)
+    date_end = dpath.get(toegewezen_product, "datumEindeGeldigheid", default=None)
+    toewijzingen = dpath.get(toegewezen_product, "toewijzingen", default=[])
+    toewijzing = toewijzingen.pop() if toewijzingen else None
+    leveringen = dpath.get(toewijzing, "leveringen", default=[])
+    levering = leveringen.pop() if leveringen else None
+    item_type_code = dpath.get(beschikt_product, "product/productsoortCode")
+    delivery_type = dpath.get(toegewezen_product, "leveringsvorm", default="")
+    service_date_start = dpath.get(levering, "begindatum", default=None)
+
+    aanvraag = {
+        "dateDecision": date_decision,
+        "title": dpath.get(beschikt_product, "product/omschrijving"),
+        "itemTypeCode": item_type_code.upper() if item_type_code else item_type_code,
+        "dateStart": dpath.get(
+            toegewezen_product, "datumIngangGeldigheid", default=None
+        ),
+        "dateEnd": date_end,
+        "isActual": is_actual,
+        "deliveryType": (delivery_type or "").upper(),
+        "supplier": dpath.get(
+            toegewezen_product, "leverancier/omschrijving", default=None
+        ),
+        "serviceOrderDate": dpath.get(toewijzing, "datumOpdracht", default=None),
+        "serviceDateStart": service_date_start,
+        "serviceDateEnd": dpath.get(levering, "einddatum", default=None),
+        "documents": None,
+    }
+
+    if (
+        is_product_with_delivery(Voorziening.from_dict(aanvraag))
+        and not is_actual
+        and not date_end
+        and not service_date_start
+    ):
+        aanvraag["isActual"] = True
+
+    return aanvraag
+
+
+def format_aanvragen_dpath(aanvragen_source):
+    aanvragen = []
+    for aanvraag_source in aanvragen_source:
+        beschikking = dpath.get(aanvraag_source, "beschikking", default=None)
+        date_decision = dpath.get(beschikking, "datumAfgifte", default=None)
+        beschikte_producten = dpath.get(beschikking, "beschikteProducten", default=None)
+        for beschikt_product in beschikte_producten or []:
+            if beschikt_product.get("resultaat") in BESCHIKT_PRODUCT_RESULTAAT:
+                aanvragen.append(format_aanvraag_dpath(date_decision, beschikt_product))
+    return aanvragen
+
+
+def benchmark_format(number=500):
+    aanvragen = load_aanvragen()
+    products = len(format_aanvragen(copy.deepcopy(aanvragen)))
+
+    assert [
+        voorziening.to_dict()
+        for voorziening in format_aanvragen(copy.deepcopy(aanvragen))
+    ] == format_aanvragen_dpath(copy.deepcopy(aanvragen))
+
+    print(f"Formatting, {len(aanvragen)} aanvragen with {products} products")
+
+    for name, fn in [
+        ("dpath.get", format_aanvragen_dpath),
+        ("Compiled field paths", format_aanvragen),
+    ]:
+        # The dpath formatter pops the last toewijzing and levering from its source, every run gets a copy
+        sources = [copy.deepcopy(aanvragen) for _ in range(number)]
+        start = time.perf_counter()
+        for source in sources:
+            fn(source)
+        report(name, time.perf_counter() - start, number * products, "product")
+
+
+def iter_strings(value):
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            yield from iter_strings(item)
+    elif isinstance(value, str):
+        yield value
+
+
+def to_date_strptime(date_input):
+    # helpers.to_date before the parsed dates were memoized
+    if "T" in date_input:
+        return datetime.strptime(date_input, "%Y-%m-%dT%H:%M:%S").date()
+    return datetime.strptime(date_input, "%Y-%m-%d").date()
+
+
+def benchmark_dates(number=200):
+    dates = [
+        value
+        for value in iter_strings(load_aanvragen())
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2})?", value)
+    ]
+
+    print(
+        f"Dates, {len(dates)} dates of which {len(set(dates))} unique in the fixtures"
+    )
+
+    parse_date.cache_clear()
+
+    for name, fn in [
+        ("strptime", to_date_strptime),
+        ("fromisoformat", parse_date.__wrapped__),
+        ("fromisoformat, memoized", parse_date),
+    ]:
+        seconds = timeit.timeit(lambda: [fn(value) for value in dates], number=number)
+        report(name, seconds, number * len(dates), "date")
+
+    def today_per_item():
+        return [date.today() for _ in dates]
+
+    def today_once():
+        today = date.today()
+        return [today for _ in dates]
+
+    for name, fn in [
+        ("date.today() per item", today_per_item),
+        ("today once", today_once),
+    ]:
+        report(name, timeit.timeit(fn, number=number), number * len(dates), "item")
+
+
+def benchmark_serialize(number=500):
+    voorzieningen = format_aanvragen(load_aanvragen())
+    dicts = [voorziening.to_dict() for voorziening in voorzieningen]
+
+    content = encode_models(voorzieningen)
+
+    with app.test_request_context():
+        # Byte-identical with the json provider, orjson does not escape non-ascii characters
+        if not isinstance(app.json, OrjsonJSONProvider):
+            assert success_response_json(dicts).data == encode_success_response(content)
+
+        print(f"Serializing, {len(voorzieningen)} voorzieningen")
+
+        for name, fn in [
+            (f"dicts, {type(app.json).__name__}", lambda: success_response_json(dicts)),
+            (
+                "models, to_dict + app JSON provider",
+                lambda: success_response_json(
+                    [voorziening.to_dict() for voorziening in voorzieningen]
+                ),
+            ),
+            (
+                "models, direct to bytes",
+                lambda: encode_success_response(encode_models(voorzieningen)),
+            ),
+            # A cache hit, the voorzieningen were serialized when they were fetched
+            ("cached content", lambda: encode_success_response(content)),
+        ]:
+            report(
+                name,
+                timeit.timeit(fn, number=number),
+                number * len(voorzieningen),
+                "voorziening",
+            )
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    many_dicts = [voorziening.to_dict() for voorziening in voorzieningen * 1000]
+    dicts_size = sum(
+        stat.size_diff
+        for stat in tracemalloc.take_snapshot().compare_to(before, "filename")
+    )
+    del many_dicts
+
+    before = tracemalloc.take_snapshot()
+    many_models = [
+        Voorziening.from_dict(voorziening.to_dict())
+        for voorziening in voorzieningen * 1000
+    ]
+    models_size = sum(
+        stat.size_diff
+        for stat in tracemalloc.take_snapshot().compare_to(before, "filename")
+    )
+    del many_models
+    tracemalloc.stop()
+
+    count = len(voorzieningen) * 1000
+    print(f"{'dict per voorziening':<48} {dicts_size / count:>10.0f} bytes")
+    print(f"{'slotted model per voorziening':<48} {models_size / count:>10.0f} bytes")
+
+
+def benchmark_json(number=500):
+    payloads = {
+        "aanvragen": load_aanvragen(),
+        "voorzieningen": {
+            "status": "OK",
+            "content": [
+                voorziening.to_dict()
+                for voorziening in format_aanvragen(load_aanvragen())
+            ],
+        },
+    }
+    providers = [
+        ("json", UpdatedJSONProvider(app)),
+        ("orjson", OrjsonJSONProvider(app)),
+    ]
+
+    with app.test_request_context():
+        for payload_name, payload in payloads.items():
+            size = len(providers[0][1].response(payload).data)
+            print(f"JSON responses, fixture {payload_name}, {size} bytes")
+
+            for name, provider in providers:
+                seconds = timeit.timeit(
+                    lambda: provider.response(payload), number=number
+                )
+                report(name, seconds, number, "response")
+            print()
+
+
+BENCHMARKS = {
+    "document-ids": benchmark_document_ids,
+    "format": benchmark_format,
+    "dates": benchmark_dates,
+    "serialize": benchmark_serialize,
+    "json": benchmark_json,
+}
+
+if __name__ == "__main__":
+    for name in argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
+        print()
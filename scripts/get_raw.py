@@ -7,5 +7,5 @@ bsn = argv[1]
 response = get_voorzieningen(bsn)
 
 print("\n\n\nResponse.v2\n\n\n")
-print(json.dumps(response, indent=4))
+print(json.dumps([voorziening.to_dict() for voorziening in response], indent=4))
 print("\n\n\nend.Response.v2\n\n\n")
@@ -0,0 +1,17 @@
+import os
+import time
+from sys import argv
+
+from app.config import PROFILER_HEADER
+from app.profiler import create_profile_header
+
+# Usage: PROFILER_SECRET=... python -m scripts.profile_header /wmoned/voorzieningen [seconds valid]
+
+path = argv[1]
+seconds = int(argv[2]) if len(argv) > 2 else 300
+
+header = create_profile_header(
+    os.environ["PROFILER_SECRET"], path, int(time.time()) + seconds
+)
+
+print(f"{PROFILER_HEADER}: {header}")